@@ -0,0 +1,87 @@
+"""
+Measure the cold import time of fabtools.
+
+Each scenario is run in a fresh Python interpreter, several times, and
+the minimum and median times are reported (in milliseconds)::
+
+    $ python benchmarks/import_time.py --repeat 20
+
+The ``fabric.api`` scenario gives the baseline cost of importing Fabric
+itself, which fabtools cannot avoid. The ``all submodules`` scenario
+imports every module, as ``import fabtools`` used to do.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+SCENARIOS = [
+    ('fabric.api', 'import fabric.api'),
+    ('import fabtools', 'import fabtools'),
+    ('require.file', 'from fabtools import require; require.file'),
+    ('require.deb.packages',
+     'from fabtools import require; require.deb.packages'),
+    ('all submodules',
+     'import fabtools; '
+     '[getattr(fabtools, name) for name in fabtools._submodules]; '
+     '[getattr(fabtools.require, name) '
+     'for name in fabtools.require._submodules]'),
+]
+
+TIMER = """\
+import time
+start = time.time()
+%s
+print(time.time() - start)
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(statement, repeat, python):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    times = []
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [python, '-W', 'ignore', '-c', TIMER % statement],
+            env=env, cwd=ROOT)
+        times.append(float(output.decode().split()[-1]) * 1000)
+    times.sort()
+    return {'min': times[0], 'median': times[len(times) // 2]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python interpreter to use')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for name, statement in SCENARIOS:
+        res = measure(statement, args.repeat, args.python)
+        res['scenario'] = name
+        results.append(res)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+    width = max(len(res['scenario']) for res in results)
+    print('%s  %11s  %11s' % ('SCENARIO'.ljust(width), 'MIN (ms)',
+                              'MEDIAN (ms)'))
+    for res in results:
+        print('%s  %11.1f  %11.1f' % (res['scenario'].ljust(width),
+                                      res['min'], res['median']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,607 @@
+"""
+Measure the round trips made by the require functions.
+
+Each scenario is run against a simulated Debian host, reached through
+a fake transport (see :py:mod:`fabtools.transport`), so that no network
+or real system is involved. The simulated host keeps just enough state
+(files, packages, users...) to answer the commands made by fabtools.
+
+Each scenario is measured on a *fresh* host (where everything must be
+installed and configured), and on a *converged* host (where a previous
+run already did it). The number of remote commands, the number of file
+transfers, the bytes sent and received, and the local CPU time are
+reported::
+
+    $ python benchmarks/roundtrips.py
+
+The counts do not depend on timing, so they can be compared across
+commits to catch a change that adds round trips to a hot helper::
+
+    $ python benchmarks/roundtrips.py --json > before.json
+    $ git checkout my-branch
+    $ python benchmarks/roundtrips.py --compare before.json
+
+With ``--compare``, the command exits with a non-zero status if any
+scenario makes more commands or transfers than in the reference file.
+
+Commands that the simulated host does not know about succeed with no
+output. They are listed with ``--verbose``, as the simulation may need
+to be extended when fabtools starts using new commands.
+"""
+
+from __future__ import print_function
+
+from pipes import quote
+import argparse
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shlex
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fabric.api import hide, settings  # noqa: E402
+
+from fabtools import instrument, transport  # noqa: E402
+
+
+NGINX_TEMPLATE = """\
+server {
+    listen %(port)d;
+    server_name %(server_name)s;
+    root %(docroot)s;
+}
+"""
+
+
+def scenario_file():
+    from fabtools import require
+
+    require.file('/etc/motd', contents='Welcome\n', use_sudo=True,
+                 owner='root', mode='644')
+
+
+def scenario_deb_packages():
+    from fabtools import require
+
+    require.deb.packages(['curl', 'git', 'htop', 'rsync', 'vim'])
+
+
+def scenario_python_packages():
+    from fabtools import require
+
+    require.python.packages(['Flask', 'requests', 'gunicorn'], use_sudo=True)
+
+
+def scenario_nginx_site():
+    from fabtools import require
+
+    require.nginx.site('example.com', template_contents=NGINX_TEMPLATE,
+                       docroot='/var/www/example')
+
+
+def scenario_redis_instance():
+    from fabtools import require
+
+    require.redis.instance('cache', port=6380, save=[])
+
+
+def scenario_shorewall_firewall():
+    from fabtools import require
+    from fabtools.shorewall import HTTP, Ping, SSH
+
+    require.shorewall.firewall(rules=[Ping(), SSH(), HTTP()])
+
+
+SCENARIOS = [
+    ('require.file', scenario_file),
+    ('require.deb.packages', scenario_deb_packages),
+    ('require.python.packages', scenario_python_packages),
+    ('require.nginx.site', scenario_nginx_site),
+    ('require.redis.instance', scenario_redis_instance),
+    ('require.shorewall.firewall', scenario_shorewall_firewall),
+]
+
+
+# Files and directories created when installing a package
+PACKAGE_FILES = {
+    'nginx': {
+        '/etc/nginx/sites-available/': None,
+        '/etc/nginx/sites-enabled/': None,
+        '/usr/sbin/nginx': '',
+    },
+    'python3-pip': {
+        '/usr/bin/pip': '',
+    },
+    'shorewall': {
+        '/etc/shorewall/': None,
+        '/etc/default/shorewall': 'startup=0\n',
+    },
+    'supervisor': {
+        '/etc/supervisor/conf.d/': None,
+    },
+}
+
+FACTS = """\
+kernel=Linux
+kernel_release=6.1.0-13-amd64
+arch=x86_64
+lsb_id=Debian
+lsb_release=12
+lsb_codename=bookworm
+lsb_desc=Debian GNU/Linux 12 (bookworm)
+file:debian_version=1
+file:os-release=1
+os_release:ID=debian
+os_release:VERSION_ID="12"
+systemd=1
+"""
+
+HOME = '/home/alice'
+
+
+class SimulatedHost(object):
+    """
+    State of a simulated Debian host, and the commands it understands.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.dirs = set(['/', '/etc', '/etc/default', '/home', HOME, '/opt',
+                         '/root', '/tmp', '/usr', '/usr/bin', '/var',
+                         '/var/lib', '/var/log', '/var/run', '/var/www'])
+        self.owners = {}
+        self.modes = {}
+        self.packages = set(['python3', 'python3-setuptools'])
+        self.python_packages = {'pip': '23.0.1', 'setuptools': '66.1.1'}
+        self.users = set(['root', 'alice'])
+        self.sysctl = {'vm.overcommit_memory': '0'}
+        self.processes = set()
+        self.services = set(['ssh'])
+        self.unhandled = []
+
+    # Filesystem
+
+    def path(self, path, cwd):
+        return posixpath.normpath(posixpath.join(cwd, path))
+
+    def write(self, path, contents):
+        self.files[path] = contents
+        self.modes.setdefault(path, '644')
+        self.owners.setdefault(path, ('root', 'root'))
+        self.mkdir(posixpath.dirname(path))
+
+    def mkdir(self, path):
+        while path not in self.dirs:
+            self.dirs.add(path)
+            self.modes.setdefault(path, '755')
+            self.owners.setdefault(path, ('root', 'root'))
+            path = posixpath.dirname(path)
+
+    def stat_line(self, path):
+        if path in self.dirs:
+            kind, size = 'directory', 4096
+        elif path in self.files:
+            kind, size = 'file', len(self.files[path])
+        else:
+            return 'missing'
+        owner, group = self.owners.get(path, ('root', 'root'))
+        mode = self.modes.get(path, '755')
+        return '%s %s %s %s %d 1700000000' % (kind, owner, group, mode, size)
+
+    def install(self, packages):
+        for package in packages:
+            self.packages.add(package)
+            for path, contents in PACKAGE_FILES.get(package, {}).items():
+                if contents is None:
+                    self.mkdir(path.rstrip('/'))
+                elif path not in self.files:
+                    self.write(path, contents)
+
+    # Commands
+
+    def execute(self, command, stdin=None, cwd=HOME):
+        """
+        Run a shell command, and return its output and exit status
+        """
+        match = re.match(r'cd (\S+) >/dev/null && ', command)
+        if match:
+            cwd = self.path(match.group(1), cwd)
+            command = command[match.end():]
+        while command.startswith('export '):
+            command = command.partition(' && ')[2]
+        command = command.strip()
+
+        if 'fabtools-batch-' in command:
+            return self.batch(command, cwd)
+        for pattern, handler in self.HANDLERS:
+            match = re.search(pattern, command, re.DOTALL)
+            if match:
+                return handler(self, match, cwd, stdin)
+        self.unhandled.append(command)
+        return '', 0
+
+    def batch(self, script, cwd):
+        pattern = re.compile(
+            r"\((.*?)\)\nprintf '\\n(\S+) (\d+) %d\\n' \$\?", re.DOTALL)
+        lines = []
+        for command, marker, index in pattern.findall(script):
+            out, status = self.execute(command, cwd=cwd)
+            lines.append('%s\n%s %s %d' % (out, marker, index, status))
+        return '\n'.join(lines), 0
+
+    def facts(self, match, cwd, stdin):
+        return FACTS, 0
+
+    def checksum_tools(self, match, cwd, stdin):
+        return 'md5=/usr/bin/md5sum\nsha256=/usr/bin/sha256sum\nblake2b=\n', 0
+
+    def stat_many(self, match, cwd, stdin):
+        paths = [self.path(path, cwd) for path in shlex.split(match.group(1))]
+        return '\n'.join('fabtools:%d:%s' % (index, self.stat_line(path))
+                         for index, path in enumerate(paths)), 0
+
+    def sftp_stat(self, match, cwd, stdin):
+        path = self.path(match.group(1), cwd)
+        if path in self.dirs:
+            return '16 41ed', 0
+        if path in self.files:
+            return '16 81a4', 0
+        return '', 1
+
+    def checksums(self, match, cwd, stdin):
+        lines = []
+        for path in shlex.split(match.group(1)):
+            contents = self.files.get(self.path(path, cwd))
+            digest = contents is not None and _md5(contents) or ''
+            lines.append('fabtools:%s' % digest)
+        return '\n'.join(lines), 0
+
+    def checksum(self, match, cwd, stdin):
+        path = self.path(match.group(2), cwd)
+        if path not in self.files:
+            return '', 1
+        return '%s  %s' % (_md5(self.files[path]), path), 0
+
+    def pwd(self, match, cwd, stdin):
+        path = self.path(match.group(1), cwd)
+        return path, 0 if path in self.dirs else 1
+
+    def cat_to(self, match, cwd, stdin):
+        self.write(self.path(match.group(1), cwd), stdin or '')
+        return '', 0
+
+    def cat(self, match, cwd, stdin):
+        path = self.path(match.group(1), cwd)
+        if path not in self.files:
+            return '', 1
+        return self.files[path], 0
+
+    def move(self, match, cwd, stdin):
+        source = self.path(match.group(1), cwd)
+        target = self.path(match.group(2), cwd)
+        if target in self.dirs:
+            target = posixpath.join(target, posixpath.basename(source))
+        self.write(target, self.files.pop(source, ''))
+        return '', 0
+
+    def copy(self, match, cwd, stdin):
+        source = self.path(match.group(1), cwd)
+        target = self.path(match.group(2), cwd)
+        if target in self.dirs:
+            target = posixpath.join(target, posixpath.basename(source))
+        self.write(target, self.files.get(source, ''))
+        return '', 0
+
+    def chown(self, match, cwd, stdin):
+        owner, _, group = match.group(1).partition(':')
+        for path in shlex.split(match.group(2)):
+            path = self.path(path, cwd)
+            self.owners[path] = (owner, group or owner)
+        return '', 0
+
+    def chmod(self, match, cwd, stdin):
+        for path in shlex.split(match.group(2)):
+            self.modes[self.path(path, cwd)] = match.group(1).lstrip('0')
+        return '', 0
+
+    def mkdir_p(self, match, cwd, stdin):
+        for path in shlex.split(match.group(1)):
+            self.mkdir(self.path(path, cwd))
+        return '', 0
+
+    def test(self, match, cwd, stdin):
+        flag, path = match.group(1), self.path(match.group(2), cwd)
+        if flag == 'd':
+            found = path in self.dirs
+        elif flag == 'f':
+            found = path in self.files
+        elif flag == 'L':
+            found = path in self.files and self.files[path] is None
+        else:
+            found = path in self.dirs or path in self.files
+        return '', 0 if found else 1
+
+    def symlink(self, match, cwd, stdin):
+        self.files[self.path(match.group(2), cwd)] = None
+        return '', 0
+
+    def remove(self, match, cwd, stdin):
+        self.files.pop(self.path(match.group(1), cwd), None)
+        return '', 0
+
+    def dpkg_query(self, match, cwd, stdin):
+        return '\n'.join('%s\tamd64\tinstall ok installed\t1.0' % name
+                         for name in sorted(self.packages)), 0
+
+    def apt_install(self, match, cwd, stdin):
+        self.install(match.group(1).split())
+        return '', 0
+
+    def pip_version(self, match, cwd, stdin):
+        return 'pip %s from /usr/lib/python3/dist-packages/pip' % (
+            self.python_packages['pip']), 0
+
+    def python_version(self, match, cwd, stdin):
+        return self.python_packages.get(match.group(1), ''), 0
+
+    def pip_freeze(self, match, cwd, stdin):
+        return '\n'.join('%s==%s' % item for item in
+                         sorted(self.python_packages.items())), 0
+
+    def pip_install(self, match, cwd, stdin):
+        for name in match.group(1).split():
+            if not name.startswith('-'):
+                self.python_packages[name] = '1.0'
+        return '', 0
+
+    def user_entry(self, match, cwd, stdin):
+        name = match.group(1)
+        if name not in self.users:
+            return '', 2
+        return '%s:x:1001:1001::/var/lib/%s:/bin/sh' % (name, name), 0
+
+    def useradd(self, match, cwd, stdin):
+        self.users.add(match.group(1))
+        return '', 0
+
+    def sysctl_get(self, match, cwd, stdin):
+        return self.sysctl.get(match.group(1), ''), 0
+
+    def sysctl_set(self, match, cwd, stdin):
+        self.sysctl[match.group(1)] = match.group(2)
+        return '', 0
+
+    def supervisor_status(self, match, cwd, stdin):
+        name = match.group(1)
+        if name in self.processes:
+            return '%s   RUNNING   pid 1234, uptime 1:00:00' % name, 0
+        return '%s: ERROR (no such process)' % name, 0
+
+    def supervisor_update(self, match, cwd, stdin):
+        for path in self.files:
+            if path.startswith('/etc/supervisor/conf.d/'):
+                name = posixpath.basename(path).rpartition('.')[0]
+                self.processes.add(name)
+        return '', 0
+
+    def umask(self, match, cwd, stdin):
+        return '0022', 0
+
+    def service_status(self, match, cwd, stdin):
+        if match.group(1) not in self.services:
+            return 'Active: inactive (dead)', 3
+        return 'Active: active (running)', 0
+
+    def service(self, match, cwd, stdin):
+        name, action = match.group('name'), match.group('action')
+        if action == 'stop':
+            self.services.discard(name)
+        else:
+            self.services.add(name)
+        return '', 0
+
+    def download(self, match, cwd, stdin):
+        self.write(self.path(match.group(1), cwd), 'tarball')
+        return '', 0
+
+    def echo(self, match, cwd, stdin):
+        return match.group(1), 0
+
+    def uname(self, match, cwd, stdin):
+        return 'Linux', 0
+
+    def success(self, match, cwd, stdin):
+        return '', 0
+
+    def shorewall_status(self, match, cwd, stdin):
+        return 'Shorewall-5.2.8 Status at simulated\n\nShorewall is running', 0
+
+    def sed(self, match, cwd, stdin):
+        path = self.path(match.group(3).strip('"'), cwd)
+        if path in self.files:
+            self.files[path] = self.files[path].replace(match.group(1),
+                                                        match.group(2))
+        return '', 0
+
+    HANDLERS = [
+        (r'^echo "kernel=', facts),
+        (r'^_first\(\)', checksum_tools),
+        (r'_stat\(\).*\ni=0\nfor p in (.*?); do\n    if \[ -d', stat_many),
+        (r'echo 16 \$m; else m=\$\(stat (?:-L )?-f %p (.*)\) && echo 8', sftp_stat),
+        (r'^for f in (.*?); do set -- \$\(', checksums),
+        (r'^(/usr/bin/md5sum|/usr/bin/sha256sum) (.*)$', checksum),
+        (r'^cd (\S+) && pwd$', pwd),
+        (r'^cat > (.*)$', cat_to),
+        (r'^cat (\S+)$', cat),
+        (r'^mv -?f? ?"?([^" ]+)"? "?([^" ]+)"?$', move),
+        (r'^cp -pf (\S+) (\S+)$', copy),
+        (r'^chown (?:-R )?(\S+) (.*)$', chown),
+        (r'^chmod (?:-R )?(\d+) (.*)$', chmod),
+        (r'^mkdir -p (.*)$', mkdir_p),
+        (r'^test -(\w) "?([^"]+)"?$', test),
+        (r'^\[ -(\w) "?([^" ]+)"? \]$', test),
+        (r'^ln -s (\S+) (\S+)$', symlink),
+        (r'^rm (?:-f )?(\S+)$', remove),
+        (r'^dpkg-query -W -f=', dpkg_query),
+        (r'apt-get install --quiet --assume-yes (.*)$', apt_install),
+        (r'^(?:\S+/)?pip\S* --version', pip_version),
+        (r"get_distribution\('(\w+)'\)", python_version),
+        (r'pip\S* freeze', pip_freeze),
+        (r'pip\S* install (.*)$', pip_install),
+        (r'^getent passwd (\S+)', user_entry),
+        (r'^useradd .* (\S+)$', useradd),
+        (r'^/sbin/sysctl -n -e (\S+)', sysctl_get),
+        (r'^/sbin/sysctl -w (\S+)=(\S+)', sysctl_set),
+        (r'^supervisorctl status (\S+)', supervisor_status),
+        (r'^supervisorctl (?:reread|update)', supervisor_update),
+        (r'^systemctl status --no-pager (\S+)\.service$', service_status),
+        (r'^service (?P<name>\S+) (?P<action>\w+)$', service),
+        (r'^systemctl (?P<action>\w+) (?P<name>\S+)\.service$', service),
+        (r'^wget .* -O (\S+)$', download),
+        (r'^echo "([^"$]*)"$', echo),
+        (r'^uname$', uname),
+        (r'^(tar|make|nginx -t|usermod|supervisorctl restart)\b', success),
+        (r'^shorewall status$', shorewall_status),
+        (r'^umask$', umask),
+        (r"^sed -i\S* -r -e 's/(\w+=\w+)/(\w+=\w+)/g' \"\$\(echo (\S+)\)\"$", sed),
+    ]
+
+
+def _md5(contents):
+    return hashlib.md5(contents).hexdigest()
+
+
+class SimulatedTransport(transport.ShellTransport):
+    """
+    Transport answering commands from a :py:class:`SimulatedHost`.
+    """
+
+    host_string = 'simulated'
+
+    def __init__(self, host):
+        super(SimulatedTransport, self).__init__('/bin/sh -c')
+        self.host = host
+
+    def argv(self, command, sudo=False, user=None, group=None):
+        return self.shell_argv() + [command]
+
+    def execute(self, command, sudo=False, user=None, group=None,
+                stdin=None, combine_stderr=False):
+        out, status = self.host.execute(command, stdin)
+        return out, '', status
+
+
+def run_scenario(func, host):
+    """
+    Run a scenario on a simulated host, and return its measures
+    """
+    from fabtools.utils import _HOST_CACHES
+
+    # Forget what previous runs learned about the host
+    for cache in _HOST_CACHES:
+        cache.clear()
+    del host.unhandled[:]
+
+    with settings(hide('everything'), user='alice', abort_exception=None):
+        with transport.use(SimulatedTransport(host)):
+            with instrument.recording() as recorder:
+                start = time.clock()
+                func()
+                cpu = time.clock() - start
+
+    commands = [r for r in recorder.records if r['kind'] in ('run', 'sudo')]
+    transfers = [r for r in recorder.records if r['kind'] in ('put', 'get')]
+    return {
+        'commands': len(commands),
+        'transfers': len(transfers),
+        'sent': sum(r['sent'] for r in recorder.records),
+        'received': sum(r['received'] for r in recorder.records),
+        'cpu_ms': cpu * 1000,
+        'unhandled': list(host.unhandled),
+    }
+
+
+def measure(name, func, repeat):
+    results = []
+    for state in ('fresh', 'converged'):
+        best = None
+        for _ in range(repeat):
+            host = SimulatedHost()
+            if state == 'converged':
+                run_scenario(func, host)
+            res = run_scenario(func, host)
+            if best is None or res['cpu_ms'] < best['cpu_ms']:
+                best = res
+        best.update(scenario=name, state=state)
+        results.append(best)
+    return results
+
+
+def compare(results, reference):
+    """
+    Print the scenarios making more round trips than in the reference
+    results, and return their number
+    """
+    previous = dict(((res['scenario'], res['state']), res) for res in reference)
+    regressions = 0
+    for res in results:
+        old = previous.get((res['scenario'], res['state']))
+        if old is None:
+            continue
+        for key in ('commands', 'transfers'):
+            if res[key] > old[key]:
+                regressions += 1
+                print('REGRESSION: %s (%s): %d %s instead of %d' % (
+                    res['scenario'], res['state'], res[key], key, old[key]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of runs (the lowest CPU time is kept)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with results saved with --json')
+    parser.add_argument('--verbose', action='store_true',
+                        help='list the commands unknown to the simulation')
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help='scenarios to run (all by default)')
+    args = parser.parse_args()
+
+    results = []
+    for name, func in SCENARIOS:
+        if not args.scenarios or name in args.scenarios:
+            results.extend(measure(name, func, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    width = max(len(res['scenario']) for res in results)
+    print('%s  %-9s  %8s  %9s  %8s  %8s  %8s' % (
+        'SCENARIO'.ljust(width), 'HOST', 'COMMANDS', 'TRANSFERS', 'SENT',
+        'RECEIVED', 'CPU (ms)'))
+    for res in results:
+        print('%s  %-9s  %8d  %9d  %8d  %8d  %8.1f' % (
+            res['scenario'].ljust(width), res['state'], res['commands'],
+            res['transfers'], res['sent'], res['received'], res['cpu_ms']))
+        if args.verbose:
+            for command in res['unhandled']:
+                print('    unknown command: %s' % quote(command)[:200])
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        if compare(results, reference):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
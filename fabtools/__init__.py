@@ -1,33 +1,48 @@
-# Keep imports sorted alphabetically
-import fabtools.arch
-import fabtools.conda
-import fabtools.cron
-import fabtools.deb
-import fabtools.disk
-import fabtools.files
-import fabtools.git
-import fabtools.group
-import fabtools.mercurial
-import fabtools.mysql
-import fabtools.network
-import fabtools.nginx
-import fabtools.nodejs
-import fabtools.openvz
-import fabtools.opkg
-import fabtools.oracle_jdk
-import fabtools.pkg
-import fabtools.portage
-import fabtools.postgres
-import fabtools.python
-import fabtools.python_setuptools
-import fabtools.rpm
-import fabtools.service
-import fabtools.shorewall
-import fabtools.ssh
-import fabtools.supervisor
-import fabtools.system
-import fabtools.tomcat
-import fabtools.user
+# Submodules are imported lazily, when they are first accessed
+# (keep them sorted alphabetically)
+from fabtools.utils import lazy_package
 
-import fabtools.require
-icanhaz = require
+lazy_package(__name__, [
+    'agent',
+    'apache',
+    'arch',
+    'checks',
+    'conda',
+    'cron',
+    'deb',
+    'disk',
+    'executor',
+    'files',
+    'git',
+    'group',
+    'gvm',
+    'instrument',
+    'mercurial',
+    'mysql',
+    'network',
+    'nginx',
+    'nodejs',
+    'openvz',
+    'opkg',
+    'oracle_jdk',
+    'pkg',
+    'portage',
+    'postgres',
+    'python',
+    'python_setuptools',
+    'require',
+    'rpm',
+    'service',
+    'shorewall',
+    'ssh',
+    'supervisor',
+    'system',
+    'systemd',
+    'tomcat',
+    'transport',
+    'user',
+    'vagrant',
+], {
+    'batch': ('fabtools.checks', 'batch'),
+    'icanhaz': ('fabtools.require', None),
+})
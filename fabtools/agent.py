@@ -0,0 +1,416 @@
+"""
+Remote helper agent
+===================
+
+This module provides an optional helper agent, that answers the
+queries made by fabtools (file attributes, checksums, package state,
+user lookups, service state) using structured data, instead of parsing
+the output of shell commands.
+
+The agent is a small self-contained Python script. It is uploaded to
+the remote host the first time it is needed, then started once per
+host. It keeps running on a single SSH channel for the rest of the
+session, and each query costs a single JSON message in each direction.
+
+To enable it, set ``env.fabtools_agent`` to ``True``::
+
+    from fabric.api import env
+
+    env.fabtools_agent = True
+
+The functions routed through the agent are:
+
+- :py:func:`fabtools.files.is_file`, :py:func:`~fabtools.files.is_dir`,
+  :py:func:`~fabtools.files.is_link`, :py:func:`~fabtools.files.owner`,
+  :py:func:`~fabtools.files.group`, :py:func:`~fabtools.files.mode`,
+  :py:func:`~fabtools.files.stat_many`,
+  :py:func:`~fabtools.files.checksum` and
+  :py:func:`~fabtools.files.checksums`
+- :py:func:`fabtools.deb.installed_packages`
+- :py:func:`fabtools.user.exists` and
+  :py:func:`fabtools.user.home_directory`
+- :py:func:`fabtools.service.is_running`
+
+If the agent cannot be started (for instance because Python is not
+available on the remote host, or because ``sudo`` requires a password),
+these functions silently fall back to using shell commands.
+
+.. note:: Queries made as root use a second agent, started with
+          ``sudo -n`` (non-interactive).
+
+"""
+
+from StringIO import StringIO
+from hashlib import sha1
+from pipes import quote
+import json
+import posixpath
+import socket
+import time
+
+from fabric.api import hide, put, settings
+
+from fabtools import instrument, transport
+from fabtools.utils import host_key
+
+
+AGENT_SCRIPT = r'''
+import grp
+import hashlib
+import json
+import os
+import pwd
+import stat
+import subprocess
+import sys
+
+
+def _name(func, id_):
+    try:
+        return func(id_)[0]
+    except KeyError:
+        return str(id_)
+
+
+def _type(mode):
+    if stat.S_ISDIR(mode):
+        return 'directory'
+    elif stat.S_ISREG(mode):
+        return 'file'
+    elif stat.S_ISLNK(mode):
+        return 'link'
+    return 'other'
+
+
+def _run(args):
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate()[0].decode('utf-8', 'replace')
+    return proc.returncode, output
+
+
+def op_stat(req):
+    func = os.stat if req.get('follow', True) else os.lstat
+    result = {}
+    for path in req['paths']:
+        try:
+            st = func(os.path.expanduser(path))
+        except OSError:
+            result[path] = None
+            continue
+        result[path] = {
+            'type': _type(st.st_mode),
+            'owner': _name(pwd.getpwuid, st.st_uid),
+            'group': _name(grp.getgrgid, st.st_gid),
+            'mode': '%o' % stat.S_IMODE(st.st_mode),
+            'size': st.st_size,
+            'mtime': int(st.st_mtime),
+        }
+    return result
+
+
+def op_hash(req):
+    result = {}
+    for path in req['paths']:
+        digest = hashlib.new(req['algorithm'])
+        try:
+            f = open(os.path.expanduser(path), 'rb')
+        except (IOError, OSError):
+            result[path] = None
+            continue
+        try:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        finally:
+            f.close()
+        result[path] = digest.hexdigest()
+    return result
+
+
+def op_user(req):
+    try:
+        entry = pwd.getpwnam(req['name'])
+    except KeyError:
+        return {'exists': False}
+    return {
+        'exists': True,
+        'uid': entry.pw_uid,
+        'gid': entry.pw_gid,
+        'home': entry.pw_dir,
+        'shell': entry.pw_shell,
+    }
+
+
+def op_packages(req):
+    if req['manager'] != 'dpkg':
+        raise ValueError('unsupported package manager: %s' % req['manager'])
+    names = req.get('names')
+    if names is None:
+        # List all the installed packages
+        status, output = _run(['dpkg-query', '-W', '-f',
+                               '${Package}\t${Architecture}\t${Status}\t'
+                               '${Version}\n'])
+        result = {}
+        for line in output.splitlines():
+            fields = line.split('\t')
+            if len(fields) == 4 and 'installed' in fields[2].split():
+                info = {'installed': True, 'version': fields[3]}
+                result[fields[0]] = info
+                result['%s:%s' % (fields[0], fields[1])] = info
+        return result
+    result = {}
+    for name in names:
+        status, output = _run(['dpkg-query', '-W', '-f',
+                               '${Status}\t${Version}', name])
+        words, _, version = output.partition('\t')
+        installed = status == 0 and 'installed' in words.split()
+        result[name] = {
+            'installed': installed,
+            'version': installed and version.strip() or None,
+        }
+    return result
+
+
+def op_service(req):
+    name = req['name']
+    if req.get('systemd'):
+        status, output = _run(['systemctl', 'status', '--no-pager',
+                               '%s.service' % name])
+        return {'running': status == 0}
+    if req.get('gentoo'):
+        status, output = _run(['/etc/init.d/%s' % name, 'status'])
+        return {'running': ' started' in output}
+    status, output = _run(['service', name, 'status'])
+    if os.path.isfile('/etc/init/%s.conf' % name):
+        # upstart
+        return {'running': 'running' in output}
+    return {'running': status == 0}
+
+
+OPS = {
+    'stat': op_stat,
+    'hash': op_hash,
+    'user': op_user,
+    'packages': op_packages,
+    'service': op_service,
+}
+
+
+def _write(response):
+    sys.stdout.write(json.dumps(response) + '\n')
+    sys.stdout.flush()
+
+
+def main():
+    _write({'ready': True})
+    for line in iter(sys.stdin.readline, ''):
+        try:
+            req = json.loads(line)
+            _write({'id': req.get('id'), 'result': OPS[req['op']](req)})
+        except Exception:
+            error = sys.exc_info()[1]
+            _write({'error': '%s: %s' % (type(error).__name__, error)})
+
+
+main()
+'''
+
+AGENT_VERSION = sha1(AGENT_SCRIPT).hexdigest()[:12]
+
+# Shell command starting the agent (or reporting where to upload it)
+LAUNCH_COMMAND = """\
+f="$HOME/.fabtools-agent-%(version)s.py"
+if [ ! -f "$f" ]; then printf '{"missing": "%%s"}\\n' "$f"; exit 0; fi
+py=$(command -v python3 || command -v python)
+if [ -z "$py" ]; then echo '{"error": "python not found"}'; exit 0; fi
+exec %(sudo)s"$py" -u "$f"
+"""
+
+# Running agents, indexed by (host key, as_root)
+# (``None`` means that the agent is unavailable on this host)
+_AGENTS = {}
+
+
+class AgentError(Exception):
+    pass
+
+
+class Agent(object):
+    """
+    Client side of a running agent.
+    """
+
+    def __init__(self, channel, stdin, stdout):
+        self.channel = channel
+        self.stdin = stdin
+        self.stdout = stdout
+        self.last_id = 0
+
+    def request(self, op, **params):
+        """
+        Send a query to the agent, and return its result.
+
+        Raises :py:class:`AgentError` if the query failed, and
+        ``IOError`` or ``socket.error`` if the channel is broken.
+        """
+        self.last_id += 1
+        params.update(op=op, id=self.last_id)
+        message = json.dumps(params) + '\n'
+        start = time.time()
+        self.stdin.write(message)
+        self.stdin.flush()
+        line = self.stdout.readline()
+        instrument.record('agent', op, time.time() - start, len(message),
+                          len(line))
+        if not line:
+            raise IOError('agent channel closed')
+        response = json.loads(line)
+        if 'error' in response:
+            raise AgentError(response['error'])
+        if response.get('id') != self.last_id:
+            raise IOError('unexpected agent response: %s' % line)
+        return response['result']
+
+    def close(self):
+        self.channel.close()
+
+
+def enabled():
+    """
+    Check if the agent should be used for the current host.
+
+    This is ``env.fabtools_agent``, except inside OpenVZ guest
+    containers, where commands are run using ``vzctl exec``, and when
+    another transport than SSH is used (see :py:mod:`fabtools.transport`).
+    """
+    from fabric.state import env
+
+    return (bool(env.get('fabtools_agent')) and
+            not env.get('fabtools_guest') and
+            isinstance(transport.current(), transport.SSHTransport))
+
+
+def query(op, use_sudo=False, **params):
+    """
+    Send a query to the agent for the current host.
+
+    The agent is started the first time it is needed. If *use_sudo* is
+    ``True``, the query is run as root.
+
+    Relative paths in the *paths* parameter are resolved against the
+    current ``cd()`` context.
+
+    Returns the result of the query, or ``None`` if the agent is not
+    enabled or not available (in which case the caller should fall back
+    to using a shell command).
+    """
+    from fabric.state import env
+
+    if not enabled():
+        return None
+
+    as_root = bool(use_sudo) and env.user != 'root'
+    key = (host_key(), as_root)
+    if key not in _AGENTS:
+        _AGENTS[key] = _start(as_root)
+    agent = _AGENTS[key]
+    if agent is None:
+        return None
+
+    paths = None
+    if 'paths' in params:
+        paths = list(params['paths'])
+        params['paths'] = [_absolute(path) for path in paths]
+
+    try:
+        result = agent.request(op, **params)
+    except AgentError:
+        # The query itself failed: use the shell command instead
+        return None
+    except (IOError, ValueError, socket.error):
+        # The channel is broken: stop using the agent on this host
+        agent.close()
+        _AGENTS[key] = None
+        return None
+
+    if paths is not None:
+        result = dict(
+            (path, result[absolute])
+            for path, absolute in zip(paths, params['paths'])
+        )
+    return result
+
+
+def stop(all_hosts=False):
+    """
+    Stop the agents running on the current host (or on all hosts).
+    """
+    keys = list(_AGENTS) if all_hosts else [
+        key for key in _AGENTS if key[0] == host_key()
+    ]
+    for key in keys:
+        agent = _AGENTS.pop(key)
+        if agent is not None:
+            agent.close()
+
+
+def _absolute(path):
+    from fabric.state import env
+
+    if env.cwd and not posixpath.isabs(path):
+        return posixpath.join(env.cwd, path)
+    return path
+
+
+def _start(as_root):
+    """
+    Start the agent, uploading it first if needed
+    """
+    for attempt in range(2):
+        agent, hello = _launch(as_root)
+        if agent is not None:
+            return agent
+        if 'missing' in hello and attempt == 0:
+            with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                          warn_only=True):
+                res = put(StringIO(AGENT_SCRIPT), hello['missing'],
+                          mode=0644)
+            if not res.succeeded:
+                return None
+        else:
+            return None
+
+
+def _launch(as_root):
+    """
+    Run the agent on a new SSH channel, and wait until it is ready
+    """
+    from fabric.state import connections, env
+
+    command = LAUNCH_COMMAND % {
+        'version': AGENT_VERSION,
+        'sudo': as_root and 'sudo -n ' or '',
+    }
+    try:
+        channel = connections[env.host_string].get_transport().open_session()
+        channel.settimeout(env.get('fabtools_agent_timeout', 60))
+        channel.exec_command('/bin/sh -c %s' % quote(command))
+        stdin = channel.makefile('wb')
+        stdout = channel.makefile('r')
+
+        # Skip any unexpected output (such as login banners)
+        for line in iter(stdout.readline, ''):
+            try:
+                hello = json.loads(line)
+            except ValueError:
+                continue
+            if hello.get('ready'):
+                return Agent(channel, stdin, stdout), hello
+            break
+        else:
+            hello = {}
+    except (IOError, socket.error):
+        return None, {}
+
+    channel.close()
+    return None, hello
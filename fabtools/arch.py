@@ -9,7 +9,13 @@ and repositories.
 
 from fabric.api import hide, run, settings
 
-from fabtools.utils import run_as_root
+from fabtools.utils import PackageSnapshot, run_as_root
+
+
+PACKAGES_QUERY = 'pacman -Q'
+
+# Touched after each successful index update
+UPDATE_STAMP = '/var/lib/fabtools/pacman-update-success-stamp'
 
 
 def pkg_manager():
@@ -30,13 +36,16 @@ def update_index(quiet=True):
     """
 
     manager = pkg_manager()
+    stamp = UPDATE_STAMP
+    cmd = ('%(manager)s -Sy && mkdir -p /var/lib/fabtools && '
+           'touch %(stamp)s' % locals())
     if quiet:
         with settings(
                 hide('running', 'stdout', 'stderr', 'warnings'),
                 warn_only=True):
-            run_as_root("%(manager)s -Sy" % locals())
+            run_as_root(cmd)
     else:
-        run_as_root("%(manager)s -Sy" % locals())
+        run_as_root(cmd)
 
 
 def upgrade():
@@ -45,17 +54,53 @@ def upgrade():
     """
     manager = pkg_manager()
     run_as_root("%(manager)s -Su" % locals(), pty=False)
+    invalidate_installed_packages()
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed Arch Linux packages and their versions.
+
+    All the packages are listed using a single ``pacman -Q`` command, the
+    first time they are needed for a given host. The snapshot is then
+    kept in memory, and updated by :py:func:`install` and
+    :py:func:`uninstall` (see :py:func:`invalidate_installed_packages`
+    if packages are managed by other means).
+
+    Returns a dict mapping package names to versions. It should not be
+    modified.
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be listed again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 2:
+            installed[fields[0]] = fields[1]
+    return installed
+
+
+_SNAPSHOT = PackageSnapshot(PACKAGES_QUERY, _parse_installed)
 
 
 def is_installed(pkg_name):
     """
     Check if an Arch Linux package is installed.
-    """
 
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run("pacman -Q %(pkg_name)s" % locals())
-        return res.succeeded
+    This uses the snapshot of installed packages of the current host
+    (see :py:func:`installed_packages`).
+    """
+    return _SNAPSHOT.is_installed(pkg_name)
 
 
 def install(packages, update=False, options=None):
@@ -90,7 +135,7 @@ def install(packages, update=False, options=None):
         packages = " ".join(packages)
     options = " ".join(options)
     cmd = '%(manager)s -S %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, True, run_as_root, cmd, pty=False)
 
 
 def uninstall(packages, options=None):
@@ -106,4 +151,4 @@ def uninstall(packages, options=None):
         packages = " ".join(packages)
     options = " ".join(options)
     cmd = '%(manager)s -R %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, False, run_as_root, cmd, pty=False)
@@ -0,0 +1,273 @@
+"""
+Batched checks
+==============
+
+This module provides a context manager to group the read-only checks
+made by fabtools (``is_file``, ``is_installed``, ``exists``...), so
+that they are sent to the remote host as a single script, instead of
+using one remote command each.
+
+"""
+
+import re
+import uuid
+
+from fabric.api import hide, run, settings
+from fabric.operations import (
+    _AttributeString,
+    _prefix_commands,
+    _prefix_env_vars,
+)
+import fabric.operations
+import fabric.sftp
+
+from fabtools import instrument
+from fabtools.utils import host_key, run_as_root
+
+
+# Stack of the active batches
+_BATCHES = []
+
+
+class batch(object):
+    """
+    Context manager to group read-only checks.
+
+    Inside the block, the checks made on the current host are not run
+    immediately. Instead, they return a :py:class:`Probe` object, which
+    behaves like the result of the check when it is used. All the pending
+    checks are then run using a single remote command, either:
+
+    - when the result of one of them is needed,
+    - before any other remote command is run (so that write actions
+      are always done *after* the checks that were made before them),
+    - at the end of the block.
+
+    To get the benefit of batching, make all the checks first, then use
+    their results::
+
+        import fabtools
+        from fabtools.files import is_file
+
+        with fabtools.batch():
+            has_user = fabtools.user.exists('alice')
+            has_group = fabtools.group.exists('staff')
+            has_config = is_file('/etc/foo.conf')
+
+            # Runs the 3 checks using a single remote command
+            if not has_user:
+                fabtools.user.create('alice')
+
+    .. note:: Use a probe in a boolean context, or call its ``result()``
+              method, to get the actual result of the check.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def __enter__(self):
+        from fabric.state import env
+
+        self.host = host_key()
+        self.host_string = env.host_string
+
+        # Wrap the transport layer and the instrumentation, rather than
+        # be wrapped by them (so that they stay in place when the block ends)
+        instrument._install()
+
+        # Run the pending checks before any other remote operation
+        self._orig_run_command = fabric.operations._run_command
+        self._orig_put = fabric.sftp.SFTP.put
+        self._orig_put_dir = fabric.sftp.SFTP.put_dir
+
+        def run_command(*args, **kwargs):
+            self.flush()
+            return self._orig_run_command(*args, **kwargs)
+
+        def put(sftp, *args, **kwargs):
+            self.flush()
+            return self._orig_put(sftp, *args, **kwargs)
+
+        def put_dir(sftp, *args, **kwargs):
+            self.flush()
+            return self._orig_put_dir(sftp, *args, **kwargs)
+
+        fabric.operations._run_command = run_command
+        fabric.sftp.SFTP.put = put
+        fabric.sftp.SFTP.put_dir = put_dir
+        _BATCHES.append(self)
+        return self
+
+    def __exit__(self, type, value, tb):
+        try:
+            if type is None:
+                self.flush()
+        finally:
+            _BATCHES.remove(self)
+            fabric.operations._run_command = self._orig_run_command
+            fabric.sftp.SFTP.put = self._orig_put
+            fabric.sftp.SFTP.put_dir = self._orig_put_dir
+
+    def add(self, command, parse, use_sudo):
+        """
+        Queue a check, and return the corresponding :py:class:`Probe`.
+        """
+        # Apply the current cd(), prefix() and path() contexts now,
+        # as the check may be run from another context
+        command = _prefix_env_vars(_prefix_commands(command, 'remote'))
+        probe = Probe(self, command, parse, use_sudo)
+        self.pending.append(probe)
+        return probe
+
+    def flush(self):
+        """
+        Run all the pending checks.
+
+        The checks are run using one remote command for the checks made
+        as the current user, and another one for those made as root.
+        """
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        for use_sudo in (False, True):
+            probes = [probe for probe in pending if probe.use_sudo == use_sudo]
+            if probes:
+                self._run(probes, use_sudo)
+
+    def _run(self, probes, use_sudo):
+        marker = 'fabtools-batch-%s' % uuid.uuid4().hex
+        script = '\n'.join(
+            "(%s)\nprintf '\\n%s %d %%d\\n' $?" % (probe.command, marker, index)
+            for index, probe in enumerate(probes)
+        )
+
+        func = use_sudo and run_as_root or run
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True, host_string=self.host_string,
+                      cwd='', command_prefixes=[], path='', shell_env={}):
+            res = func(script)
+
+        results = _parse_output(res, marker)
+        for index, probe in enumerate(probes):
+            if index in results:
+                output, status = results[index]
+            else:
+                output, status = res, -1
+            probe.resolve(_result(output, status, probe.command))
+
+
+def _parse_output(output, marker):
+    """
+    Split the output of a batch script into (output, status) per check
+    """
+    results = {}
+    lines = []
+    pattern = re.compile(r'^%s (\d+) (\d+)$' % marker)
+    for line in output.splitlines():
+        m = pattern.match(line)
+        if m is None:
+            lines.append(line)
+            continue
+        # Remove the newline added before the marker
+        if lines and lines[-1] == '':
+            lines.pop()
+        results[int(m.group(1))] = ('\n'.join(lines), int(m.group(2)))
+        lines = []
+    return results
+
+
+def _result(output, status, command):
+    """
+    Build an object similar to the result of Fabric's ``run()``
+    """
+    res = _AttributeString(output)
+    res.command = command
+    res.return_code = status
+    res.succeeded = (status == 0)
+    res.failed = not res.succeeded
+    res.stderr = ''
+    return res
+
+
+class Probe(object):
+    """
+    Deferred result of a check queued in a :py:class:`batch`.
+    """
+
+    def __init__(self, batch, command, parse, use_sudo):
+        self.batch = batch
+        self.command = command
+        self.parse = parse
+        self.use_sudo = use_sudo
+        self.done = False
+        self.value = None
+
+    def resolve(self, res):
+        self.value = self.parse(res)
+        self.done = True
+
+    def result(self):
+        """
+        Get the result of the check (running the pending checks if needed).
+        """
+        if not self.done:
+            self.batch.flush()
+        return self.value
+
+    def __nonzero__(self):
+        return bool(self.result())
+
+    __bool__ = __nonzero__
+
+    def __eq__(self, other):
+        return self.result() == other
+
+    def __ne__(self, other):
+        return self.result() != other
+
+    def __repr__(self):
+        if self.done:
+            return '<Probe %r: %r>' % (self.command, self.value)
+        return '<Probe %r: pending>' % self.command
+
+
+def _current_batch():
+    if _BATCHES and _BATCHES[-1].host == host_key():
+        return _BATCHES[-1]
+    return None
+
+
+def check(command, parse=None, use_sudo=False):
+    """
+    Run a read-only check on the remote host.
+
+    This returns ``parse(result)``, where *result* is the result of
+    running *command* (by default, whether the command succeeded).
+    The command should have no side effects.
+
+    Inside a :py:class:`batch` block, the command is not run immediately:
+    it is queued, and a :py:class:`Probe` is returned instead.
+
+    Example::
+
+        from fabtools.checks import check
+
+        def is_mounted(path):
+            return check('mountpoint -q %s' % path)
+
+    """
+    if parse is None:
+        parse = _succeeded
+    current = _current_batch()
+    if current is not None:
+        return current.add(command, parse, use_sudo)
+
+    func = use_sudo and run_as_root or run
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = func(command)
+    return parse(res)
+
+
+def _succeeded(res):
+    return res.succeeded
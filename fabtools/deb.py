@@ -7,15 +7,58 @@ and repositories.
 
 """
 
-from hashlib import md5
+from StringIO import StringIO
+from collections import OrderedDict
+from hashlib import md5, sha256
+from pipes import quote
+from urllib import unquote
+import json
+import os
+import posixpath
+
+from fabric.api import get, hide, put, run, settings
+from fabric.utils import abort, puts
+import fabric.operations
+import fabric.sftp
+
+from fabtools import agent, instrument
+from fabtools.utils import PackageSnapshot, host_cache, host_key, run_as_root
+from fabtools.files import (
+    checksums,
+    copy,
+    getmtime,
+    is_file,
+    remove,
+)
 
-from fabric.api import hide, run, settings
 
-from fabtools.utils import run_as_root
-from fabtools.files import getmtime, is_file, is_dir, copy, remove
+MANAGER = 'DEBIAN_FRONTEND=noninteractive apt-get'
 
+# Use eatmydata (if available) to disable fsync() in fast mode
+FAST_MANAGER = 'DEBIAN_FRONTEND=noninteractive $(command -v eatmydata) apt-get'
 
-MANAGER = 'DEBIAN_FRONTEND=noninteractive apt-get'
+# Extra apt-get options used in fast mode
+FAST_OPTIONS = [
+    '--no-install-recommends',
+    '-o Dpkg::Options::=--force-unsafe-io',
+    "-o 'Dpkg::Options::=--path-exclude=/usr/share/doc/*'",
+    "-o 'Dpkg::Options::=--path-exclude=/usr/share/man/*'",
+    "-o 'Dpkg::Options::=--path-exclude=/usr/share/info/*'",
+    '-o Acquire::Queue-Mode=host',
+    '-o Acquire::http::Pipeline-Depth=10',
+    '-o Acquire::Retries=3',
+]
+
+# Touched by APT after each successful index update
+UPDATE_STAMP = '/var/lib/apt/periodic/fabtools-update-success-stamp'
+
+PACKAGES_QUERY = (
+    "dpkg-query -W -f='${Package}\\t${Architecture}\\t${Status}\\t"
+    "${Version}\\n'"
+)
+
+# Stack of the active transactions
+_TRANSACTIONS = []
 
 
 def update_index(quiet=True):
@@ -26,34 +69,324 @@ def update_index(quiet=True):
     run_as_root("%s %s update" % (MANAGER, options))
 
 
-def upgrade(safe=True):
+def upgrade(safe=True, from_cache=False):
     """
     Upgrade all packages.
+
+    If *safe* is ``False``, packages may be installed or removed to
+    satisfy the new dependencies (using ``dist-upgrade``).
+
+    If *from_cache* is ``True``, the packages are only installed from
+    the local archive cache, as downloaded beforehand by
+    :py:func:`prefetch_upgrade` (the upgrade fails if a package is
+    missing from the cache, instead of downloading it).
     """
     manager = MANAGER
     if safe:
         cmd = 'upgrade'
     else:
         cmd = 'dist-upgrade'
-    run_as_root("%(manager)s --assume-yes %(cmd)s" % locals(), pty=False)
+    options = '--assume-yes'
+    if from_cache:
+        options += ' --no-download'
+    try:
+        run_as_root("%(manager)s %(options)s %(cmd)s" % locals(), pty=False)
+    finally:
+        invalidate_installed_packages()
+
+
+def prefetch_upgrade(safe=True):
+    """
+    Download the packages needed to upgrade all packages, without
+    installing them.
+
+    This is the first phase of a two-phase upgrade: the packages are
+    downloaded to the local archive cache ahead of time, then installed
+    later (for instance during a maintenance window) using
+    ``upgrade(from_cache=True)``, which does not depend on the speed of
+    the mirrors. Use the same *safe* value for both phases.
+
+    The packages to download are listed, then downloaded, using a single
+    remote command.
+
+    Returns a list of dicts (with the ``name``, ``version``, ``arch``
+    and ``size`` of each downloaded package, in bytes). Packages already
+    in the cache are not listed.
+
+    Example::
+
+        from fabtools import deb
+        from fabtools.executor import run_on_hosts
+
+        # Ahead of time
+        results = run_on_hosts(deb.prefetch_upgrade, hosts)
+        for host, res in results.items():
+            if res.succeeded:
+                size = sum(pkg['size'] for pkg in res.result)
+                print("%s: %d bytes" % (host, size))
+
+        # During the maintenance window
+        run_on_hosts(deb.upgrade, hosts, kwargs={'from_cache': True})
+
+    """
+    cmd = 'upgrade' if safe else 'dist-upgrade'
+    with settings(hide('stdout')):
+        res = run_as_root(
+            '%(manager)s --assume-yes --print-uris --quiet --quiet %(cmd)s && '
+            '%(manager)s --assume-yes --download-only --quiet --quiet %(cmd)s'
+            % {'manager': MANAGER, 'cmd': cmd}, pty=False)
+    packages = _parse_uris(res)
+    puts('Downloaded %d packages (%d bytes)' % (
+        len(packages), sum(pkg['size'] for pkg in packages)))
+    return packages
+
+
+def _parse_uris(output):
+    """
+    Parse the output of ``apt-get --print-uris``::
+
+        'http://deb.debian.org/.../curl_7.88.1-10_amd64.deb' curl_7.88.1-10_amd64.deb 315704 SHA256:...
+    """
+    packages = []
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) < 3 or not parts[0].startswith("'"):
+            continue
+        filename = unquote(parts[1])
+        if not filename.endswith('.deb') or filename.count('_') != 2:
+            continue
+        name, version, arch = filename[:-len('.deb')].split('_')
+        packages.append({
+            'name': name,
+            'version': version,
+            'arch': arch,
+            'size': int(parts[2]),
+        })
+    return packages
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed packages and their versions.
+
+    All the packages are listed using a single ``dpkg-query`` command,
+    the first time they are needed for a given host. The snapshot is
+    then kept in memory, and updated by :py:func:`install` and
+    :py:func:`uninstall` (see :py:func:`invalidate_installed_packages`
+    if packages are managed by other means).
+
+    Returns a dict mapping package names (both plain and qualified with
+    the architecture, such as ``libc6:amd64``) to versions. It should
+    not be modified.
+
+    Example::
+
+        from fabtools.deb import installed_packages
+
+        print(installed_packages().get('nginx'))
+        # 1.22.1-9
+
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be listed again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 4:
+            continue
+        name, arch, status, version = fields
+        if 'installed' in status.split(' '):
+            installed[name] = version
+            installed['%s:%s' % (name, arch)] = version
+    return installed
+
+
+class _Snapshot(PackageSnapshot):
+
+    def load(self):
+        packages = agent.query('packages', manager='dpkg')
+        if packages is not None:
+            return dict((name, info['version'])
+                        for name, info in packages.items())
+        return super(_Snapshot, self).load()
+
+    def record(self, packages, installed):
+        if isinstance(packages, basestring):
+            packages = packages.split()
+        # Strip the version pins ("nginx=1.22.1-9")
+        packages = [pkg_name.partition('=')[0] for pkg_name in packages]
+        super(_Snapshot, self).record(packages, installed)
+
+
+_SNAPSHOT = _Snapshot(PACKAGES_QUERY, _parse_installed)
 
 
 def is_installed(pkg_name):
     """
     Check if a package is installed.
+
+    This uses the snapshot of installed packages of the current host
+    (see :py:func:`installed_packages`).
     """
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run("dpkg -s %(pkg_name)s" % locals())
-        for line in res.splitlines():
-            if line.startswith("Status: "):
-                status = line[8:]
-                if "installed" in status.split(' '):
-                    return True
-        return False
+    return _SNAPSHOT.is_installed(pkg_name)
+
+
+class transaction(object):
+    """
+    Context manager to install packages using a single APT transaction.
+
+    Inside the block, the packages to install on the current host (using
+    :py:func:`install`, or the ``require.deb`` functions) are not
+    installed immediately. They are collected, then installed at the end
+    of the block using a single ``apt-get install`` command, so that the
+    dependency resolution and the ``dpkg`` lock are paid only once.
+
+    Version pins are preserved, and the package index is updated once
+    before the installation if any of the requests asked for it.
+    Requests with different extra *options* are installed using one
+    command per set of options.
+
+    The pending packages are also installed before any other remote
+    command or upload on the same host, so that code in the block (such
+    as starting a service) never runs against missing packages.
+
+    The packages are not installed if the block raises an exception.
+
+    Example::
+
+        from fabtools import require
+        from fabtools.deb import transaction
+
+        with transaction():
+            require.deb.package('nginx')
+            require.deb.packages(['git', 'curl'])
+            require.deb.package('emacs', version='23.3+1-1ubuntu9')
+
+    .. note:: Checks made locally (such as :py:func:`is_installed`) do not
+              see the pending packages. Code that needs them installed
+              without running a remote command can use
+              :py:func:`install_pending` (or :py:meth:`flush`).
+    """
+
+    def __init__(self):
+        self.key = None
+        self.update = False
+        self.pending = OrderedDict()
+        self._flushing = False
+
+    def __enter__(self):
+        self.key = host_key()
+
+        # Wrap the transport layer and the instrumentation, rather than
+        # be wrapped by them (so that they stay in place when the block ends)
+        instrument._install()
+
+        # Install the pending packages before any other remote operation
+        self._orig_run_command = fabric.operations._run_command
+        self._orig_put = fabric.sftp.SFTP.put
+        self._orig_put_dir = fabric.sftp.SFTP.put_dir
+
+        def run_command(*args, **kwargs):
+            self._flush_before_operation()
+            return self._orig_run_command(*args, **kwargs)
+
+        def put(sftp, *args, **kwargs):
+            self._flush_before_operation()
+            return self._orig_put(sftp, *args, **kwargs)
+
+        def put_dir(sftp, *args, **kwargs):
+            self._flush_before_operation()
+            return self._orig_put_dir(sftp, *args, **kwargs)
+
+        fabric.operations._run_command = run_command
+        fabric.sftp.SFTP.put = put
+        fabric.sftp.SFTP.put_dir = put_dir
+        _TRANSACTIONS.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            _TRANSACTIONS.remove(self)
+            fabric.operations._run_command = self._orig_run_command
+            fabric.sftp.SFTP.put = self._orig_put
+            fabric.sftp.SFTP.put_dir = self._orig_put_dir
+
+    def _flush_before_operation(self):
+        # Not for the commands of the installation itself, nor for
+        # the other hosts
+        if self.pending and not self._flushing and host_key() == self.key:
+            self.flush()
+
+    def add(self, packages, update=False, options=None, version=None,
+            fast=False):
+        """
+        Add packages to install at the end of the block.
+        """
+        if isinstance(packages, basestring):
+            packages = packages.split()
+        group = self.pending.setdefault((tuple(options or ()), fast),
+                                        OrderedDict())
+        for pkg_name in packages:
+            if version:
+                pkg_name = '%s=%s' % (pkg_name, version)
+            group[pkg_name.partition('=')[0]] = pkg_name
+        self.update = self.update or update
+
+    def flush(self):
+        """
+        Install the pending packages now.
+        """
+        # Forget each group only once installed, so that the groups left
+        # after a failure are still pending
+        self._flushing = True
+        try:
+            while self.pending:
+                key, group = next(iter(self.pending.items()))
+                options, fast = key
+                _install(list(group.values()), self.update, list(options),
+                         fast=fast)
+                del self.pending[key]
+                self.update = False
+        finally:
+            self._flushing = False
+
+
+def _transaction():
+    """
+    Get the active transaction for the current host (if any)
+    """
+    key = host_key()
+    for txn in _TRANSACTIONS:
+        if txn.key == key:
+            return txn
+    return None
+
+
+def install_pending():
+    """
+    Install right away the packages collected by the active
+    :py:class:`transaction` (if any), for code that needs them before
+    the end of the block.
+    """
+    txn = _transaction()
+    if txn is not None:
+        txn.flush()
 
 
-def install(packages, update=False, options=None, version=None):
+def install(packages, update=False, options=None, version=None, fast=None):
     """
     Install one or more packages.
 
@@ -62,6 +395,24 @@ def install(packages, update=False, options=None, version=None):
 
     Extra *options* may be passed to ``apt-get`` if necessary.
 
+    If *fast* is ``True`` (or if ``env.fabtools_deb_fast`` is ``True``),
+    the installation trades crash safety and completeness for speed,
+    which suits short-lived hosts such as CI workers. Only for this
+    command (the APT configuration of the host is not changed):
+
+    - ``fsync()`` is disabled during unpacking (using ``eatmydata`` if
+      it is installed, and ``dpkg --force-unsafe-io``)
+    - recommended packages are not installed
+    - documentation, man and info pages are not installed (which also
+      makes the ``man-db`` trigger cheap)
+    - downloads use one connection per host, with HTTP pipelining and
+      retries
+
+    The options are listed in ``fabtools.deb.FAST_OPTIONS``.
+
+    Inside a :py:class:`transaction` block, the installation is deferred
+    to the end of the block.
+
     Example::
 
         import fabtools
@@ -78,12 +429,30 @@ def install(packages, update=False, options=None, version=None):
         # Install a specific version
         fabtools.deb.install('emacs', version='23.3+1-1ubuntu9')
 
+        # Install quickly on a throwaway host
+        fabtools.deb.install(['build-essential', 'git'], fast=True)
+
     """
+    from fabric.state import env
+
+    if fast is None:
+        fast = env.get('fabtools_deb_fast', False)
+    txn = _transaction()
+    if txn is not None and not (version and isinstance(packages, list)):
+        txn.add(packages, update, options, version, fast)
+        return
+    _install(packages, update, options, version, fast)
+
+
+def _install(packages, update=False, options=None, version=None, fast=False):
     manager = MANAGER
     if update:
         update_index()
     if options is None:
         options = []
+    if fast:
+        manager = FAST_MANAGER
+        options = options + FAST_OPTIONS
     if version is None:
         version = ''
     if version and not isinstance(packages, list):
@@ -94,7 +463,7 @@ def install(packages, update=False, options=None, version=None):
     options.append("--assume-yes")
     options = " ".join(options)
     cmd = '%(manager)s install %(options)s %(packages)s%(version)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, True, run_as_root, cmd, pty=False)
 
 
 def uninstall(packages, purge=False, options=None):
@@ -106,6 +475,9 @@ def uninstall(packages, purge=False, options=None):
 
     Extra *options* may be passed to ``apt-get`` if necessary.
     """
+    # Keep the order of the operations
+    install_pending()
+
     manager = MANAGER
     command = "purge" if purge else "remove"
     if options is None:
@@ -115,7 +487,7 @@ def uninstall(packages, purge=False, options=None):
     options.append("--assume-yes")
     options = " ".join(options)
     cmd = '%(manager)s %(command)s %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, False, run_as_root, cmd, pty=False)
 
 
 def preseed_package(pkg_name, preseed):
@@ -135,25 +507,212 @@ def preseed_package(pkg_name, preseed):
         })
         fabtools.deb.install('postfix')
 
+    All the answers are set using a single remote command (see
+    :py:func:`preseed_packages`).
+    """
+    return preseed_packages({pkg_name: preseed})
+
+
+PRESEED_SCRIPT = """\
+current=$(debconf-show %(packages)s 2>/dev/null | cut -c3-)
+selections=$(
+%(checks)s
+)
+if [ -n "$selections" ]; then
+    printf '%%s\\n' "$selections" | debconf-set-selections || exit 1
+    printf '%%s\\n' "$selections"
+fi"""
+
+
+def preseed_packages(preseeds):
+    """
+    Preseed the ``debconf`` parameters of several packages at once.
+
+    *preseeds* is a dict mapping package names to dicts of parameters
+    (in the same format as for :py:func:`preseed_package`).
+
+    The current answers are read, and only the answers that differ are
+    set, using a single ``debconf-set-selections`` command. All of this
+    is done using a single remote command.
+
+    Returns the list of the parameters that were changed (passwords are
+    always set, as their current value cannot be read).
+    """
+    checks = []
+    for pkg_name, preseed in sorted(preseeds.items()):
+        for q_name, (q_type, q_answer) in sorted(preseed.items()):
+            current = '%s: %s' % (q_name, q_answer)
+            selection = '%s %s %s %s' % (pkg_name, q_name, q_type, q_answer)
+            checks.append(
+                'printf \'%%s\\n\' "$current" | grep -qxF -- %s || echo %s'
+                % (quote(current), quote(selection))
+            )
+    if not checks:
+        return []
+    packages = ' '.join(quote(pkg_name) for pkg_name in sorted(preseeds))
+    script = PRESEED_SCRIPT % {'packages': packages,
+                               'checks': '\n'.join(checks)}
+    with settings(hide('running', 'stdout')):
+        res = run_as_root(script)
+    changed = []
+    for line in res.splitlines():
+        fields = line.split(None, 3)
+        if len(fields) == 4 and fields[0] in preseeds:
+            changed.append(fields[1])
+    return changed
+
+
+class Selections(dict):
+    """
+    The ``dpkg`` selections of a host, mapping each state (such as
+    ``'install'``, ``'hold'`` or ``'deinstall'``) to a ``frozenset`` of
+    package names.
+
+    Package names are interned, so that the selections of many hosts
+    share the memory used by the names.
+    """
+
+    def state(self, pkg_name):
+        """
+        Get the state of a package (or ``None`` if it is not selected).
+        """
+        for state, names in self.items():
+            if pkg_name in names:
+                return state
+        return None
+
+    def by_package(self):
+        """
+        Get a dict mapping each package name to its state.
+        """
+        return dict((name, state)
+                    for state, names in self.items() for name in names)
+
+    def diff(self, baseline):
+        """
+        Compare these selections with the *baseline* selections (a
+        :py:class:`Selections`, or a dict mapping package names to
+        states, as returned by :py:meth:`by_package`).
+
+        Returns a :py:class:`SelectionsDiff` (which is false if there
+        is no difference).
+        """
+        if isinstance(baseline, Selections):
+            baseline = baseline.by_package()
+        missing = set(baseline)
+        extra = set()
+        changed = {}
+        for state, names in self.items():
+            for name in names:
+                expected = baseline.get(name)
+                if expected is None:
+                    extra.add(name)
+                    continue
+                missing.discard(name)
+                if expected != state:
+                    changed[name] = (expected, state)
+        return SelectionsDiff(missing, extra, changed)
+
+
+class SelectionsDiff(object):
+    """
+    Differences between the selections of a host and a baseline.
+
+    - ``missing``: the set of packages of the baseline that are not
+      selected on the host
+    - ``extra``: the set of packages selected on the host that are not
+      in the baseline
+    - ``changed``: a dict mapping the packages that are in a different
+      state to a ``(baseline_state, host_state)`` tuple
     """
-    for q_name, _ in preseed.items():
-        q_type, q_answer = _
-        run_as_root('echo "%(pkg_name)s %(q_name)s %(q_type)s %(q_answer)s" | debconf-set-selections' % locals())
+
+    def __init__(self, missing=None, extra=None, changed=None):
+        self.missing = missing or set()
+        self.extra = extra or set()
+        self.changed = changed or {}
+
+    def __nonzero__(self):
+        return bool(self.missing or self.extra or self.changed)
+
+    def __repr__(self):
+        return '<SelectionsDiff: %d missing, %d extra, %d changed>' % (
+            len(self.missing), len(self.extra), len(self.changed))
+
+
+def parse_selections(lines):
+    """
+    Parse the output of ``dpkg --get-selections``, given as an iterable
+    of lines (such as an open file), into a :py:class:`Selections`.
+    """
+    states = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        name, state = fields
+        states.setdefault(intern(state), []).append(intern(name))
+    return Selections((state, frozenset(names))
+                      for state, names in states.items())
 
 
 def get_selections():
     """
     Get the state of ``dkpg`` selections.
 
-    Returns a dict with state => [packages].
+    Returns a :py:class:`Selections` dict with state => frozenset of
+    packages.
     """
     with settings(hide('stdout')):
         res = run_as_root('dpkg --get-selections')
-    selections = dict()
-    for line in res.splitlines():
-        package, status = line.split()
-        selections.setdefault(status, list()).append(package)
-    return selections
+    return parse_selections(StringIO(res))
+
+
+def selections_drift(baseline):
+    """
+    Compare the selections of the current host with the *baseline*
+    selections (a :py:class:`Selections`).
+
+    Returns a :py:class:`SelectionsDiff`, which is small when the host
+    does not drift much. To check a fleet of hosts, run it on all of
+    them with :py:func:`fabtools.executor.run_on_hosts`, so that only
+    the differences are sent back by the worker processes::
+
+        from fabric.api import settings
+        from fabtools.deb import get_selections, selections_drift
+        from fabtools.executor import run_on_hosts
+
+        with settings(host_string='reference.example.com'):
+            baseline = get_selections()
+
+        results = run_on_hosts(selections_drift, hosts, args=[baseline])
+        for host, res in results.items():
+            if res.succeeded and res.result:
+                print("%s: %r" % (host, res.result))
+
+    """
+    return get_selections().diff(baseline)
+
+
+def diff_selections(baseline, selections):
+    """
+    Compare the selections of many hosts with the *baseline* selections.
+
+    *selections* is a dict (or an iterable of pairs, so that they can be
+    parsed lazily, one host at a time) mapping host names to
+    :py:class:`Selections`.
+
+    Returns a dict mapping the hosts that differ from the baseline to
+    their :py:class:`SelectionsDiff`.
+    """
+    if isinstance(selections, dict):
+        selections = selections.items()
+    expected = baseline.by_package()
+    drift = {}
+    for host, host_selections in selections:
+        diff = host_selections.diff(expected)
+        if diff:
+            drift[host] = diff
+    return drift
 
 
 def apt_key_exists(keyid):
@@ -166,32 +725,75 @@ def apt_key_exists(keyid):
     return False
 
 
-def locate_apt_key(keyid):
+APT_KEYS_SCRIPT = """\
+home=$(mktemp -d) && trap 'rm -rf "$home"' EXIT
+for keyring in /etc/apt/trusted.gpg /etc/apt/trusted.gpg.d/*.gpg \\
+        /etc/apt/trusted.gpg.d/.*.gpg; do
+    [ -f "$keyring" ] || continue
+    gpg --ignore-time-conflict --no-options --no-default-keyring \\
+        --homedir "$home" --keyring "$keyring" --with-colons \\
+        --fingerprint 2>/dev/null |
+    sed -n "s|^fpr:.*:\\([0-9A-F]\\{16,\\}\\):.*$|\\1 $keyring|p"
+done
+true"""
+
+# Index of the APT keys (fingerprint or key id => keyring file)
+_APT_KEYS = host_cache()
+
+
+def apt_keys(refresh=False):
     """
-    Locate the given key id in apt keyring.
+    Get the index of the keys trusted by APT.
+
+    The keyrings (``/etc/apt/trusted.gpg`` and the files in
+    ``/etc/apt/trusted.gpg.d``) are read using a single remote command,
+    the first time they are needed for a given host. The index is then
+    kept in memory, and updated by :py:func:`add_apt_key` and
+    :py:func:`del_apt_key`.
+
+    Returns a dict mapping the fingerprints of the keys (and subkeys) to
+    the keyring files containing them. It should not be modified.
     """
     from fabtools.require.deb import package as require_package
-    require_package('gpg')
 
-    keyring_list = []
+    key = host_key()
+    if refresh or key not in _APT_KEYS:
+        require_package('gpg')
+        install_pending()
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run(APT_KEYS_SCRIPT)
+        index = {}
+        for line in res.splitlines():
+            parts = line.split(None, 1)
+            if len(parts) == 2:
+                index.setdefault(parts[0], parts[1])
+        _APT_KEYS[key] = index
+    return _APT_KEYS[key]
+
 
-    trusted_file = '/etc/apt/trusted.gpg'
-    if is_file(trusted_file):
-        keyring_list.append(trusted_file)
+def _normalize_keyid(keyid):
+    keyid = keyid.replace(' ', '').upper()
+    if keyid.startswith('0X'):
+        keyid = keyid[2:]
+    return keyid
 
-    trusted_parts = '/etc/apt/trusted.gpg.d'
-    if is_dir(trusted_parts):
-        res = run('(shopt -s dotglob; ls -N -d -1 %s/*.gpg)' % trusted_parts, quiet=True)
-        if res.succeeded:
-            keyring_list.extend(res.splitlines())
 
-    for keyring in keyring_list:
-        # Command extracted from apt-key source
-        gpg_cmd = 'gpg --ignore-time-conflict --no-options --no-default-keyring --keyring %s' % keyring
+def locate_apt_key(keyid):
+    """
+    Locate the given key id in apt keyring.
 
-        res = run('%s --fingerprint %s' % (gpg_cmd, keyid), quiet=True)
-        if res.succeeded:
+    The *keyid* may be a short (8 digits) or long (16 digits) key id,
+    or a fingerprint. The keyring is found using the index of the keys
+    (see :py:func:`apt_keys`).
+    """
+    keyid = _normalize_keyid(keyid)
+    if not keyid:
+        return None
+    for fingerprint, keyring in sorted(apt_keys().items()):
+        if fingerprint.endswith(keyid):
             return keyring
+    return None
 
 
 def _check_pgp_key(path, keyid):
@@ -215,9 +817,16 @@ def _get_pubid_gpg_key(filename):
 def _add_pgp_key(filename):
     pubid = _get_pubid_gpg_key(filename)
     destname = 'imported_key_%s.gpg' % pubid
+    keyring = '/etc/apt/trusted.gpg.d/%s' % destname
     with settings(hide('everything')):
-        copy(filename, '/etc/apt/trusted.gpg.d/%s' % destname, use_sudo=True)
+        copy(filename, keyring, use_sudo=True)
         remove(filename, force=True, use_sudo=True)
+
+    # Update the index of the keys (by key id)
+    index = _APT_KEYS.get(host_key())
+    if index is not None:
+        for keyid in pubid.split():
+            index[_normalize_keyid(keyid)] = keyring
     return destname
 
 
@@ -243,6 +852,7 @@ def add_apt_key(filename=None, url=None, keyid=None, keyserver='subkeys.pgp.net'
     """
     from fabtools.require.deb import package as require_package
     require_package('gpg')
+    install_pending()
 
     if keyid is None:
         if filename is not None:
@@ -267,6 +877,7 @@ def add_apt_key(filename=None, url=None, keyid=None, keyserver='subkeys.pgp.net'
             remove(tmp_key, force=True, use_sudo=True)
         else:
             require_package('dirmngr')
+            install_pending()
             run_as_root('gpg -k')
             keyserver_opt = '--keyserver %s' % keyserver if keyserver is not None else ''
             # Import key to tmp keyring file
@@ -291,6 +902,10 @@ def del_apt_key(keyid):
     if filename is not None:
         if filename != '/etc/apt/trusted.gpg':
             remove(filename, force=True, use_sudo=True)
+            index = apt_keys()
+            for fingerprint, keyring in index.items():
+                if keyring == filename:
+                    del index[fingerprint]
         else:
             raise ValueError('Deleting a key from `/etc/apt/trusted.gpg` is no more supported.')
 
@@ -311,7 +926,183 @@ def last_update_time():
         # 1377603808.02
 
     """
-    STAMP = '/var/lib/apt/periodic/fabtools-update-success-stamp'
-    if not is_file(STAMP):
+    if not is_file(UPDATE_STAMP):
         return -1
-    return getmtime(STAMP)
+    return getmtime(UPDATE_STAMP)
+
+
+# Remote directory where bundles are uploaded
+BUNDLE_DIR = '/var/cache/fabtools/debs'
+
+BUNDLE_SCRIPT = """\
+rm -rf %(work_dir)s && mkdir -p %(work_dir)s && cd %(work_dir)s && \
+apt-get download --quiet --quiet $(apt-cache depends --recurse \
+    --no-recommends --no-suggests --no-conflicts --no-breaks \
+    --no-replaces --no-enhances %(packages)s | grep '^[a-z0-9]' | sort -u) \
+    >/dev/null && \
+sha256sum *.deb"""
+
+
+class Bundle(object):
+    """
+    A set of ``.deb`` files stored on the controlling machine
+    (see :py:func:`build_bundle`).
+
+    - ``packages``: a list of dicts, with the ``name``, ``version``,
+      ``arch``, ``filename`` and ``sha256`` of each package
+    - ``cache_dir``: the local directory where the files are stored,
+      named after their SHA-256 checksum
+    """
+
+    def __init__(self, packages, cache_dir):
+        self.packages = packages
+        self.cache_dir = cache_dir
+
+    def local_path(self, pkg):
+        return os.path.join(self.cache_dir, '%s.deb' % pkg['sha256'])
+
+    def save(self, filename):
+        """
+        Save the list of packages to a JSON file, to reuse the bundle
+        in a later session (see :py:meth:`load`).
+        """
+        with open(filename, 'w') as f:
+            json.dump({'packages': self.packages,
+                       'cache_dir': self.cache_dir}, f, indent=2)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(data['packages'], data['cache_dir'])
+
+
+def _bundle_cache_dir(cache_dir):
+    from fabric.state import env
+
+    if cache_dir is None:
+        cache_dir = env.get('fabtools_deb_bundle_cache',
+                            '~/.cache/fabtools/debs')
+    cache_dir = os.path.expanduser(cache_dir)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+def _sha256(filename):
+    digest = sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_bundle(pkg_list, cache_dir=None,
+                 work_dir='/tmp/fabtools-bundle'):
+    """
+    Build a bundle of ``.deb`` files, to install packages on hosts that
+    cannot reach the mirrors (or only through a slow link).
+
+    The packages and the closure of their dependencies (excluding
+    recommended packages) are resolved and downloaded on the current
+    host, the *seed*, using a single remote command. The files are then
+    copied to the local *cache_dir* (``env.fabtools_deb_bundle_cache``,
+    or ``~/.cache/fabtools/debs`` by default), where they are stored by
+    checksum: files already in the cache are not copied again.
+
+    The seed must run the same release, on the same architecture, as the
+    target hosts. It can be the controlling machine itself, using the
+    local transport (see :py:mod:`fabtools.transport`).
+
+    Returns a :py:class:`Bundle`, to be installed on the target hosts
+    using :py:func:`fabtools.require.deb.bundle`.
+
+    Example::
+
+        from fabric.api import settings
+        from fabtools import deb, require
+        from fabtools.executor import run_on_hosts
+
+        with settings(host_string='seed.example.com'):
+            bundle = deb.build_bundle(['nginx', 'redis-server'])
+        bundle.save('bundle.json')
+
+        run_on_hosts(require.deb.bundle, hosts, args=[bundle])
+
+    """
+    cache_dir = _bundle_cache_dir(cache_dir)
+    packages = ' '.join(quote(pkg) for pkg in pkg_list)
+    with settings(hide('running', 'stdout')):
+        res = run(BUNDLE_SCRIPT % locals())
+
+    bundle = Bundle([], cache_dir)
+    for line in res.splitlines():
+        parts = line.split()
+        if len(parts) != 2 or not parts[1].endswith('.deb'):
+            continue
+        checksum, filename = parts
+        name, version, arch = unquote(filename)[:-len('.deb')].split('_')
+        pkg = {
+            'name': name,
+            'version': version,
+            'arch': arch,
+            'filename': filename,
+            'sha256': checksum,
+        }
+        local_path = bundle.local_path(pkg)
+        if not os.path.exists(local_path):
+            tmp_path = local_path + '.part'
+            get(posixpath.join(work_dir, filename), tmp_path)
+            if _sha256(tmp_path) != checksum:
+                os.remove(tmp_path)
+                abort('Checksum mismatch for %s' % filename)
+            os.rename(tmp_path, local_path)
+        bundle.packages.append(pkg)
+
+    run('rm -rf %s' % work_dir, quiet=True)
+    return bundle
+
+
+def push_bundle(bundle, packages=None, remote_dir=BUNDLE_DIR):
+    """
+    Upload the files of a :py:class:`Bundle` (or only the given
+    *packages* of the bundle) to *remote_dir* on the current host.
+
+    Files already present on the host, with the same checksum, are not
+    uploaded again. All the files are checked using a single remote
+    command.
+
+    Returns the remote paths of the files.
+    """
+    if packages is None:
+        packages = bundle.packages
+    paths = [posixpath.join(remote_dir, pkg['filename']) for pkg in packages]
+    remote = checksums(paths, 'sha256', use_sudo=True)
+    missing = [(pkg, path) for pkg, path in zip(packages, paths)
+               if remote.get(path) != pkg['sha256']]
+    if missing:
+        run_as_root('mkdir -p %s' % quote(remote_dir))
+        for pkg, path in missing:
+            put(bundle.local_path(pkg), path, use_sudo=True)
+    return paths
+
+
+def install_bundle(bundle, packages=None, remote_dir=BUNDLE_DIR, fast=None):
+    """
+    Upload the files of a :py:class:`Bundle` (or only the given
+    *packages* of the bundle) to the current host, and install them
+    (see :py:func:`push_bundle`).
+
+    The *fast* option is the same as for :py:func:`install`.
+    """
+    from fabric.state import env
+
+    if packages is None:
+        packages = bundle.packages
+    if not packages:
+        return
+    if fast is None:
+        fast = env.get('fabtools_deb_fast', False)
+    paths = push_bundle(bundle, packages, remote_dir)
+    _install(paths, fast=fast)
+    _SNAPSHOT.record([pkg['name'] for pkg in packages], True)
@@ -0,0 +1,241 @@
+"""
+Parallel execution
+==================
+
+This module provides a function to run a provisioning function on
+many hosts at once, using a bounded pool of worker processes.
+
+Unlike Fabric's ``@parallel`` decorator, it collects a structured
+result for each host, supports stopping at the first failure, and
+keeps the per-host caches of fabtools (such as the system facts)
+gathered by the workers.
+
+"""
+
+from collections import OrderedDict
+import multiprocessing
+import pickle
+import time
+import traceback
+
+from fabric.api import hide, settings
+from fabric.network import disconnect_all, to_dict
+
+from fabtools import instrument
+
+
+# The function run by the worker processes, with its arguments
+# (inherited when forking, so that it does not need to be pickled)
+_JOB = None
+
+
+class HostResult(object):
+    """
+    Result of running a function on a host.
+
+    - ``host``: the host string
+    - ``status``: ``'succeeded'``, ``'failed'``, or ``'skipped'`` (if the
+      function was not run, or was interrupted, because another host
+      failed in fail-fast mode)
+    - ``result``: the return value of the function
+    - ``error``: the error message, if it failed
+    - ``traceback``: the formatted traceback, if it failed with an
+      exception (``abort()`` does not give one)
+    - ``duration``: the time spent on this host, in seconds
+    """
+
+    def __init__(self, host, status, result=None, error=None,
+                 traceback=None, duration=None):
+        self.host = host
+        self.status = status
+        self.result = result
+        self.error = error
+        self.traceback = traceback
+        self.duration = duration
+
+    @property
+    def succeeded(self):
+        return self.status == 'succeeded'
+
+    @property
+    def failed(self):
+        return self.status == 'failed'
+
+    def __repr__(self):
+        return '<HostResult %s: %s>' % (self.host, self.status)
+
+
+class Results(OrderedDict):
+    """
+    Results of :py:func:`run_on_hosts`, mapping each host string to
+    a :py:class:`HostResult` (in the order of the host list).
+    """
+
+    @property
+    def succeeded(self):
+        return [host for host, res in self.items() if res.succeeded]
+
+    @property
+    def failed(self):
+        return [host for host, res in self.items() if res.failed]
+
+    @property
+    def skipped(self):
+        return [host for host, res in self.items() if res.status == 'skipped']
+
+
+def run_on_hosts(func, hosts, args=(), kwargs=None, pool_size=None,
+                 fail_fast=False, progress=None):
+    """
+    Run *func* on each host of the *hosts* list, in parallel.
+
+    The function is called with ``env.host_string`` set to the host
+    (and with the optional *args* and *kwargs*). At most *pool_size*
+    hosts are processed at the same time (``env.pool_size``, or 10, by
+    default), so the total time is bounded by the slowest hosts, rather
+    than by the sum of all hosts.
+
+    Errors (including ``abort()``) are caught and reported per host. By
+    default, all the hosts are processed even if some of them fail. If
+    *fail_fast* is ``True``, the remaining hosts are skipped (and the
+    running ones are interrupted) as soon as one host fails.
+
+    The optional *progress* callback is called in the controlling
+    process with each :py:class:`HostResult`, as soon as it is known.
+
+    The remote operations recorded by the workers are added to the
+    active recorders (see :py:mod:`fabtools.instrument`).
+
+    The per-host caches gathered by the workers (see
+    :py:func:`fabtools.utils.host_cache`) are merged back into the
+    controlling process, so that later calls on the same hosts do not
+    have to gather them again.
+
+    Returns a :py:class:`Results` dict::
+
+        from fabtools import require
+        from fabtools.executor import run_on_hosts
+
+        def provision():
+            require.deb.packages(['nginx', 'redis-server'])
+            require.service.started('nginx')
+
+        results = run_on_hosts(provision, ['web1', 'web2', 'web3'],
+                               pool_size=20)
+        for host in results.failed:
+            print("%s: %s" % (host, results[host].error))
+
+    With a *pool_size* of 1, the hosts are processed one after the
+    other, in the current process.
+    """
+    from fabric.state import env
+
+    global _JOB
+
+    hosts = list(hosts)
+    if pool_size is None:
+        pool_size = env.get('pool_size') or 10
+    pool_size = min(pool_size, len(hosts))
+
+    results = Results((host, HostResult(host, 'skipped')) for host in hosts)
+    if not hosts:
+        return results
+
+    _JOB = (func, tuple(args), kwargs or {})
+    try:
+        if pool_size <= 1:
+            outcomes = (_run_host(host, in_worker=False) for host in hosts)
+            _collect(outcomes, results, fail_fast, progress)
+        else:
+            pool = multiprocessing.Pool(pool_size, _init_worker)
+            try:
+                _collect(pool.imap_unordered(_run_host, hosts),
+                         results, fail_fast, progress)
+            finally:
+                pool.terminate()
+                pool.join()
+    finally:
+        _JOB = None
+
+    return results
+
+
+def _collect(outcomes, results, fail_fast, progress):
+    """
+    Store the outcome of each host as soon as it is known
+    """
+    from fabtools.utils import _HOST_CACHES
+
+    for res, caches, records in outcomes:
+        results[res.host] = res
+        for cache, entries in zip(_HOST_CACHES, caches):
+            cache.update(entries)
+        instrument._add_records(records)
+        if progress is not None:
+            progress(res)
+        if res.failed and fail_fast:
+            break
+
+
+def _init_worker():
+    from fabric.state import connections
+
+    # Do not share the SSH connections of the parent process
+    connections.clear()
+
+    # Only send back the records made by this worker
+    instrument._take_records()
+
+
+def _run_host(host, in_worker=True):
+    """
+    Run the job on a host, and return its result, cache entries and
+    instrumentation records
+    """
+    func, args, kwargs = _JOB
+    start = time.time()
+    try:
+        with settings(**to_dict(host)):
+            result = func(*args, **kwargs)
+        res = HostResult(host, 'succeeded', result=_picklable(result))
+    except SystemExit as e:
+        # abort() already reported the error
+        error = getattr(e, 'message', '') or str(e)
+        res = HostResult(host, 'failed', error=error)
+    except Exception as e:
+        res = HostResult(host, 'failed', error='%s: %s' % (type(e).__name__, e),
+                         traceback=traceback.format_exc())
+    res.duration = time.time() - start
+
+    if not in_worker:
+        return res, [], []
+
+    with hide('status'):
+        disconnect_all()
+    return res, _host_caches(host), instrument._take_records()
+
+
+def _host_caches(host):
+    """
+    Get the entries about *host* (or its guests) in each per-host cache
+    """
+    from fabtools.utils import _HOST_CACHES
+
+    return [
+        dict(
+            (key, value) for key, value in cache.items()
+            if key == host or key.startswith(host + '/')
+        )
+        for cache in _HOST_CACHES
+    ]
+
+
+def _picklable(result):
+    """
+    Results are sent back by the worker processes, so they must be picklable
+    """
+    try:
+        pickle.dumps(result)
+    except Exception:
+        return repr(result)
+    return result
@@ -4,6 +4,7 @@ Files and directories
 """
 
 from pipes import quote
+import hashlib
 import os
 
 from fabric.api import (
@@ -15,42 +16,50 @@ from fabric.api import (
     warn,
 )
 from fabric.contrib.files import upload_template as _upload_template
-from fabric.contrib.files import exists
 
-from fabtools.utils import run_as_root
+from fabtools import agent
+from fabtools.checks import check
+from fabtools.utils import host_cache, host_key, run_as_root
 
 
 def is_file(path, use_sudo=False):
     """
     Check if a path exists, and is a file.
     """
-    func = use_sudo and run_as_root or run
-    with settings(hide('running', 'warnings'), warn_only=True):
-        return func('[ -f "%(path)s" ]' % locals()).succeeded
+    info = agent.query('stat', use_sudo, paths=[path])
+    if info is not None:
+        return info[path] is not None and info[path]['type'] == 'file'
+    return check('[ -f "%(path)s" ]' % locals(), use_sudo=use_sudo)
 
 
 def is_dir(path, use_sudo=False):
     """
     Check if a path exists, and is a directory.
     """
-    func = use_sudo and run_as_root or run
-    with settings(hide('running', 'warnings'), warn_only=True):
-        return func('[ -d "%(path)s" ]' % locals()).succeeded
+    info = agent.query('stat', use_sudo, paths=[path])
+    if info is not None:
+        return info[path] is not None and info[path]['type'] == 'directory'
+    return check('[ -d "%(path)s" ]' % locals(), use_sudo=use_sudo)
 
 
 def is_link(path, use_sudo=False):
     """
     Check if a path exists, and is a symbolic link.
     """
-    func = use_sudo and run_as_root or run
-    with settings(hide('running', 'warnings'), warn_only=True):
-        return func('[ -L "%(path)s" ]' % locals()).succeeded
+    info = agent.query('stat', use_sudo, paths=[path], follow=False)
+    if info is not None:
+        return info[path] is not None and info[path]['type'] == 'link'
+    return check('[ -L "%(path)s" ]' % locals(), use_sudo=use_sudo)
 
 
 def owner(path, use_sudo=False):
     """
     Get the owner name of a file or directory.
     """
+    info = _agent_stat(path, use_sudo)
+    if info is not None:
+        return info['owner']
+
     func = use_sudo and run_as_root or run
     # I'd prefer to use quiet=True, but that's not supported with older
     # versions of Fabric.
@@ -67,6 +76,10 @@ def group(path, use_sudo=False):
     """
     Get the group name of a file or directory.
     """
+    info = _agent_stat(path, use_sudo)
+    if info is not None:
+        return info['group']
+
     func = use_sudo and run_as_root or run
     # I'd prefer to use quiet=True, but that's not supported with older
     # versions of Fabric.
@@ -86,6 +99,10 @@ def mode(path, use_sudo=False):
     Returns a string such as ``'0755'``, representing permissions as
     an octal number.
     """
+    info = _agent_stat(path, use_sudo)
+    if info is not None:
+        return info['mode']
+
     func = use_sudo and run_as_root or run
     # I'd prefer to use quiet=True, but that's not supported with older
     # versions of Fabric.
@@ -98,6 +115,14 @@ def mode(path, use_sudo=False):
             return result
 
 
+def _agent_stat(path, use_sudo):
+    """
+    Get the attributes of an existing path using the agent, if enabled
+    """
+    info = agent.query('stat', use_sudo, paths=[path])
+    return info and info[path]
+
+
 def umask(use_sudo=False):
     """
     Get the user's umask.
@@ -111,6 +136,104 @@ def umask(use_sudo=False):
     return func('umask')
 
 
+def stat_many(paths, use_sudo=False):
+    """
+    Get the attributes of several files or directories at once.
+
+    All the paths are checked using a single remote command. Symbolic
+    links are followed.
+
+    Returns a dict mapping each path to either ``None`` (if it does not
+    exist) or a dict with the following keys:
+
+    - ``type``: ``'file'``, ``'directory'`` or ``'other'``
+    - ``owner`` and ``group``: names of the owner and group
+    - ``mode``: permissions as an octal string, such as ``'755'``
+    - ``size``: size in bytes
+    - ``mtime``: time of last modification, in seconds since the epoch
+
+    Example::
+
+        from fabtools.files import stat_many
+
+        stats = stat_many(['/etc/hosts', '/etc/nginx'])
+        if stats['/etc/nginx'] is None:
+            print("nginx is not configured")
+
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+    paths = list(paths)
+    if not paths:
+        return {}
+
+    info = agent.query('stat', use_sudo, paths=paths)
+    if info is not None:
+        return info
+
+    func = use_sudo and run_as_root or run
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = func(_stat_script(paths))
+
+    # Ignore any other output (login banners, warnings...)
+    lines = {}
+    for line in res.splitlines():
+        if line.startswith('fabtools:'):
+            index, _, attributes = line[len('fabtools:'):].partition(':')
+            lines[index] = attributes
+    stats = {}
+    for index, path in enumerate(paths):
+        line = lines.get(str(index))
+        if line is None:
+            abort('Unexpected output from stat: %s' % res)
+        stats[path] = _parse_stat_line(line)
+    return stats
+
+
+STAT_SCRIPT = """\
+if stat -c %%n / >/dev/null 2>&1; then
+    _stat() { stat -L -c '%%U %%G %%a %%s %%Y' "$1"; }
+else
+    _stat() { stat -L -f '%%Su %%Sg %%OLp %%z %%m' "$1"; }
+fi
+i=0
+for p in %(paths)s; do
+    if [ -d "$p" ]; then t="directory $(_stat "$p")"
+    elif [ -f "$p" ]; then t="file $(_stat "$p")"
+    elif [ -e "$p" ]; then t="other $(_stat "$p")"
+    else t=missing
+    fi
+    echo "fabtools:$i:$t"
+    i=$((i + 1))
+done"""
+
+
+def _stat_script(paths):
+    """
+    Build a shell script printing one line of attributes per path,
+    prefixed with its index (using either the GNU or the BSD version
+    of stat)
+    """
+    paths = ' '.join(quote(path) for path in paths)
+    return STAT_SCRIPT % locals()
+
+
+def _parse_stat_line(line):
+    parts = line.split()
+    if len(parts) != 6:
+        return None
+    type_, owner, group, mode, size, mtime = parts
+    return {
+        'type': type_,
+        'owner': owner,
+        'group': group,
+        'mode': mode,
+        'size': int(size),
+        'mtime': int(mtime),
+    }
+
+
 def upload_template(filename, destination, context=None, use_jinja=False,
                     template_dir=None, use_sudo=False, backup=True,
                     mirror_local_mode=False, mode=None,
@@ -154,45 +277,186 @@ def upload_template(filename, destination, context=None, use_jinja=False,
         run_as_root('chown %s: %s' % (user, quote(destination)))
 
 
-def md5sum(filename, use_sudo=False):
+# Shell script locating the checksum utilities available on the remote host
+# (for each algorithm, the first executable found is used)
+CHECKSUM_TOOLS_PROBE = """\
+_first() {
+    for tool in "$@"; do
+        if [ -x "$tool" ]; then echo "$tool"; return; fi
+    done
+}
+echo "md5=$(_first /usr/bin/md5sum /sbin/md5 /opt/local/gnu/bin/md5sum /opt/local/bin/md5sum $(command -v md5sum) $(command -v md5))"
+echo "sha256=$(_first $(command -v sha256sum) $(command -v shasum) $(command -v sha256))"
+echo "blake2b=$(_first $(command -v b2sum))"
+"""
+
+# Supported algorithms, by order of preference
+CHECKSUM_ALGORITHMS = ('blake2b', 'sha256', 'md5')
+
+_CHECKSUM_TOOLS = host_cache()
+
+
+def checksum_tools():
     """
-    Compute the MD5 sum of a file.
+    Get the checksum utilities available on the remote host.
+
+    The utilities are located using a single remote command, the first
+    time they are needed for a given host. The result is then remembered
+    for the rest of the session.
+
+    Returns a dict mapping each supported algorithm (``'md5'``,
+    ``'sha256'``, ``'blake2b'``) to the command to use, or ``None`` if no
+    utility was found for this algorithm.
     """
+    key = host_key()
+    if key not in _CHECKSUM_TOOLS:
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run(CHECKSUM_TOOLS_PROBE)
+        tools = dict.fromkeys(CHECKSUM_ALGORITHMS)
+        for line in res.splitlines():
+            algorithm, _, path = line.partition('=')
+            if algorithm in tools and path.strip():
+                tools[algorithm] = _checksum_command(path.strip())
+        _CHECKSUM_TOOLS[key] = tools
+    return _CHECKSUM_TOOLS[key]
+
+
+def _checksum_command(path):
+    name = path.rsplit('/', 1)[-1]
+    if name in ('md5', 'sha256'):
+        # BSD / OS X
+        return '%s -r' % path
+    elif name == 'shasum':
+        return '%s -a 256' % path
+    else:
+        return path
+
+
+def checksum_algorithm():
+    """
+    Get the checksum algorithm used to compare local and remote files.
+
+    This is ``env.fabtools_checksum_algorithm`` if set (``'md5'`` by
+    default). The special value ``'auto'`` selects the fastest algorithm
+    supported by both the local Python and the remote host (``blake2b``,
+    then ``sha256``, then ``md5``).
+
+    Example::
+
+        from fabric.api import env
+
+        # Use BLAKE2 (b2sum) or SHA-256 when available
+        env.fabtools_checksum_algorithm = 'auto'
+
+    """
+    from fabric.state import env
+
+    algorithm = env.get('fabtools_checksum_algorithm') or 'md5'
+    if algorithm != 'auto':
+        return algorithm
+    tools = checksum_tools()
+    for algorithm in CHECKSUM_ALGORITHMS:
+        if tools[algorithm] and _hashlib_supports(algorithm):
+            return algorithm
+    return 'md5'
+
+
+def _hashlib_supports(algorithm):
+    try:
+        hashlib.new(algorithm)
+    except ValueError:
+        return False
+    return True
+
+
+def checksum(filename, algorithm='md5', use_sudo=False):
+    """
+    Compute the checksum of a file, using the given *algorithm*
+    (``'md5'``, ``'sha256'`` or ``'blake2b'``).
+
+    Returns the hex digest of the file, or ``None`` if it could not be
+    computed (for instance if the file does not exist).
+
+    The checksum utility is located only once per host
+    (see :py:func:`checksum_tools`).
+    """
+    digests = agent.query('hash', use_sudo, paths=[filename],
+                          algorithm=algorithm)
+    if digests is not None:
+        return digests[filename]
+
+    tool = checksum_tools().get(algorithm)
+    if tool is None:
+        if algorithm == 'md5':
+            abort('No MD5 utility was found on this system.')
+        abort('No %s utility was found on this system.' % algorithm)
+
     func = use_sudo and run_as_root or run
     with settings(hide('running', 'stdout', 'stderr', 'warnings'),
                   warn_only=True):
-        # Linux (LSB)
-        if exists(u'/usr/bin/md5sum'):
-            res = func(u'/usr/bin/md5sum %(filename)s' % locals())
-        # BSD / OS X
-        elif exists(u'/sbin/md5'):
-            res = func(u'/sbin/md5 -r %(filename)s' % locals())
-        # SmartOS Joyent build
-        elif exists(u'/opt/local/gnu/bin/md5sum'):
-            res = func(u'/opt/local/gnu/bin/md5sum %(filename)s' % locals())
-        # SmartOS Joyent build
-        # (the former doesn't exist, at least on joyent_20130222T000747Z)
-        elif exists(u'/opt/local/bin/md5sum'):
-            res = func(u'/opt/local/bin/md5sum %(filename)s' % locals())
-        # Try to find ``md5sum`` or ``md5`` on ``$PATH`` or abort
-        else:
-            md5sum = func(u'which md5sum')
-            md5 = func(u'which md5')
-            if exists(md5sum):
-                res = func('%(md5sum)s %(filename)s' % locals())
-            elif exists(md5):
-                res = func('%(md5)s %(filename)s' % locals())
-            else:
-                abort('No MD5 utility was found on this system.')
+        res = func('%(tool)s %(filename)s' % locals())
 
     if res.succeeded:
         parts = res.split()
-        _md5sum = len(parts) > 0 and parts[0] or None
+        _checksum = len(parts) > 0 and parts[0] or None
     else:
         warn(res)
-        _md5sum = None
+        _checksum = None
 
-    return _md5sum
+    return _checksum
+
+
+def md5sum(filename, use_sudo=False):
+    """
+    Compute the MD5 sum of a file.
+    """
+    return checksum(filename, 'md5', use_sudo)
+
+
+def checksums(filenames, algorithm='md5', use_sudo=False):
+    """
+    Compute the checksums of several files, using a single remote command.
+
+    Returns a dict mapping each filename to its hex digest, or to ``None``
+    if it could not be computed (for instance if the file does not exist).
+
+    Example::
+
+        from fabtools.files import checksums
+
+        digests = checksums(['/etc/hosts', '/etc/resolv.conf'])
+
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return {}
+
+    digests = agent.query('hash', use_sudo, paths=filenames,
+                          algorithm=algorithm)
+    if digests is not None:
+        return digests
+
+    tool = checksum_tools().get(algorithm)
+    if tool is None:
+        abort('No %s utility was found on this system.' % algorithm)
+
+    files = ' '.join(quote(filename) for filename in filenames)
+    command = (
+        'for f in %(files)s; do'
+        ' set -- $(%(tool)s "$f" 2>/dev/null); echo "fabtools:$1";'
+        ' done' % locals()
+    )
+    func = use_sudo and run_as_root or run
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = func(command)
+
+    digests = [line[len('fabtools:'):].strip() or None
+               for line in res.splitlines() if line.startswith('fabtools:')]
+    if len(digests) != len(filenames):
+        abort('Unexpected output from %s: %s' % (tool, res))
+    return dict(zip(filenames, digests))
 
 
 class watch(object):
@@ -204,10 +468,15 @@ class watch(object):
 
     You can read the *changed* attribute at the end of the block to
     check if the contents of any of the watched files has changed.
+    The *changed_files* attribute gives the list of the files whose
+    contents has changed.
 
     You can also provide a *callback* that will be called at the end of
     the block if the contents of any of the watched files has changed.
 
+    The checksums of all the watched files are computed using a single
+    remote command when entering the block, and another one at the end.
+
     Example using an explicit check::
 
         from fabric.contrib.files import comment, uncomment
@@ -237,29 +506,44 @@ class watch(object):
             uncomment('/etc/daemon.conf', 'someoption')
             comment('/etc/daemon.conf', 'otheroption')
 
+    Example reloading only the services whose configuration has changed::
+
+        from fabtools.files import watch
+        from fabtools.service import reload
+
+        services = {
+            '/etc/nginx/nginx.conf': 'nginx',
+            '/etc/redis/redis.conf': 'redis-server',
+        }
+        with watch(services.keys()) as config:
+            ...
+
+        for filename in config.changed_files:
+            reload(services[filename])
+
     """
 
     def __init__(self, filenames, callback=None, use_sudo=False):
         if isinstance(filenames, basestring):
             self.filenames = [filenames]
         else:
-            self.filenames = filenames
+            self.filenames = list(filenames)
         self.callback = callback
         self.use_sudo = use_sudo
         self.digest = dict()
         self.changed = False
+        self.changed_files = []
 
     def __enter__(self):
-        with settings(hide('warnings')):
-            for filename in self.filenames:
-                self.digest[filename] = md5sum(filename, self.use_sudo)
+        self.algorithm = checksum_algorithm()
+        self.digest = checksums(self.filenames, self.algorithm, self.use_sudo)
         return self
 
     def __exit__(self, type, value, tb):
-        for filename in self.filenames:
-            if md5sum(filename, self.use_sudo) != self.digest[filename]:
-                self.changed = True
-                break
+        digest = checksums(self.filenames, self.algorithm, self.use_sudo)
+        self.changed_files = [filename for filename in self.filenames
+                              if digest[filename] != self.digest[filename]]
+        self.changed = bool(self.changed_files)
         if self.changed and self.callback:
             self.callback()
 
@@ -289,6 +573,27 @@ def getmtime(path, use_sudo=False):
         return int(func('stat -c %%Y "%(path)s" ' % locals()).strip())
 
 
+def age(path, use_sudo=False):
+    """
+    Return the number of seconds since the last modification of path,
+    or ``None`` if it does not exist.
+
+    This uses a single remote command (with either the GNU or the BSD
+    version of stat).
+    """
+    func = use_sudo and run_as_root or run
+    with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                  warn_only=True):
+        res = func('[ -e "%(path)s" ] && '
+                   'm=$(stat -c %%Y "%(path)s" 2>/dev/null || '
+                   'stat -f %%m "%(path)s") && '
+                   'echo $(($(date +%%s) - $m))'
+                   % locals())
+    if res.succeeded and res.strip():
+        return int(res)
+    return None
+
+
 def copy(source, destination, recursive=False, force=False, use_sudo=False):
     """
     Copy a file or directory
@@ -3,8 +3,7 @@ Groups
 ======
 """
 
-from fabric.api import hide, run, settings
-
+from fabtools.checks import check
 from fabtools.utils import run_as_root
 
 
@@ -12,8 +11,7 @@ def exists(name):
     """
     Check if a group exists.
     """
-    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
-        return run('getent group %(name)s' % locals()).succeeded
+    return check('getent group %(name)s' % locals())
 
 
 def create(name, gid=None):
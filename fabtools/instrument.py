@@ -0,0 +1,312 @@
+"""
+Instrumentation
+===============
+
+This module records the remote operations made by fabtools (commands
+run with ``run``, ``sudo`` or ``run_as_root``, file transfers, and
+agent queries), to find out where provisioning time goes.
+
+For each operation, it records the host, the fabtools function that
+made it (and the outermost fabtools function that led to it, such as
+a ``require.*`` function), the wall time, and the number of bytes
+sent and received.
+
+Example::
+
+    from fabtools import instrument, require
+
+    with instrument.recording() as recorder:
+        require.deb.packages(['nginx', 'redis-server'])
+        require.nginx.site('example.com', template_contents=TEMPLATE)
+
+    print(recorder.table())
+    recorder.write_json('fabtools-stats.json')
+
+You can also record a whole run, and get the summary when it ends::
+
+    from fabtools import instrument
+
+    instrument.start(json_file='fabtools-stats.json')
+
+"""
+
+from contextlib import contextmanager
+import atexit
+import json
+import os
+import sys
+import time
+
+import fabric.operations
+import fabric.sftp
+
+
+# Modules whose functions are never reported as callers
+_INTERNAL_MODULES = (
+    'fabtools.agent',
+    'fabtools.checks',
+    'fabtools.executor',
+    'fabtools.instrument',
+    'fabtools.tests',
+)
+
+# Active recorders
+_RECORDERS = []
+
+_ORIGINALS = {}
+
+
+class Recorder(object):
+    """
+    Collects the records of the remote operations.
+
+    Each record is a dict with the following keys:
+
+    - ``host``: the host key (see :py:func:`fabtools.utils.host_key`)
+    - ``kind``: ``'run'``, ``'sudo'``, ``'put'``, ``'get'`` or ``'agent'``
+    - ``function``: the fabtools function that made the operation
+    - ``caller``: the outermost fabtools function that led to it
+    - ``command``: the command, path or query
+    - ``time``: the wall time, in seconds
+    - ``sent`` and ``received``: the number of bytes transferred
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def summary(self, by='function'):
+        """
+        Aggregate the records by *by* (``'host'``, ``'function'``,
+        ``'caller'`` or ``'kind'``).
+
+        Returns a list of dicts (``name``, ``count``, ``time``, ``sent``,
+        ``received``), sorted by decreasing time.
+        """
+        groups = {}
+        for record in self.records:
+            name = record[by]
+            group = groups.setdefault(name, {
+                'name': name, 'count': 0, 'time': 0.0, 'sent': 0,
+                'received': 0,
+            })
+            group['count'] += 1
+            group['time'] += record['time']
+            group['sent'] += record['sent']
+            group['received'] += record['received']
+        return sorted(groups.values(), key=lambda group: -group['time'])
+
+    def to_json(self):
+        """
+        Export the summaries (by host, function and caller) and the
+        detailed records as a JSON string.
+        """
+        return json.dumps({
+            'total': self._total(),
+            'hosts': self.summary('host'),
+            'functions': self.summary('function'),
+            'callers': self.summary('caller'),
+            'records': self.records,
+        }, indent=2, sort_keys=True)
+
+    def write_json(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.to_json())
+
+    def table(self, by='function'):
+        """
+        Format the summary as a text table.
+        """
+        rows = [(group['name'] or '-', str(group['count']),
+                 '%.3f' % group['time'], str(group['sent']),
+                 str(group['received']))
+                for group in self.summary(by)]
+        total = self._total()
+        rows.append(('TOTAL', str(total['count']), '%.3f' % total['time'],
+                     str(total['sent']), str(total['received'])))
+        header = (by.upper(), 'CALLS', 'TIME (s)', 'SENT', 'RECEIVED')
+        widths = [max(len(row[i]) for row in [header] + rows)
+                  for i in range(len(header))]
+        lines = []
+        for row in [header] + rows:
+            cells = [row[0].ljust(widths[0])] + [
+                cell.rjust(width) for cell, width in zip(row[1:], widths[1:])
+            ]
+            lines.append('  '.join(cells))
+        return '\n'.join(lines)
+
+    def _total(self):
+        return {
+            'count': len(self.records),
+            'time': sum(record['time'] for record in self.records),
+            'sent': sum(record['sent'] for record in self.records),
+            'received': sum(record['received'] for record in self.records),
+        }
+
+
+def record(kind, command, duration, sent, received):
+    """
+    Add a record to the active recorders (if any).
+    """
+    if not _RECORDERS:
+        return
+    from fabtools.utils import host_key
+
+    function, caller = _callers()
+    entry = {
+        'host': host_key(),
+        'kind': kind,
+        'function': function,
+        'caller': caller,
+        'command': command,
+        'time': duration,
+        'sent': sent,
+        'received': received,
+    }
+    for recorder in _RECORDERS:
+        recorder.records.append(entry)
+
+
+@contextmanager
+def recording():
+    """
+    Context manager recording the remote operations made in the block.
+    """
+    recorder = Recorder()
+    _install()
+    _RECORDERS.append(recorder)
+    try:
+        yield recorder
+    finally:
+        _RECORDERS.remove(recorder)
+
+
+def start(json_file=None, table=True):
+    """
+    Start recording the remote operations until the end of the run.
+
+    When the process exits, the summary is printed as a text table
+    (unless *table* is ``False``), and written as JSON to *json_file*
+    (if given).
+
+    Returns the :py:class:`Recorder`.
+    """
+    recorder = Recorder()
+    _install()
+    _RECORDERS.append(recorder)
+
+    def report():
+        if table:
+            print(recorder.table())
+        if json_file:
+            recorder.write_json(json_file)
+
+    atexit.register(report)
+    return recorder
+
+
+def _take_records():
+    """
+    Remove and return the records gathered so far (used by the worker
+    processes of :py:func:`fabtools.executor.run_on_hosts`)
+    """
+    records = _RECORDERS[0].records if _RECORDERS else []
+    for recorder in _RECORDERS:
+        recorder.records = []
+    return records
+
+
+def _add_records(records):
+    for recorder in _RECORDERS:
+        recorder.records.extend(records)
+
+
+def _callers():
+    """
+    Find the innermost and outermost fabtools functions in the call stack
+    """
+    function = caller = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if (module.startswith('fabtools.') and
+                not module.startswith(_INTERNAL_MODULES) and
+                frame.f_code.co_name != 'run_as_root'):
+            name = '%s.%s' % (module, frame.f_code.co_name)
+            if function is None:
+                function = name
+            caller = name
+        frame = frame.f_back
+    return function, caller
+
+
+def _install():
+    """
+    Wrap Fabric's low-level functions (only once)
+    """
+    from fabtools import transport
+
+    if _ORIGINALS:
+        return
+    # Wrap the transport layer, so that all transports are recorded
+    transport._install()
+    _ORIGINALS['run_command'] = fabric.operations._run_command
+    _ORIGINALS['put'] = fabric.sftp.SFTP.put
+    _ORIGINALS['get'] = fabric.sftp.SFTP.get
+    fabric.operations._run_command = _run_command
+    fabric.sftp.SFTP.put = _put
+    fabric.sftp.SFTP.get = _get
+
+
+def _run_command(command, *args, **kwargs):
+    run_command = _ORIGINALS['run_command']
+    if not _RECORDERS:
+        return run_command(command, *args, **kwargs)
+    start = time.time()
+    result = None
+    try:
+        result = run_command(command, *args, **kwargs)
+        return result
+    finally:
+        received = 0
+        if result is not None:
+            received = len(result) + len(getattr(result, 'stderr', ''))
+        record(kwargs.get('sudo') and 'sudo' or 'run', command,
+               time.time() - start, len(command), received)
+
+
+def _put(sftp, local_path, remote_path, *args, **kwargs):
+    put = _ORIGINALS['put']
+    if not _RECORDERS:
+        return put(sftp, local_path, remote_path, *args, **kwargs)
+    start = time.time()
+    try:
+        return put(sftp, local_path, remote_path, *args, **kwargs)
+    finally:
+        record('put', remote_path, time.time() - start, _size(local_path), 0)
+
+
+def _get(sftp, remote_path, local_path, *args, **kwargs):
+    get = _ORIGINALS['get']
+    if not _RECORDERS:
+        return get(sftp, remote_path, local_path, *args, **kwargs)
+    start = time.time()
+    result = None
+    try:
+        result = get(sftp, remote_path, local_path, *args, **kwargs)
+        return result
+    finally:
+        target = result if isinstance(result, basestring) else local_path
+        record('get', remote_path, time.time() - start, 0, _size(target))
+
+
+def _size(path_or_file):
+    """
+    Size of a local file, given its path or a file-like object
+    (which has been read or written entirely)
+    """
+    try:
+        if isinstance(path_or_file, basestring):
+            return os.path.getsize(path_or_file)
+        return path_or_file.tell()
+    except (AttributeError, IOError, OSError):
+        return 0
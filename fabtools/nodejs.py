@@ -19,7 +19,7 @@ except ImportError:
 
 from fabric.api import cd, hide, run, settings
 
-from fabtools.system import cpus, distrib_family
+from fabtools.system import UnsupportedFamily, cpus
 from fabtools.utils import run_as_root
 
 
@@ -43,33 +43,26 @@ def install_from_source(version=DEFAULT_VERSION, checkinstall=False):
 
     """
 
-    from fabtools.require.deb import packages as require_deb_packages
-    from fabtools.require.rpm import packages as require_rpm_packages
+    from fabtools.deb import install_pending
     from fabtools.require import file as require_file
-
-    family = distrib_family()
-
-    if family == 'debian':
-        packages = [
-            'build-essential',
-            'libssl-dev',
-            'python',
-        ]
-        if checkinstall:
-            packages.append('checkinstall')
-        require_deb_packages(packages)
-
-    elif family == 'redhat':
-        packages = [
-            'gcc',
-            'gcc-c++',
-            'make',
-            'openssl-devel',
-            'python',
-        ]
-        if checkinstall:
-            packages.append('checkinstall')
-        require_rpm_packages(packages)
+    from fabtools.require import packages as require_packages
+
+    packages = {
+        'compiler': {'debian': 'build-essential',
+                     'redhat': ['gcc', 'gcc-c++', 'make']},
+        'openssl headers': {'debian': 'libssl-dev',
+                            'redhat': 'openssl-devel'},
+        'python': {'debian': 'python', 'redhat': 'python'},
+    }
+    if checkinstall:
+        packages['checkinstall'] = {'debian': 'checkinstall',
+                                    'redhat': 'checkinstall'}
+    try:
+        require_packages(packages)
+    except UnsupportedFamily:
+        # The build dependencies must already be there on other systems
+        pass
+    install_pending()
 
     filename = 'node-v%s.tar.gz' % version
     foldername = filename[0:-7]
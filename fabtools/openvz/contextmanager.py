@@ -33,6 +33,8 @@ from fabric.context_managers import (
     warn_only as warn_only_manager,
 )
 
+from fabtools import instrument
+
 
 @contextmanager
 def guest(name_or_ctid):
@@ -60,6 +62,10 @@ def guest(name_or_ctid):
     .. _put: http://docs.fabfile.org/en/1.4.3/api/core/operations.html#fabric.operations.put
     """
 
+    # Wrap the transport layer and the instrumentation, rather than be
+    # wrapped by them (so that they stay in place when the block ends)
+    instrument._install()
+
     # Monkey patch fabric operations
     _orig_run_command = fabric.operations._run_command
     _orig_put = fabric.sftp.SFTP.put
@@ -171,7 +177,9 @@ def guest(name_or_ctid):
     fabric.operations._run_command = run_guest_command
     fabric.sftp.SFTP.put = put_guest
 
-    yield
+    # Keep per-host caches (system facts...) separate for the guest
+    with settings(fabtools_guest=str(name_or_ctid)):
+        yield
 
     # Monkey unpatch
     fabric.operations._run_command = _orig_run_command
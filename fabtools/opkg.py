@@ -7,13 +7,13 @@ and repositories.
 
 """
 
-from fabric.api import hide, run, settings
-
-from fabtools.utils import run_as_root
+from fabtools.utils import PackageSnapshot, run_as_root
 
 
 MANAGER = 'opkg'
 
+PACKAGES_QUERY = 'opkg list-installed'
+
 
 def update_index(quiet=True):
     """
@@ -30,17 +30,53 @@ def upgrade():
     manager = MANAGER
     cmd = 'upgrade'
     run_as_root("%(manager)s %(cmd)s" % locals(), pty=False)
+    invalidate_installed_packages()
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed packages and their versions.
+
+    All the packages are listed using a single ``opkg list-installed`` command, the
+    first time they are needed for a given host. The snapshot is then
+    kept in memory, and updated by :py:func:`install` and
+    :py:func:`uninstall` (see :py:func:`invalidate_installed_packages`
+    if packages are managed by other means).
+
+    Returns a dict mapping package names to versions. It should not be
+    modified.
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be listed again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split(' - ')
+        if len(fields) >= 2:
+            installed[fields[0].strip()] = fields[1].strip()
+    return installed
+
+
+_SNAPSHOT = PackageSnapshot(PACKAGES_QUERY, _parse_installed)
 
 
 def is_installed(pkg_name):
     """
     Check if a package is installed.
+
+    This uses the snapshot of installed packages of the current host
+    (see :py:func:`installed_packages`).
     """
-    manager = MANAGER
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run("%(manager)s  status %(pkg_name)s" % locals())
-        return len(res) > 0
+    return _SNAPSHOT.is_installed(pkg_name)
 
 
 def install(packages, update=False, options=None):
@@ -77,7 +113,7 @@ def install(packages, update=False, options=None):
     options.append("--verbosity=0")
     options = " ".join(options)
     cmd = '%(manager)s install %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, True, run_as_root, cmd, pty=False)
 
 
 def uninstall(packages, options=None):
@@ -94,4 +130,4 @@ def uninstall(packages, options=None):
         packages = " ".join(packages)
     options = " ".join(options)
     cmd = '%(manager)s %(command)s %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, False, run_as_root, cmd, pty=False)
@@ -8,27 +8,41 @@ This module provides tools to manage `SmartOS`_ packages.
 
 """
 
+from pipes import quote
+import re
+
 from fabric.api import hide, quiet, run, settings
 
 from fabtools.files import is_file
-from fabtools.utils import run_as_root
+from fabtools.utils import PackageSnapshot, run_as_root
 
 
 MANAGER = 'pkgin'
 
+# Parsable output: "<name>-<version>;<description>"
+PACKAGES_QUERY = 'pkgin -p list'
+
+# Touched after each successful index update
+UPDATE_STAMP = '/var/lib/fabtools/pkgin-update-success-stamp'
+
+# Package patterns (such as "redis>=7" or "py3*-pip") understood by pkg_info
+PATTERN_RE = re.compile(r'[*?\[{<>=]')
+
 
 def update_index(force=False):
     """
     Update pkgin package definitions.
     """
     manager = MANAGER
+    stamp = UPDATE_STAMP
+    touch = 'mkdir -p /var/lib/fabtools && touch %(stamp)s' % locals()
     if force:
         with quiet():
             # clean the package cache
             run_as_root("%(manager)s clean" % locals())
-        run_as_root("%(manager)s -f update" % locals())
+        run_as_root("%(manager)s -f update && %(touch)s" % locals())
     else:
-        run_as_root("%(manager)s update" % locals())
+        run_as_root("%(manager)s update && %(touch)s" % locals())
 
 
 def upgrade(full=False):
@@ -39,15 +53,65 @@ def upgrade(full=False):
     cmds = {'pkgin': {False: 'uprade', True: 'full-upgrade'}}
     cmd = cmds[manager][full]
     run_as_root("%(manager)s -y %(cmd)s" % locals())
+    invalidate_installed_packages()
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed packages and their versions.
+
+    All the packages are listed using a single ``pkgin list`` command, the
+    first time they are needed for a given host. The snapshot is then
+    kept in memory, and updated by :py:func:`install` and
+    :py:func:`uninstall` (see :py:func:`invalidate_installed_packages`
+    if packages are managed by other means).
+
+    Returns a dict mapping package names to versions. It should not be
+    modified.
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be listed again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        fullname = line.partition(';')[0].strip()
+        name, sep, version = fullname.rpartition('-')
+        if sep:
+            installed[name] = version
+            # Packages may also be checked along with their version
+            installed[fullname] = version
+    return installed
+
+
+_SNAPSHOT = PackageSnapshot(PACKAGES_QUERY, _parse_installed)
 
 
 def is_installed(pkg_name):
     """
     Check if a package is installed.
+
+    This uses the snapshot of installed packages of the current host
+    (see :py:func:`installed_packages`). Package patterns (such as
+    ``redis>=7``) are checked using ``pkg_info -e``.
     """
-    with settings(warn_only=True):
-        res = run('pkg_info -e %s' % pkg_name)
-        return res.succeeded is True
+    if _SNAPSHOT.is_installed(pkg_name):
+        return True
+    if not PATTERN_RE.search(pkg_name):
+        return False
+    pkg_name = quote(pkg_name)
+    with settings(
+            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
+        res = run('pkg_info -e %(pkg_name)s' % locals())
+    return res.succeeded
 
 
 def install(packages, update=False, yes=None, options=None):
@@ -87,11 +151,11 @@ def install(packages, update=False, yes=None, options=None):
     options.append("-y")
     options = " ".join(options)
     if isinstance(yes, str):
-        run_as_root(
-            'yes %(yes)s | %(manager)s %(options)s install %(packages)s'
-            % locals())
+        cmd = ('yes %(yes)s | %(manager)s %(options)s install %(packages)s'
+               % locals())
     else:
-        run_as_root('%(manager)s %(options)s install %(packages)s' % locals())
+        cmd = '%(manager)s %(options)s install %(packages)s' % locals()
+    _SNAPSHOT.run(packages, True, run_as_root, cmd)
 
 
 def uninstall(packages, orphan=False, options=None):
@@ -114,7 +178,9 @@ def uninstall(packages, orphan=False, options=None):
     options = " ".join(options)
     if orphan:
         run_as_root('%(manager)s -y autoremove' % locals())
-    run_as_root('%(manager)s %(options)s remove %(packages)s' % locals())
+        invalidate_installed_packages()
+    cmd = '%(manager)s %(options)s remove %(packages)s' % locals()
+    _SNAPSHOT.run(packages, False, run_as_root, cmd)
 
 
 def smartos_build():
@@ -14,29 +14,180 @@ import re
 
 from fabric.api import hide, run, settings
 
-from fabtools.utils import run_as_root
+from fabtools.utils import PackageSnapshot, run_as_root
 
 
 MANAGER = 'emerge --color n'
 
+# Touched after each successful tree synchronization
+UPDATE_STAMP = '/var/lib/fabtools/portage-update-success-stamp'
+
+# List the installed packages from the Portage database ("vdb"), in the
+# same "category/name-version" format as ``qlist -ICv``
+PACKAGES_QUERY = "cd /var/db/pkg && printf '%s\\n' */*"
+
+VERSION_RE = re.compile(
+    r'^(?P<numbers>\d+(?:\.\d+)*)(?P<letter>[a-z]?)'
+    r'(?P<suffixes>(?:_(?:alpha|beta|pre|rc|p)\d*)*)'
+    r'(?:-r(?P<revision>\d+))?$')
+
+ATOM_RE = re.compile(r'^(?P<operator>[<>]=?|=|~)?(?P<package>[^:\[\]]+?)'
+                     r'(?P<wildcard>\*)?$')
+
+# Order of the version suffixes (no suffix sorts between _rc and _p)
+_SUFFIXES = {'alpha': 0, 'beta': 1, 'pre': 2, 'rc': 3, '': 4, 'p': 5}
+
 
 def update_index(quiet=True):
     """
     Update Portage package definitions.
     """
     manager = MANAGER
+    stamp = UPDATE_STAMP
+    cmd = ('%(manager)s --sync && mkdir -p /var/lib/fabtools && '
+           'touch %(stamp)s' % locals())
 
     if quiet:
         with settings(hide('running', 'stdout', 'stderr', 'warnings'),
                       warn_only=True):
-            run_as_root("%(manager)s --sync" % locals())
+            run_as_root(cmd)
     else:
-        run_as_root("%(manager)s --sync" % locals())
+        run_as_root(cmd)
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed Portage packages and their versions.
+
+    All the packages are read from the Portage database (``/var/db/pkg``)
+    using a single command, the first time they are needed for a given
+    host. The snapshot is then kept in memory, and updated by
+    :py:func:`install` and :py:func:`uninstall` (see
+    :py:func:`invalidate_installed_packages` if packages are managed by
+    other means).
+
+    Returns a dict mapping qualified package names (such as
+    ``dev-db/redis``) to the list of their installed versions (one per
+    slot). It should not be modified.
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be read again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        category, _, pf = line.strip().partition('/')
+        # Skip the partially merged packages ("-MERGING-foo-1.0")
+        if not pf or pf.startswith('-'):
+            continue
+        name, version = _split_version(pf)
+        if version is not None:
+            installed.setdefault('%s/%s' % (category, name), []).append(
+                version)
+    return installed
+
+
+_SNAPSHOT = PackageSnapshot(PACKAGES_QUERY, _parse_installed)
+
+
+def _split_version(pf):
+    """
+    Split "name-version" at the first hyphen followed by a valid version
+    """
+    parts = pf.split('-')
+    for i in range(1, len(parts)):
+        version = '-'.join(parts[i:])
+        if VERSION_RE.match(version):
+            return '-'.join(parts[:i]), version
+    return pf, None
+
+
+def _version_key(version):
+    """
+    Sort key of a Portage version (e.g. ``1.2.3b_rc1-r2``)
+    """
+    match = VERSION_RE.match(version)
+    numbers = tuple(int(n) for n in match.group('numbers').split('.'))
+    suffixes = tuple(
+        (_SUFFIXES[name], int(num or 0))
+        for name, num in re.findall(r'_([a-z]+)(\d*)',
+                                    match.group('suffixes'))
+    ) + ((_SUFFIXES[''], 0),)
+    return (numbers, match.group('letter'), suffixes,
+            int(match.group('revision') or 0))
 
 
 def is_installed(pkg_name):
     """
     Check if a Portage package is installed.
+
+    The package may be given as a name (``redis``), a qualified name
+    (``dev-db/redis``), or an atom with a version (``=dev-db/redis-7.0.11``,
+    ``>=redis-7``, ``~redis-7.0.11``, ``=redis-7.0*``). This uses the
+    snapshot of installed packages of the current host (see
+    :py:func:`installed_packages`).
+
+    Atoms with slot or USE dependencies cannot be resolved locally, and
+    are checked using ``emerge --pretend``.
+    """
+    state = _SNAPSHOT.change(pkg_name)
+    if state is not None:
+        return state
+
+    match = ATOM_RE.match(pkg_name)
+    if match is None:
+        return _emerge_check(pkg_name)
+    operator, package, wildcard = match.group('operator', 'package',
+                                              'wildcard')
+    if operator:
+        name, version = _split_version(package)
+        if version is None or (wildcard and operator != '='):
+            return _emerge_check(pkg_name)
+    elif wildcard:
+        return _emerge_check(pkg_name)
+    else:
+        name, version = package, None
+
+    installed = installed_packages()
+    if '/' in name:
+        versions = installed.get(name, [])
+    else:
+        suffix = '/' + name
+        versions = [v for cp, vs in installed.items() if cp.endswith(suffix)
+                    for v in vs]
+    if version is None:
+        return bool(versions)
+    return any(_version_matches(v, operator, version, wildcard)
+               for v in versions)
+
+
+def _version_matches(installed, operator, version, wildcard):
+    if wildcard:
+        return installed.startswith(version)
+    if operator == '~':
+        return installed.partition('-r')[0] == version.partition('-r')[0]
+    if operator == '=':
+        return _version_key(installed) == _version_key(version)
+    cmp_ = cmp(_version_key(installed), _version_key(version))
+    return {
+        '<': cmp_ < 0,
+        '<=': cmp_ <= 0,
+        '>': cmp_ > 0,
+        '>=': cmp_ >= 0,
+    }[operator]
+
+
+def _emerge_check(pkg_name):
+    """
+    Check if a package is installed using the dependency resolver
     """
     manager = MANAGER
 
@@ -53,7 +204,7 @@ def is_installed(pkg_name):
         pkg_name = pkg_name[1:]
 
     match = re.search(
-        r"\n\[ebuild +(?P<code>\w+) *\] .*%(pkg_name)s.*" % locals(),
+        r"\n\[ebuild +(?P<code>\w+) *\] .*%s.*" % re.escape(pkg_name),
         res.stdout)
     if match and match.groupdict()["code"] in ("U", "R"):
         return True
@@ -96,7 +247,7 @@ def install(packages, update=False, options=None):
         packages = " ".join(packages)
 
     cmd = '%(manager)s %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, True, run_as_root, cmd, pty=False)
 
 
 def uninstall(packages, options=None):
@@ -114,4 +265,4 @@ def uninstall(packages, options=None):
         packages = " ".join(packages)
 
     cmd = '%(manager)s --unmerge %(options)s %(packages)s' % locals()
-    run_as_root(cmd, pty=False)
+    _SNAPSHOT.run(packages, False, run_as_root, cmd, pty=False)
@@ -17,15 +17,24 @@ import os
 import posixpath
 import re
 
-from fabric.api import cd, hide, prefix, run, settings, sudo
+from fabric.api import cd, env, hide, prefix, run, settings, sudo
 from fabric.utils import puts
 
 from fabtools.files import is_file
-from fabtools.utils import abspath, download, run_as_root
+from fabtools.utils import (
+    abspath,
+    download,
+    host_cache,
+    host_key,
+    run_as_root,
+)
 
 
 GET_PIP_URL = 'https://bootstrap.pypa.io/pip/2.7/get-pip.py'
 
+# Installed packages of each (pip command, virtual environment)
+_INVENTORIES = host_cache()
+
 
 def is_pip_installed(version=None, pip_cmd='pip'):
     """
@@ -89,7 +98,11 @@ def is_installed(package, pip_cmd='pip'):
     """
     Check if a Python package is installed (using pip).
 
-    Package names are case insensitive.
+    Package names are case insensitive. A version may be required using
+    ``name==version``.
+
+    This uses the inventory of the installed packages (see
+    :py:func:`installed_packages`).
 
     Example::
 
@@ -102,11 +115,70 @@ def is_installed(package, pip_cmd='pip'):
 
     .. _pip: http://www.pip-installer.org/
     """
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run('%(pip_cmd)s freeze' % locals())
-    packages = [line.split('==')[0].lower() for line in res.splitlines()]
-    return (package.lower() in packages)
+    name, _, version = package.partition('==')
+    name = _normalize(name)
+    installed = installed_packages(pip_cmd=pip_cmd)
+    if name not in installed:
+        return False
+    # Packages installed from an URL have no version
+    return not version or installed[name] == version.strip()
+
+
+def installed_packages(pip_cmd='pip', refresh=False):
+    """
+    Get the installed Python packages and their versions (using pip).
+
+    The packages are listed using a single ``pip freeze`` command, the
+    first time they are needed for a given host, pip command and active
+    virtual environment (see :py:func:`virtualenv`). The inventory is
+    then kept in memory, until packages are installed using
+    :py:func:`install` or :py:func:`install_requirements` (see
+    :py:func:`invalidate_installed_packages` if packages are managed by
+    other means).
+
+    Returns a dict mapping normalized package names (lowercase, with
+    runs of ``-``, ``_`` and ``.`` replaced by ``-``) to versions (or
+    ``None`` for packages installed from an URL). It should not be
+    modified.
+    """
+    inventories = _INVENTORIES.setdefault(host_key(), {})
+    key = (pip_cmd, tuple(env.command_prefixes), env.cwd)
+    if refresh or key not in inventories:
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run('%(pip_cmd)s freeze' % locals())
+        inventories[key] = _parse_freeze(res)
+    return inventories[key]
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed Python packages of the current host, so that
+    they will be listed again when needed.
+    """
+    _INVENTORIES.pop(host_key(), None)
+
+
+def _parse_freeze(output):
+    installed = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if line.startswith('-e '):
+            # Editable package: "-e git+https://...#egg=name"
+            name, version = line.rpartition('#egg=')[2], None
+        elif ' @ ' in line:
+            # Package installed from an URL: "name @ file:///..."
+            name, version = line.split(' @ ')[0], None
+        elif '==' in line:
+            name, _, version = line.partition('==')
+        else:
+            continue
+        installed[_normalize(name)] = version
+    return installed
+
+
+def _normalize(name):
+    return re.sub(r'[-_.]+', '-', name.strip()).lower()
 
 
 def install(packages, upgrade=False, download_cache=None, allow_external=None,
@@ -167,10 +239,13 @@ def install(packages, upgrade=False, download_cache=None, allow_external=None,
 
     command = '%(pip_cmd)s install %(options)s %(packages)s' % locals()
 
-    if use_sudo:
-        sudo(command, user=user, pty=False)
-    else:
-        run(command, pty=False)
+    try:
+        if use_sudo:
+            sudo(command, user=user, pty=False)
+        else:
+            run(command, pty=False)
+    finally:
+        invalidate_installed_packages()
 
 
 def install_requirements(filename, upgrade=False, download_cache=None,
@@ -211,10 +286,13 @@ def install_requirements(filename, upgrade=False, download_cache=None,
 
     command = '%(pip_cmd)s install %(options)s -r %(filename)s' % locals()
 
-    if use_sudo:
-        sudo(command, user=user, pty=False)
-    else:
-        run(command, pty=False)
+    try:
+        if use_sudo:
+            sudo(command, user=user, pty=False)
+        else:
+            run(command, pty=False)
+    finally:
+        invalidate_installed_packages()
 
 
 def create_virtualenv(directory, system_site_packages=False, venv_python=None,
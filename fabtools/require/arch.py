@@ -8,10 +8,14 @@ and repositories.
 """
 
 from fabtools.arch import (
+    UPDATE_STAMP,
     install,
     is_installed,
     uninstall,
+    update_index,
 )
+from fabtools.files import age
+from fabtools.utils import to_seconds
 
 
 def package(pkg_name, update=False):
@@ -78,3 +82,29 @@ def nopackages(pkg_list):
     pkg_list = [pkg for pkg in pkg_list if is_installed(pkg)]
     if pkg_list:
         uninstall(pkg_list)
+
+
+def uptodate_index(quiet=True, max_age=86400):
+    """
+    Require an up-to-date package index.
+
+    This will update the package index (using ``pacman -Sy``) if the last
+    successful update occured more than *max_age* ago. The age check
+    uses a single remote command.
+
+    *max_age* can be specified either as an integer (a value in seconds),
+    or as a dictionary whose keys are units (``seconds``, ``minutes``,
+    ``hours``, ``days``, ``weeks``, ``months``) and values are integers.
+    The default value is 1 day.
+
+    Example::
+
+        from fabtools import require
+
+        # Update index if last time was more than 1 day ago
+        require.arch.uptodate_index(max_age={'day': 1})
+
+    """
+    update_age = age(UPDATE_STAMP)
+    if update_age is None or update_age > to_seconds(max_age):
+        update_index(quiet=quiet)
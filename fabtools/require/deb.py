@@ -10,18 +10,21 @@ and repositories.
 from fabric.utils import puts
 
 from fabtools.deb import (
+    BUNDLE_DIR,
+    UPDATE_STAMP,
     add_apt_key,
     apt_key_exists,
     install,
+    install_bundle,
+    installed_packages,
+    install_pending,
     is_installed,
     uninstall,
     update_index,
-    last_update_time,
 )
-from fabtools.files import is_file, watch
+from fabtools.files import age, is_file, watch
 from fabtools.system import distrib_codename, distrib_release
-from fabtools.utils import run_as_root
-from fabtools import system
+from fabtools.utils import run_as_root, to_seconds
 
 
 def key(keyid, filename=None, url=None, keyserver='subkeys.pgp.net',
@@ -113,11 +116,12 @@ def ppa(name, auto_accept=True, keyserver=None):
 
     if not is_file(source):
         package('python-software-properties')
+        install_pending()
         run_as_root('add-apt-repository %(auto_accept)s %(keyserver)s %(name)s' % locals(), pty=False)
         update_index()
 
 
-def package(pkg_name, update=False, version=None):
+def package(pkg_name, update=False, version=None, fast=None):
     """
     Require a deb package to be installed.
 
@@ -133,10 +137,10 @@ def package(pkg_name, update=False, version=None):
 
     """
     if not is_installed(pkg_name):
-        install(pkg_name, update=update, version=version)
+        install(pkg_name, update=update, version=version, fast=fast)
 
 
-def packages(pkg_list, update=False):
+def packages(pkg_list, update=False, fast=None):
     """
     Require several deb packages to be installed.
 
@@ -149,10 +153,41 @@ def packages(pkg_list, update=False):
             'bar',
             'baz',
         ])
+
+    If *fast* is ``True``, the missing packages are installed in fast
+    mode (see :py:func:`fabtools.deb.install`).
     """
+    # The installed packages are listed using a single remote command
     pkg_list = [pkg for pkg in pkg_list if not is_installed(pkg)]
     if pkg_list:
-        install(pkg_list, update)
+        install(pkg_list, update, fast=fast)
+
+
+def bundle(bundle, remote_dir=BUNDLE_DIR, fast=None):
+    """
+    Require the packages of a bundle built on the controlling machine
+    (see :py:func:`fabtools.deb.build_bundle`) to be installed.
+
+    Only the packages that are not installed yet (with the same version)
+    are considered. Their files are uploaded to *remote_dir*, unless they
+    are already there with the same checksum, then installed using a
+    single ``apt-get install`` command.
+
+    Example::
+
+        from fabtools import require
+        from fabtools.deb import Bundle
+
+        require.deb.bundle(Bundle.load('bundle.json'))
+
+    """
+    installed = installed_packages()
+    missing = [
+        pkg for pkg in bundle.packages
+        if installed.get('%(name)s:%(arch)s' % pkg) != pkg['version']
+    ]
+    if missing:
+        install_bundle(bundle, missing, remote_dir, fast)
 
 
 def nopackage(pkg_name):
@@ -188,34 +223,6 @@ def nopackages(pkg_list):
         uninstall(pkg_list)
 
 
-def _to_seconds(var):
-    sec = 0
-    MINUTE = 60
-    HOUR = 60 * MINUTE
-    DAY = 24 * HOUR
-    WEEK = 7 * DAY
-    MONTH = 31 * DAY
-    try:
-        for key, value in var.items():
-            if key in ('second', 'seconds'):
-                sec += value
-            elif key in ('minute', 'minutes'):
-                sec += value * MINUTE
-            elif key in ('hour', 'hours'):
-                sec += value * HOUR
-            elif key in ('day', 'days'):
-                sec += value * DAY
-            elif key in ('week', 'weeks'):
-                sec += value * WEEK
-            elif key in ('month', 'months'):
-                sec += value * MONTH
-            else:
-                raise ValueError("Unknown time unit '%s'" % key)
-        return sec
-    except AttributeError:
-        return var
-
-
 def uptodate_index(quiet=True, max_age=86400):
     """
     Require an up-to-date package index.
@@ -242,8 +249,9 @@ def uptodate_index(quiet=True, max_age=86400):
 
     from fabtools.require import file as require_file
     require_file('/etc/apt/apt.conf.d/15fabtools-update-stamp', contents='''\
-APT::Update::Post-Invoke-Success {"touch /var/lib/apt/periodic/fabtools-update-success-stamp 2>/dev/null || true";};
-''', use_sudo=True)
+APT::Update::Post-Invoke-Success {"touch %s 2>/dev/null || true";};
+''' % UPDATE_STAMP, use_sudo=True)
 
-    if system.time() - last_update_time() > _to_seconds(max_age):
+    update_age = age(UPDATE_STAMP)
+    if update_age is None or update_age > to_seconds(max_age):
         update_index(quiet=quiet)
@@ -13,22 +13,22 @@ from urlparse import urlparse
 import hashlib
 import os
 
-from fabric.api import hide, put, run, settings
+from fabric.api import abort, hide, put, run, settings
 
 from fabtools.files import (
-    group as _group,
-    is_file,
-    is_dir,
+    checksum,
+    checksum_algorithm,
     md5sum,
-    mode as _mode,
-    owner as _owner,
+    stat_many,
     umask,
 )
-from fabtools.utils import run_as_root
+from fabtools.utils import host_cache, host_key, run_as_root
 
 
 BLOCKSIZE = 2 ** 20  # 1MB
 
+_ROOT_UMASK = host_cache()
+
 
 def directory(path, use_sudo=False, owner='', group='', mode=''):
     """
@@ -46,20 +46,16 @@ def directory(path, use_sudo=False, owner='', group='', mode=''):
     """
     func = use_sudo and run_as_root or run
 
-    if not is_dir(path):
+    info = stat_many([path], use_sudo)[path]
+    if info is None or info['type'] != 'directory':
         func('mkdir -p "%(path)s"' % locals())
+        info = None
 
-    # Ensure correct owner
-    if (owner and _owner(path, use_sudo) != owner) or \
-       (group and _group(path, use_sudo) != group):
-        func('chown %(owner)s:%(group)s "%(path)s"' % locals())
-
-    # Ensure correct mode
-    if mode and _mode(path, use_sudo) != mode:
-        func('chmod %(mode)s "%(path)s"' % locals())
+    _ensure_attributes(path, info, owner, group, mode, use_sudo)
 
 
-def directories(path_list, use_sudo=False, owner='', group='', mode=''):
+def directories(path_list, use_sudo=False, owner='', group='', mode='',
+                batch=False):
     """
     Require a list of directories to exist.
 
@@ -73,13 +69,104 @@ def directories(path_list, use_sudo=False, owner='', group='', mode=''):
         ]
         require.directories(dirs, owner='alice', mode='750')
 
+    If *batch* is ``True``, all the directories are checked and fixed
+    using a single remote script, which only creates the missing
+    directories and fixes the wrong owners and modes. In this case, the
+    function returns a dict mapping each path to the list of changes
+    that were made (``'created'``, ``'owner'``, ``'mode'``)::
+
+        from fabtools import require
+
+        changes = require.directories(dirs, owner='alice', batch=True)
+        created = [path for path in dirs if 'created' in changes[path]]
+
     .. note:: This function can be accessed directly from the
               ``fabtools.require`` module for convenience.
     """
+    if batch:
+        return _directories_batch(path_list, use_sudo, owner, group, mode)
     for path in path_list:
         directory(path, use_sudo, owner, group, mode)
 
 
+DIRECTORIES_SCRIPT = """\
+if stat -c %%n / >/dev/null 2>&1; then
+    _stat() { stat -L -c '%%U %%G %%a' "$1"; }
+else
+    _stat() { stat -L -f '%%Su %%Sg %%OLp' "$1"; }
+fi
+_require() {
+    res=""
+    if [ ! -d "$2" ]; then
+        if mkdir -p "$2"; then res="$res created"; else res="$res !created"; fi
+    fi
+    set -- "$1" "$2" $(_stat "$2")
+    if [ -n "$_owner" -a "$3" != "$_owner" ] || [ -n "$_group" -a "$4" != "$_group" ]; then
+        if chown "$_owner:$_group" "$2"; then res="$res owner"; else res="$res !owner"; fi
+    fi
+    if [ -n "$_mode" ] && [ "$5" != "$_octal_mode" ]; then
+        if chmod "$_mode" "$2"; then res="$res mode"; else res="$res !mode"; fi
+    fi
+    echo "fabtools:$1:$res"
+}
+_owner=%(owner)s
+_group=%(group)s
+_mode=%(mode)s
+_octal_mode=%(octal_mode)s
+i=0
+for p in %(paths)s; do
+    _require $i "$p"
+    i=$((i + 1))
+done"""
+
+
+def _directories_batch(path_list, use_sudo, owner, group, mode):
+    """
+    Require several directories using a single remote script
+    """
+    func = use_sudo and run_as_root or run
+
+    path_list = list(path_list)
+    if not path_list:
+        return {}
+
+    # Symbolic modes cannot be compared, so they are always applied
+    try:
+        octal_mode = '%o' % int(str(mode), 8) if mode else ''
+    except ValueError:
+        octal_mode = ''
+
+    script = DIRECTORIES_SCRIPT % {
+        'owner': quote(owner or ''),
+        'group': quote(group or ''),
+        'mode': quote(mode or ''),
+        'octal_mode': quote(octal_mode),
+        'paths': ' '.join(quote(path) for path in path_list),
+    }
+    with settings(hide('stdout'), warn_only=True):
+        res = func(script)
+
+    changes = {}
+    failures = []
+    for line in res.splitlines():
+        if not line.startswith('fabtools:'):
+            continue
+        _, index, result = line.split(':', 2)
+        path = path_list[int(index)]
+        changes[path] = []
+        for change in result.split():
+            if change.startswith('!'):
+                failures.append('%s (%s)' % (path, change[1:]))
+            else:
+                changes[path].append(change)
+
+    missing = [name for name in path_list if name not in changes]
+    if failures or missing:
+        abort('Could not require directories: %s' % ', '.join(failures + missing))
+
+    return changes
+
+
 def file(path=None, contents=None, source=None, url=None, md5=None,
          use_sudo=False, owner=None, group='', mode=None, verify_remote=True,
          temp_dir='/tmp'):
@@ -112,7 +199,9 @@ def file(path=None, contents=None, source=None, url=None, md5=None,
     will be used to check whether the remote file is the same as the
     source. If this is ``False``, the file will be assumed to be the
     same if it is present. This is useful for very large files, where
-    generating an MD5 sum may take a while.
+    generating an MD5 sum may take a while. A faster algorithm may be
+    selected using ``env.fabtools_checksum_algorithm`` (see
+    :py:func:`fabtools.files.checksum_algorithm`).
 
     When providing either the *contents* or the *source* parameter, Fabric's
     ``put`` function will be used to upload the file to the remote host.
@@ -132,19 +221,25 @@ def file(path=None, contents=None, source=None, url=None, md5=None,
     """
     func = use_sudo and run_as_root or run
 
+    if url and not path:
+        path = os.path.basename(urlparse(url).path)
+
+    # Get all the current attributes of the file at once
+    info = stat_many([path], use_sudo)[path]
+    exists = info is not None and info['type'] == 'file'
+
     # 1) Only a path is given
-    if path and not (contents or source or url):
+    if not (contents or source or url):
         assert path
-        if not is_file(path):
+        if not exists:
             func('touch "%(path)s"' % locals())
+            info = None
 
     # 2) A URL is specified (path is optional)
     elif url:
-        if not path:
-            path = os.path.basename(urlparse(url).path)
-
-        if not is_file(path) or md5 and md5sum(path) != md5:
+        if not exists or md5 and md5sum(path) != md5:
             func('wget --progress=dot:mega %(url)s -O %(path)s' % locals())
+            info = None
 
     # 3) A local filename, or a content string, is specified
     else:
@@ -158,8 +253,9 @@ def file(path=None, contents=None, source=None, url=None, md5=None,
             t.close()
 
         if verify_remote:
+            algorithm = checksum_algorithm()
             # Avoid reading the whole file into memory at once
-            digest = hashlib.md5()
+            digest = hashlib.new(algorithm)
             f = open(source, 'rb')
             try:
                 while True:
@@ -172,27 +268,64 @@ def file(path=None, contents=None, source=None, url=None, md5=None,
         else:
             digest = None
 
-        if (not is_file(path, use_sudo=use_sudo) or
+        if (not exists or
                 (verify_remote and
-                    md5sum(path, use_sudo=use_sudo) != digest.hexdigest())):
+                    checksum(path, algorithm, use_sudo=use_sudo) != digest.hexdigest())):
             with settings(hide('running')):
                 put(source, path, use_sudo=use_sudo, temp_dir=temp_dir)
+            info = None
 
         if t is not None:
             os.unlink(source)
 
-    # Ensure correct owner
+    # Ensure correct owner and mode
     if use_sudo and owner is None:
         owner = 'root'
-    if (owner and _owner(path, use_sudo) != owner) or \
-       (group and _group(path, use_sudo) != group):
-        func('chown %(owner)s:%(group)s "%(path)s"' % locals())
-
-    # Ensure correct mode
     if use_sudo and mode is None:
-        mode = oct(0666 & ~int(umask(use_sudo=True), base=8))
-    if mode and _mode(path, use_sudo) != mode:
-        func('chmod %(mode)s "%(path)s"' % locals())
+        mode = oct(0666 & ~int(_root_umask(), base=8))
+    _ensure_attributes(path, info, owner, group, mode, use_sudo)
+
+
+def _root_umask():
+    """
+    Get root's umask (only once per host, as it is not expected to change)
+    """
+    key = host_key()
+    if key not in _ROOT_UMASK:
+        _ROOT_UMASK[key] = umask(use_sudo=True)
+    return _ROOT_UMASK[key]
+
+
+def _ensure_attributes(path, info, owner, group, mode, use_sudo):
+    """
+    Fix the owner, group and mode of a path, using a single command.
+
+    *info* is the result of :py:func:`fabtools.files.stat_many` for this
+    path, or ``None`` if the attributes are unknown (for instance, because
+    the path has just been created). In this case, all the required
+    attributes are set.
+    """
+    func = use_sudo and run_as_root or run
+
+    commands = []
+    if (owner and (info is None or info['owner'] != owner)) or \
+       (group and (info is None or info['group'] != group)):
+        commands.append('chown %s:%s "%s"' % (owner or '', group or '', path))
+    if mode and (info is None or not _same_mode(info['mode'], mode)):
+        commands.append('chmod %s "%s"' % (mode, path))
+
+    if commands:
+        func(' && '.join(commands))
+
+
+def _same_mode(current, required):
+    """
+    Compare octal modes, so that ``'0755'`` and ``'755'`` are the same
+    """
+    try:
+        return int(current, 8) == int(str(required), 8)
+    except ValueError:
+        return current == required
 
 
 def template_file(path=None, template_contents=None, template_source=None,
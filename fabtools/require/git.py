@@ -28,6 +28,7 @@ def command():
         run('git --help')
 
     """
+    from fabtools.deb import install_pending
     from fabtools.require.deb import package as require_deb_package
     from fabtools.require.pkg import package as require_pkg_package
     from fabtools.require.rpm import package as require_rpm_package
@@ -38,6 +39,7 @@ def command():
         family = distrib_family()
         if family == 'debian':
             require_deb_package('git-core')
+            install_pending()
         elif family == 'redhat':
             require_rpm_package('git')
         elif family == 'sun':
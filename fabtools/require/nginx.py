@@ -16,7 +16,7 @@ from fabric.api import (
 )
 from fabric.colors import red
 
-from fabtools.deb import is_installed
+from fabtools.deb import install_pending, is_installed
 from fabtools.files import is_link
 from fabtools.nginx import disable, enable
 from fabtools.service import reload as reload_service
@@ -53,6 +53,7 @@ def _server_debian(package_name):
     from fabtools.require.deb import package as require_deb_package
 
     require_deb_package(package_name)
+    install_pending()
     require_started('nginx')
 
 
@@ -23,7 +23,6 @@ from fabtools.python_setuptools import (
     install_setuptools,
     is_setuptools_installed,
 )
-from fabtools.system import UnsupportedFamily, distrib_family
 
 
 MIN_SETUPTOOLS_VERSION = '0.7'
@@ -40,21 +39,19 @@ def setuptools(version=MIN_SETUPTOOLS_VERSION, python_cmd='python'):
     .. _setuptools: http://pythonhosted.org/setuptools/
     """
 
-    from fabtools.require.deb import package as require_deb_package
-    from fabtools.require.rpm import package as require_rpm_package
+    from fabtools.deb import install_pending
+    from fabtools.require import packages as require_packages
 
     if not is_setuptools_installed(python_cmd=python_cmd):
-        family = distrib_family()
-
-        if family == 'debian':
-            require_deb_package('python-dev')
-        elif family == 'redhat':
-            require_rpm_package('python-devel')
-        elif family == 'arch':
-            pass  # ArchLinux installs header with base package
-        else:
-            raise UnsupportedFamily(supported=['debian', 'redhat', 'arch'])
-
+        require_packages({
+            'python headers': {
+                'debian': 'python-dev',
+                'redhat': 'python-devel',
+                # ArchLinux installs header with base package
+                'arch': None,
+            },
+        })
+        install_pending()
         install_setuptools(python_cmd=python_cmd)
 
 
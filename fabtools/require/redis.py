@@ -11,7 +11,7 @@ This module provides high-level tools for managing `Redis`_ instances.
 from fabric.api import cd, run, settings
 
 from fabtools.files import is_file, watch
-from fabtools.system import distrib_family
+from fabtools.system import UnsupportedFamily
 from fabtools.utils import run_as_root
 import fabtools.supervisor
 
@@ -34,24 +34,23 @@ def installed_from_source(version=VERSION):
 
     The compiled binaries will be installed in ``/opt/redis-{version}/``.
     """
+    from fabtools.deb import install_pending
     from fabtools.require import directory as require_directory
     from fabtools.require import file as require_file
+    from fabtools.require import packages as require_packages
     from fabtools.require import user as require_user
-    from fabtools.require.deb import packages as require_deb_packages
-    from fabtools.require.rpm import packages as require_rpm_packages
 
-    family = distrib_family()
-
-    if family == 'debian':
-        require_deb_packages([
-            'build-essential',
-        ])
-
-    elif family == 'redhat':
-        require_rpm_packages([
-            'gcc',
-            'make',
-        ])
+    try:
+        require_packages({
+            'compiler': {
+                'debian': 'build-essential',
+                'redhat': ['gcc', 'make'],
+            },
+        })
+    except UnsupportedFamily:
+        # The compiler must already be there on other systems
+        pass
+    install_pending()
 
     require_user('redis', home='/var/lib/redis', system=True)
     require_directory('/var/lib/redis', owner='redis', use_sudo=True)
@@ -8,13 +8,17 @@ packages and repositories.
 """
 
 from fabric.api import hide, settings
+
+from fabtools.files import age
 from fabtools.rpm import (
+    UPDATE_STAMP,
     install,
     is_installed,
     uninstall,
+    update_index,
 )
 from fabtools.system import get_arch, distrib_release
-from fabtools.utils import run_as_root
+from fabtools.utils import run_as_root, to_seconds
 
 
 def package(pkg_name, repos=None, yes=None, options=None):
@@ -83,6 +87,32 @@ def nopackages(pkg_list, options=None):
         uninstall(pkg_list, options)
 
 
+def uptodate_index(quiet=True, max_age=86400):
+    """
+    Require an up-to-date package index.
+
+    This will update the package index (using ``yum makecache``) if the last
+    successful update occured more than *max_age* ago. The age check
+    uses a single remote command.
+
+    *max_age* can be specified either as an integer (a value in seconds),
+    or as a dictionary whose keys are units (``seconds``, ``minutes``,
+    ``hours``, ``days``, ``weeks``, ``months``) and values are integers.
+    The default value is 1 day.
+
+    Example::
+
+        from fabtools import require
+
+        # Update index if last time was more than 1 day ago
+        require.rpm.uptodate_index(max_age={'day': 1})
+
+    """
+    update_age = age(UPDATE_STAMP)
+    if update_age is None or update_age > to_seconds(max_age):
+        update_index(quiet=quiet)
+
+
 def repository(name):
     """
     Require a repository. Aimed for 3rd party repositories.
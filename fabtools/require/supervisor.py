@@ -49,6 +49,7 @@ def process(name, **kwargs):
     .. _supervisor documentation: http://supervisord.org/configuration.html#program-x-section-values
     """
 
+    from fabtools.deb import install_pending
     from fabtools.require import file as require_file
     from fabtools.require.deb import package as require_deb_package
     from fabtools.require.rpm import package as require_rpm_package
@@ -59,6 +60,7 @@ def process(name, **kwargs):
 
     if family == 'debian':
         require_deb_package('supervisor')
+        install_pending()
         require_started('supervisor')
     elif family == 'redhat':
         require_rpm_package('supervisord')
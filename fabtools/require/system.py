@@ -19,6 +19,16 @@ from fabtools.system import (
 from fabtools.utils import run_as_root
 
 
+# Package manager of each distribution family
+PACKAGE_MANAGERS = {
+    'arch': 'arch',
+    'debian': 'deb',
+    'gentoo': 'portage',
+    'redhat': 'rpm',
+    'sun': 'pkg',
+}
+
+
 class UnsupportedLocales(Exception):
 
     def __init__(self, locales):
@@ -142,3 +152,78 @@ def default_locale(name):
     else:
         config_file = '/etc/default/locale'
     require_file(config_file, contents, use_sudo=True)
+
+
+def packages(pkg_map, update=False):
+    """
+    Require packages to be installed, whatever the distribution.
+
+    *pkg_map* is a dict mapping logical names to the package names for
+    each distribution family (see
+    :py:func:`~fabtools.system.distrib_family`). A package name may be a
+    string, a list of names, or ``None`` if nothing is needed on this
+    family. A logical name mapped to a string uses the same package name
+    on all the families.
+
+    The package manager is chosen from the (cached) system facts, the
+    packages are all checked against the installed packages snapshot of
+    the host, and the missing ones are installed using a single command.
+
+    If *update* is ``True``, the package definitions will be updated
+    first (if something needs to be installed).
+
+    Raises UnsupportedFamily if this family has no supported package
+    manager (such as ``'other'``), or if a package has no name for this
+    family.
+
+    Example::
+
+        from fabtools import require
+
+        require.packages({
+            'compiler': {
+                'debian': 'build-essential',
+                'redhat': ['gcc', 'make'],
+                'arch': 'base-devel',
+            },
+            'python headers': {
+                'debian': 'python-dev',
+                'redhat': 'python-devel',
+                'arch': None,
+            },
+            'curl': 'curl',
+        })
+
+    """
+    import fabtools.require
+
+    family = distrib_family()
+    if family not in PACKAGE_MANAGERS:
+        raise UnsupportedFamily(supported=sorted(PACKAGE_MANAGERS))
+    pkg_list = _package_names(pkg_map, family)
+    if not pkg_list:
+        return
+    manager = getattr(fabtools.require, PACKAGE_MANAGERS[family])
+    if family == 'redhat':
+        # yum refreshes its package definitions by itself
+        manager.packages(pkg_list)
+    else:
+        manager.packages(pkg_list, update=update)
+
+
+def _package_names(pkg_map, family):
+    """
+    Get the package names for a distribution family
+    """
+    pkg_list = []
+    for name, spec in sorted(pkg_map.items()):
+        if isinstance(spec, dict):
+            if family not in spec:
+                raise UnsupportedFamily(supported=sorted(spec))
+            spec = spec[family]
+        if spec is None:
+            continue
+        if isinstance(spec, basestring):
+            spec = [spec]
+        pkg_list.extend(pkg for pkg in spec if pkg not in pkg_list)
+    return pkg_list
@@ -7,13 +7,38 @@ and repositories.
 
 """
 
+from pipes import quote
+
 from fabric.api import hide, run, settings
 
-from fabtools.utils import run_as_root
+from fabtools.utils import PackageSnapshot, run_as_root
 
 
 MANAGER = 'yum -y --color=never'
 
+# Touched after each successful metadata update
+UPDATE_STAMP = '/var/lib/fabtools/yum-update-success-stamp'
+
+PACKAGES_QUERY = (
+    "rpm -qa --qf '%{NAME}\\t%{ARCH}\\t%{VERSION}\\t%{RELEASE}\\n'"
+)
+
+
+def update_index(quiet=True):
+    """
+    Update the ``yum`` metadata cache.
+    """
+    manager = MANAGER
+    stamp = UPDATE_STAMP
+    cmd = ('%(manager)s makecache && mkdir -p /var/lib/fabtools && '
+           'touch %(stamp)s' % locals())
+    if quiet:
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            run_as_root(cmd)
+    else:
+        run_as_root(cmd)
+
 
 def update(kernel=False):
     """
@@ -29,6 +54,7 @@ def update(kernel=False):
     }
     cmd = cmds[manager][kernel]
     run_as_root("%(manager)s %(cmd)s" % locals())
+    invalidate_installed_packages()
 
 
 def upgrade(kernel=False):
@@ -46,6 +72,7 @@ def upgrade(kernel=False):
     }
     cmd = cmds[manager][kernel]
     run_as_root("%(manager)s %(cmd)s" % locals())
+    invalidate_installed_packages()
 
 
 def groupupdate(group, options=None):
@@ -62,19 +89,73 @@ def groupupdate(group, options=None):
         options = [options]
     options = " ".join(options)
     run_as_root('%(manager)s %(options)s groupupdate "%(group)s"' % locals())
+    invalidate_installed_packages()
+
+
+def installed_packages(refresh=False):
+    """
+    Get the installed RPM packages and their versions.
+
+    All the packages are listed using a single ``rpm`` command, the
+    first time they are needed for a given host. The snapshot is then
+    kept in memory, and updated by :py:func:`install` and
+    :py:func:`uninstall` (see :py:func:`invalidate_installed_packages`
+    if packages are managed by other means).
+
+    Returns a dict mapping package names (plain, with the version, such
+    as ``glibc-2.17``, with the version and release, and each of these
+    qualified with the architecture, such as ``glibc.x86_64``) to
+    versions. It should not be modified.
+    """
+    return _SNAPSHOT.packages(refresh)
+
+
+def invalidate_installed_packages():
+    """
+    Forget the installed packages of the current host, so that they
+    will be listed again when needed.
+    """
+    _SNAPSHOT.invalidate()
+
+
+def _parse_installed(output):
+    installed = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 4:
+            continue
+        name, arch, version, release = fields
+        full_version = '%s-%s' % (version, release)
+        # Packages may be checked using any name accepted by "rpm -q"
+        for pkg_name in (name, '%s-%s' % (name, version),
+                         '%s-%s' % (name, full_version)):
+            installed[pkg_name] = full_version
+            installed['%s.%s' % (pkg_name, arch)] = full_version
+    return installed
+
+
+_SNAPSHOT = PackageSnapshot(PACKAGES_QUERY, _parse_installed)
 
 
 def is_installed(pkg_name):
     """
     Check if an RPM package is installed.
+
+    This uses the snapshot of installed packages of the current host
+    (see :py:func:`installed_packages`). Other names (such as files or
+    capabilities provided by a package) are checked using
+    ``rpm --query --whatprovides``.
     """
-    manager = MANAGER
+    if _SNAPSHOT.is_installed(pkg_name):
+        return True
+    if _SNAPSHOT.change(pkg_name) is not None:
+        # Just removed
+        return False
+    pkg_name = quote(pkg_name)
     with settings(
             hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run("rpm --query %(pkg_name)s" % locals())
-        if res.succeeded:
-            return True
-        return False
+        res = run("rpm --query --whatprovides %(pkg_name)s" % locals())
+    return res.succeeded
 
 
 def install(packages, repos=None, yes=None, options=None):
@@ -114,9 +195,10 @@ def install(packages, repos=None, yes=None, options=None):
             options.append('--enablerepo=%(repo)s' % locals())
     options = " ".join(options)
     if isinstance(yes, str):
-        run_as_root('yes %(yes)s | %(manager)s %(options)s install %(packages)s' % locals())
+        cmd = 'yes %(yes)s | %(manager)s %(options)s install %(packages)s' % locals()
     else:
-        run_as_root('%(manager)s %(options)s install %(packages)s' % locals())
+        cmd = '%(manager)s %(options)s install %(packages)s' % locals()
+    _SNAPSHOT.run(packages, True, run_as_root, cmd)
 
 
 def groupinstall(group, options=None):
@@ -145,6 +227,7 @@ def groupinstall(group, options=None):
     run_as_root(
         '%(manager)s %(options)s groupinstall "%(group)s"' % locals(),
         pty=False)
+    invalidate_installed_packages()
 
 
 def uninstall(packages, options=None):
@@ -162,7 +245,8 @@ def uninstall(packages, options=None):
     if not isinstance(packages, basestring):
         packages = " ".join(packages)
     options = " ".join(options)
-    run_as_root('%(manager)s %(options)s remove %(packages)s' % locals())
+    cmd = '%(manager)s %(options)s remove %(packages)s' % locals()
+    _SNAPSHOT.run(packages, False, run_as_root, cmd)
 
 
 def groupuninstall(group, options=None):
@@ -179,6 +263,7 @@ def groupuninstall(group, options=None):
         options = [options]
     options = " ".join(options)
     run_as_root('%(manager)s %(options)s groupremove "%(group)s"' % locals())
+    invalidate_installed_packages()
 
 
 def repolist(status='', media=None):
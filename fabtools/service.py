@@ -12,7 +12,7 @@ and traditional SysV-style ``/etc/init.d/`` scripts.
 
 from fabric.api import hide, settings
 
-from fabtools import systemd
+from fabtools import agent, systemd
 from fabtools.system import using_systemd, distrib_family
 from fabtools.utils import run_as_root
 
@@ -28,6 +28,13 @@ def is_running(service):
         if fabtools.service.is_running('foo'):
             print "Service foo is running!"
     """
+    if agent.enabled():
+        state = agent.query('service', use_sudo=True, name=service,
+                            systemd=using_systemd(),
+                            gentoo=distrib_family() == 'gentoo')
+        if state is not None:
+            return state['running']
+
     with settings(hide('running', 'stdout', 'stderr', 'warnings'),
                   warn_only=True):
         if using_systemd():
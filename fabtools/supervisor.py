@@ -9,8 +9,7 @@ processes using `supervisord`_.
 
 """
 
-from fabric.api import hide, settings
-
+from fabtools.checks import check
 from fabtools.utils import run_as_root
 
 
@@ -35,13 +34,15 @@ def process_status(name):
     """
     Get the status of a supervisor process.
     """
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        res = run_as_root("supervisorctl status %(name)s" % locals())
-        if res.startswith("No such process"):
-            return None
-        else:
-            return res.split()[1]
+    return check("supervisorctl status %(name)s" % locals(),
+                 _process_status, use_sudo=True)
+
+
+def _process_status(res):
+    if res.startswith("No such process"):
+        return None
+    else:
+        return res.split()[1]
 
 
 def start_process(name):
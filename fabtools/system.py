@@ -3,10 +3,42 @@ System settings
 ===============
 """
 
+from hashlib import sha1
+import json
+import os
+import re
+import time as _time
+
 from fabric.api import hide, run, settings
 
-from fabtools.files import is_file
-from fabtools.utils import read_lines, run_as_root
+from fabtools.utils import host_cache, host_key, read_lines, run_as_root
+
+
+# Single command gathering everything needed by the OS detection
+# functions (output is a list of "key=value" lines)
+FACTS_PROBE = r"""
+echo "kernel=$(uname -s)"
+echo "kernel_release=$(uname -r)"
+echo "arch=$(uname -m)"
+if [ -f /usr/bin/lsb_release ]; then
+    echo "lsb_id=$(lsb_release --id --short 2>/dev/null | tail -n 1)"
+    echo "lsb_release=$(lsb_release -r --short 2>/dev/null | tail -n 1)"
+    echo "lsb_codename=$(lsb_release --codename --short 2>/dev/null | tail -n 1)"
+    echo "lsb_desc=$(lsb_release --desc --short 2>/dev/null | tail -n 1)"
+fi
+for name in debian_version fedora-release arch-release redhat-release gentoo-release os-release; do
+    [ -f /etc/$name ] && echo "file:$name=1"
+done
+[ -f /etc/redhat-release ] && echo "redhat_release=$(head -n 1 /etc/redhat-release)"
+[ -f /etc/os-release ] && sed -n 's/^\([A-Z_]*\)=/os_release:\1=/p' /etc/os-release
+which systemctl >/dev/null 2>&1 && echo "systemd=1"
+true
+"""
+
+# Facts always printed by a successful probe
+REQUIRED_FACTS = ('kernel', 'kernel_release', 'arch')
+
+_FACTS = host_cache()
 
 
 class UnsupportedFamily(Exception):
@@ -35,6 +67,128 @@ class UnsupportedFamily(Exception):
         super(UnsupportedFamily, self).__init__(msg)
 
 
+def facts(refresh=False):
+    """
+    Get the facts about the remote system used for OS detection.
+
+    All the facts are gathered using a single remote command, the first
+    time they are needed for a given host. They are then kept in memory
+    for the rest of the session (see :py:func:`invalidate_facts`). Facts
+    from a failed or incomplete probe are not kept, so that they will be
+    gathered again next time.
+
+    If ``env.fabtools_facts_cache_dir`` is set, facts are also stored
+    on disk in this directory, and reused by later sessions for
+    ``env.fabtools_facts_cache_ttl`` seconds (1 hour by default).
+
+    Returns a dict (which should not be modified).
+    """
+    key = host_key()
+    if refresh:
+        invalidate_facts()
+    elif key in _FACTS:
+        return _FACTS[key]
+
+    host_facts = _load_facts(key)
+    if host_facts is None:
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run(FACTS_PROBE)
+        host_facts = _parse_facts(res)
+        if not (res.succeeded and _complete_facts(host_facts)):
+            return host_facts
+        _save_facts(key, host_facts)
+
+    _FACTS[key] = host_facts
+    return host_facts
+
+
+def invalidate_facts(all_hosts=False):
+    """
+    Forget the facts about the current host (or about all hosts),
+    so that they will be gathered again when needed.
+
+    This also removes them from the on-disk cache, if enabled.
+
+    Example::
+
+        from fabtools.system import distrib_release, invalidate_facts
+
+        # The distribution has just been upgraded
+        invalidate_facts()
+        print(distrib_release())
+
+    """
+    keys = list(_FACTS) if all_hosts else [host_key()]
+    for key in keys:
+        _FACTS.pop(key, None)
+        path = _facts_cache_path(key)
+        if path is not None and os.path.exists(path):
+            os.unlink(path)
+
+
+def _parse_facts(output):
+    host_facts = {}
+    for line in output.splitlines():
+        name, sep, value = line.partition('=')
+        if sep:
+            host_facts[name.strip()] = value.strip()
+    return host_facts
+
+
+def _complete_facts(host_facts):
+    return all(host_facts.get(name) for name in REQUIRED_FACTS)
+
+
+def _facts_cache_path(key):
+    from fabric.state import env
+
+    cache_dir = env.get('fabtools_facts_cache_dir')
+    if not cache_dir:
+        return None
+    filename = '%s.json' % sha1(str(key)).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), filename)
+
+
+def _load_facts(key):
+    from fabric.state import env
+
+    path = _facts_cache_path(key)
+    if path is None or not os.path.exists(path):
+        return None
+    ttl = env.get('fabtools_facts_cache_ttl', 3600)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except ValueError:
+        return None
+    if data.get('host') != key or _time.time() - data['time'] > ttl:
+        return None
+    if not _complete_facts(data.get('facts', {})):
+        return None
+    return data['facts']
+
+
+def _save_facts(key, host_facts):
+    path = _facts_cache_path(key)
+    if path is None:
+        return
+    cache_dir = os.path.dirname(path)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    with open(path, 'w') as f:
+        json.dump({'host': key, 'time': _time.time(), 'facts': host_facts}, f)
+
+
+def _os_release(host_facts, name, pattern):
+    """
+    Extract a value from ``/etc/os-release`` (same as ``grep | egrep -o``)
+    """
+    value = host_facts.get('os_release:%s' % name, '')
+    m = re.search(pattern, value)
+    return m.group(0) if m else ''
+
+
 def distrib_id():
     """
     Get the OS distribution ID.
@@ -51,46 +205,44 @@ def distrib_id():
             abort(u"Distribution is not supported")
 
     """
-
-    with settings(hide('running', 'stdout')):
-        kernel = run('uname -s')
-
-        if kernel == 'Linux':
-            # lsb_release works on Ubuntu and Debian >= 6.0
-            # but is not always included in other distros
-            if is_file('/usr/bin/lsb_release'):
-                id_ = run('lsb_release --id --short')
-                id_ = id_.splitlines()[-1]  # Use last line only to exclude warnings
-                if id_ in ['arch', 'Archlinux']:  # old IDs used before lsb-release 1.4-14
-                    id_ = 'Arch'
-                elif id_ == 'Rocky':  # old ID used before Rocky Linux 9
-                    id_ = 'RockyLinux'
-                return id_
-            else:
-                if is_file('/etc/debian_version'):
-                    return "Debian"
-                elif is_file('/etc/fedora-release'):
-                    return "Fedora"
-                elif is_file('/etc/arch-release'):
-                    return "Arch"
-                elif is_file('/etc/redhat-release'):
-                    release = run('cat /etc/redhat-release')
-                    if release.startswith('Red Hat Enterprise Linux'):
-                        return "RHEL"
-                    elif release.startswith('CentOS'):
-                        return "CentOS"
-                    elif release.startswith('Scientific Linux'):
-                        return "SLES"
-                    elif release.startswith('Rocky Linux'):  # When lsb-release is not installed
-                        return "RockyLinux"
-                elif is_file('/etc/gentoo-release'):
-                    return "Gentoo"
-
-        elif "CYGWIN" in kernel:
-            return "Cygwin"
-
+    host_facts = facts()
+    kernel = host_facts.get('kernel', '')
+
+    if kernel == 'Linux':
+        # lsb_release works on Ubuntu and Debian >= 6.0
+        # but is not always included in other distros
+        if 'lsb_id' in host_facts:
+            id_ = host_facts['lsb_id']
+            if id_ in ['arch', 'Archlinux']:  # old IDs used before lsb-release 1.4-14
+                id_ = 'Arch'
+            elif id_ == 'Rocky':  # old ID used before Rocky Linux 9
+                id_ = 'RockyLinux'
+            return id_
         else:
-            return 'Unknown Distribution'
+            if 'file:debian_version' in host_facts:
+                return "Debian"
+            elif 'file:fedora-release' in host_facts:
+                return "Fedora"
+            elif 'file:arch-release' in host_facts:
+                return "Arch"
+            elif 'file:redhat-release' in host_facts:
+                release = host_facts.get('redhat_release', '')
+                if release.startswith('Red Hat Enterprise Linux'):
+                    return "RHEL"
+                elif release.startswith('CentOS'):
+                    return "CentOS"
+                elif release.startswith('Scientific Linux'):
+                    return "SLES"
+                elif release.startswith('Rocky Linux'):  # When lsb-release is not installed
+                    return "RockyLinux"
+            elif 'file:gentoo-release' in host_facts:
+                return "Gentoo"
+
+    elif "CYGWIN" in kernel:
+        return "Cygwin"
+
+    else:
+        return 'Unknown Distribution'
 
 
 def distrib_release():
@@ -105,27 +257,27 @@ def distrib_release():
             print(u"CentOS 6.2 has been released. Please upgrade.")
 
     """
+    host_facts = facts()
+    kernel = host_facts.get('kernel', '')
+
+    if kernel == 'Linux':
+        # lsb_release works on Ubuntu and Debian >= 6.0
+        # but is not always included in other distros
+        if 'lsb_release' in host_facts:
+            return host_facts['lsb_release']
+        else:
+            if 'file:redhat-release' in host_facts:
+                m = re.search(r'release ([0-9]{1,}\.[0-9]{1,})',
+                              host_facts.get('redhat_release', ''))
+                return m.group(1) if m else ''
+            elif 'file:os-release' in host_facts:
+                return _os_release(host_facts, 'VERSION_ID', r'[0-9]{1,}\.[0-9]{1,}')
 
-    with settings(hide('running', 'stdout')):
-        kernel = run('uname -s')
-
-        if kernel == 'Linux':
-            # lsb_release works on Ubuntu and Debian >= 6.0
-            # but is not always included in other distros
-            if is_file('/usr/bin/lsb_release'):
-                rel = run('lsb_release -r --short')
-                return rel.splitlines()[-1]  # Use last line only to exclude warnings
-            else:
-                if is_file('/etc/redhat-release'):
-                    return run("cat /etc/redhat-release | egrep -o 'release [0-9]{1,}\\.[0-9]{1,}' | awk '{print $NF}'")
-                elif is_file('/etc/os-release'):
-                    return run("cat /etc/os-release | grep 'VERSION_ID=' | egrep -o '[0-9]{1,}\\.[0-9]{1,}'")
-
-        elif "CYGWIN" in kernel:
-            return run('uname -r')
+    elif "CYGWIN" in kernel:
+        return host_facts.get('kernel_release')
 
-        else:
-            return 'Unknown Release'
+    else:
+        return 'Unknown Release'
 
 
 def distrib_codename():
@@ -140,23 +292,22 @@ def distrib_codename():
             print(u"Ubuntu 12.04 LTS detected")
 
     """
-    with settings(hide('running', 'stdout')):
-        kernel = run('uname -s')
-
-        if kernel == 'Linux':
-            # lsb_release works on Ubuntu and Debian >= 6.0
-            # but is not always included in other distros
-            if is_file('/usr/bin/lsb_release'):
-                code = run('lsb_release --codename --short')
-                return code.splitlines()[-1]  # Use last line only to exclude warnings
-            else:
-                if is_file('/etc/redhat-release'):
-                    return run("cat /etc/redhat-release | egrep -o '\\(.*\\)' | tr -d '(),'")
-                elif is_file('/etc/os-release'):
-                    return run("cat /etc/os-release | grep 'VERSION=' | egrep -o '\\(.*\\)' | tr -d '(),'")
+    host_facts = facts()
 
+    if host_facts.get('kernel') == 'Linux':
+        # lsb_release works on Ubuntu and Debian >= 6.0
+        # but is not always included in other distros
+        if 'lsb_codename' in host_facts:
+            return host_facts['lsb_codename']
         else:
-            return 'Unknown Codename'
+            if 'file:redhat-release' in host_facts:
+                m = re.search(r'\(.*\)', host_facts.get('redhat_release', ''))
+                return re.sub(r'[(),]', '', m.group(0)) if m else ''
+            elif 'file:os-release' in host_facts:
+                return re.sub(r'[(),]', '', _os_release(host_facts, 'VERSION', r'\(.*\)'))
+
+    else:
+        return 'Unknown Codename'
 
 
 def distrib_desc():
@@ -165,23 +316,21 @@ def distrib_desc():
 
     For example: ``Debian GNU/Linux 6.0.7 (squeeze)``.
     """
-    with settings(hide('running', 'stdout')):
-        kernel = run('uname -s')
-
-        if kernel == 'Linux':
-            # lsb_release works on Ubuntu and Debian >= 6.0
-            # but is not always included in other distros
-            if is_file('/usr/bin/lsb_release'):
-                desc = run('lsb_release --desc --short')
-                return desc.splitlines()[-1]  # Use last line only to exclude warnings
-            else:
-                if is_file('/etc/redhat-release'):
-                    return run('cat /etc/redhat-release')
-                elif is_file('/etc/os-release'):
-                    return run("cat /etc/os-release | grep 'PRETTY_NAME=' | egrep -o '\".*\"' | tr -d '\"\",'")
+    host_facts = facts()
 
+    if host_facts.get('kernel') == 'Linux':
+        # lsb_release works on Ubuntu and Debian >= 6.0
+        # but is not always included in other distros
+        if 'lsb_desc' in host_facts:
+            return host_facts['lsb_desc']
         else:
-            return 'No Description'
+            if 'file:redhat-release' in host_facts:
+                return host_facts.get('redhat_release', '')
+            elif 'file:os-release' in host_facts:
+                return re.sub(r'[",]', '', _os_release(host_facts, 'PRETTY_NAME', r'".*"'))
+
+    else:
+        return 'No Description'
 
 
 def distrib_family():
@@ -306,9 +455,12 @@ def get_arch():
             print(u"Running on a 64-bit Intel/AMD system")
 
     """
-    with settings(hide('running', 'stdout')):
-        arch = run('uname -m')
+    arch = facts().get('arch')
+    if arch:
         return arch
+    # The facts could not be gathered
+    with settings(hide('running', 'stdout')):
+        return run('uname -m')
 
 
 def cpus():
@@ -341,7 +493,7 @@ def using_systemd():
             pass
 
     """
-    return run('which systemctl', quiet=True).succeeded
+    return 'systemd' in facts()
 
 
 def time():
@@ -8,8 +8,7 @@ This module provides low-level tools for managing `systemd`_ services.
 
 """
 
-from fabric.api import hide, settings
-
+from fabtools.checks import check
 from fabtools.utils import run_as_root
 
 
@@ -52,9 +51,8 @@ def is_running(service):
         if fabtools.systemd.is_running('httpd'):
             print("Service httpd is running!")
     """
-    with settings(
-            hide('running', 'stdout', 'stderr', 'warnings'), warn_only=True):
-        return action('status --no-pager', service).succeeded
+    return check('systemctl status --no-pager %s.service' % service,
+                 use_sudo=True)
 
 
 def start(service):
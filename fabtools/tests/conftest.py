@@ -0,0 +1,50 @@
+from mock import patch
+import pytest
+
+from fabric.operations import _AttributeString
+
+
+def _result(output='', succeeded=True):
+    """
+    Fake the result of a command
+    """
+    res = _AttributeString(output)
+    res.succeeded = succeeded
+    res.failed = not succeeded
+    return res
+
+
+def _clear_host_caches():
+    from fabtools.utils import _HOST_CACHES
+    for cache in _HOST_CACHES:
+        cache.clear()
+
+
+@pytest.yield_fixture
+def mock_run(request):
+    """
+    Fake the command listing the installed packages, starting with empty
+    caches.
+
+    The command outputs the ``PACKAGES_OUTPUT`` of the test module, or
+    the parameter of the fixture (using ``indirect`` parametrization).
+    """
+    output = getattr(request, 'param', None)
+    if output is None:
+        output = getattr(request.module, 'PACKAGES_OUTPUT', '')
+    _clear_host_caches()
+    with patch('fabtools.utils.run') as mock:
+        mock.return_value = output
+        yield mock
+    _clear_host_caches()
+
+
+@pytest.yield_fixture
+def mock_run_as_root(request):
+    """
+    Fake the commands run as root by the ``BACKEND`` module of the test
+    module (such as ``deb``), which all succeed.
+    """
+    with patch('fabtools.%s.run_as_root' % request.module.BACKEND) as mock:
+        mock.return_value = _result()
+        yield mock
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from mock import Mock, patch
+
+from fabric.api import settings
+
+
+class LocalChannel(object):
+    """
+    Run the agent script locally, instead of on an SSH channel
+    """
+
+    def __init__(self):
+        from fabtools.agent import AGENT_SCRIPT
+        self.proc = subprocess.Popen(
+            [sys.executable, '-u', '-c', AGENT_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        assert self.proc.stdout.readline().strip() == '{"ready": true}'
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class AgentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.agent import Agent, _AGENTS
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.channel = LocalChannel()
+        self.agent = Agent(self.channel, self.channel.proc.stdin,
+                           self.channel.proc.stdout)
+        _AGENTS.clear()
+
+        patcher = patch('fabtools.agent._start', return_value=self.agent)
+        self.start = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.channel.close()
+        shutil.rmtree(self.tmpdir)
+
+    def _settings(self, **kwargs):
+        return settings(host_string='example.com', fabtools_agent=True,
+                        **kwargs)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_stat(self):
+        from fabtools.files import is_dir, is_file, is_link, stat_many
+
+        path = self._write('foo', 'hello')
+        os.chmod(path, 0640)
+        link = os.path.join(self.tmpdir, 'link')
+        os.symlink(path, link)
+        missing = os.path.join(self.tmpdir, 'missing')
+
+        with self._settings():
+            stats = stat_many([path, link, missing])
+            self.assertTrue(is_file(path))
+            self.assertFalse(is_dir(path))
+            self.assertTrue(is_dir(self.tmpdir))
+            self.assertTrue(is_link(link))
+            self.assertFalse(is_link(path))
+            self.assertFalse(is_file(missing))
+
+        self.assertEqual(stats[path]['type'], 'file')
+        self.assertEqual(stats[path]['mode'], '640')
+        self.assertEqual(stats[path]['size'], 5)
+        self.assertEqual(stats[link], stats[path])
+        self.assertIsNone(stats[missing])
+
+        # A single agent is started for the host
+        self.assertEqual(self.start.call_count, 1)
+
+    def test_relative_paths_use_cwd(self):
+        from fabric.api import cd
+        from fabtools.files import mode
+
+        self._write('foo', 'hello')
+        os.chmod(os.path.join(self.tmpdir, 'foo'), 0600)
+        with self._settings():
+            with cd(self.tmpdir):
+                self.assertEqual(mode('foo'), '600')
+
+    def test_checksums(self):
+        from fabtools.files import checksum, checksums
+
+        path = self._write('foo', 'hello')
+        missing = os.path.join(self.tmpdir, 'missing')
+        with self._settings():
+            self.assertEqual(checksum(path, 'sha256'),
+                             hashlib.sha256('hello').hexdigest())
+            self.assertEqual(checksums([path, missing]), {
+                path: hashlib.md5('hello').hexdigest(),
+                missing: None,
+            })
+
+    def test_user(self):
+        import pwd
+        from fabtools.user import exists, home_directory
+
+        name = pwd.getpwuid(os.getuid()).pw_name
+        with self._settings():
+            self.assertTrue(exists(name))
+            self.assertEqual(home_directory(name),
+                             pwd.getpwnam(name).pw_dir)
+            self.assertFalse(exists('no-such-user-fabtools'))
+
+    @patch('fabtools.files.check')
+    def test_failed_query_falls_back_to_shell(self, check):
+        from fabtools.files import is_file
+
+        from fabtools.agent import _AGENTS, query
+
+        with self._settings():
+            # The query failed on the remote side
+            self.assertIsNone(query('bogus'))
+            self.assertIs(_AGENTS[('example.com', False)], self.agent)
+
+            # The channel is broken
+            with patch.object(self.agent, 'request', side_effect=IOError):
+                is_file('/foo')
+            self.assertIsNone(_AGENTS[('example.com', False)])
+            is_file('/bar')
+        self.assertEqual(check.call_count, 2)
+
+    @patch('fabtools.files.check')
+    def test_disabled(self, check):
+        from fabtools.files import is_file
+
+        with settings(host_string='example.com'):
+            is_file('/foo')
+        with self._settings(fabtools_guest='101'):
+            is_file('/foo')
+        self.assertEqual(check.call_count, 2)
+        self.assertFalse(self.start.called)
+
+
+class StartTestCase(unittest.TestCase):
+
+    @patch('fabtools.agent.put')
+    @patch('fabtools.agent._launch')
+    def test_upload_if_missing(self, launch, put):
+        from fabtools.agent import AGENT_VERSION, _start
+
+        path = '/home/alice/.fabtools-agent-%s.py' % AGENT_VERSION
+        agent = Mock()
+        launch.side_effect = [(None, {'missing': path}), (agent, {})]
+        self.assertIs(_start(False), agent)
+        self.assertEqual(put.call_args[0][1], path)
+
+    @patch('fabtools.agent.put')
+    @patch('fabtools.agent._launch')
+    def test_unavailable(self, launch, put):
+        from fabtools.agent import _start
+
+        launch.return_value = (None, {'error': 'python not found'})
+        self.assertIsNone(_start(True))
+        self.assertFalse(put.called)
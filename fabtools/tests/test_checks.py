@@ -0,0 +1,119 @@
+import unittest
+
+from mock import patch
+
+from fabric.api import settings
+
+from fabtools.tests.conftest import _result
+
+
+def _batch_output(script, statuses):
+    """
+    Fake the output of a batch script, given the status of each check
+    """
+    import re
+    lines = []
+    for line in script.splitlines():
+        m = re.match(r"^printf '\\n(\S+) (\d+) %d\\n' \$\?$", line)
+        if m:
+            status = statuses[int(m.group(2))]
+            lines.append('output %s' % m.group(2))
+            lines.append('')
+            lines.append('%s %s %d' % (m.group(1), m.group(2), status))
+    return _result('\n'.join(lines))
+
+
+class CheckTestCase(unittest.TestCase):
+
+    @patch('fabtools.checks.run')
+    def test_check_runs_immediately_outside_batch(self, run):
+        from fabtools.checks import check
+
+        run.return_value = _result('', succeeded=False)
+        self.assertFalse(check('test -f /foo'))
+        run.assert_called_once_with('test -f /foo')
+
+    @patch('fabtools.checks.run')
+    def test_check_parse(self, run):
+        from fabtools.checks import check
+
+        run.return_value = _result('foo')
+        self.assertEqual(check('echo foo', lambda res: res.upper()), 'FOO')
+
+
+class BatchTestCase(unittest.TestCase):
+
+    @patch('fabtools.checks.run')
+    def test_checks_are_run_in_a_single_command(self, run):
+        from fabtools.checks import batch, check
+
+        run.side_effect = lambda script: _batch_output(script, [0, 1, 0])
+        with settings(host_string='example.com'):
+            with batch():
+                probes = [check('test -f /a'), check('test -f /b'),
+                          check('test -f /c', lambda res: str(res))]
+                self.assertEqual(run.call_count, 0)
+            self.assertEqual(run.call_count, 1)
+        self.assertTrue(probes[0])
+        self.assertFalse(probes[1])
+        self.assertEqual(probes[2], 'output 2')
+
+    @patch('fabtools.checks.run')
+    def test_using_a_result_runs_pending_checks(self, run):
+        from fabtools.checks import batch, check
+
+        run.side_effect = lambda script: _batch_output(script, [1, 0])
+        with settings(host_string='example.com'):
+            with batch():
+                first = check('test -f /a')
+                second = check('test -f /b')
+                self.assertFalse(first)
+                self.assertEqual(run.call_count, 1)
+                self.assertTrue(second)
+            self.assertEqual(run.call_count, 1)
+
+    @patch('fabtools.checks.run')
+    def test_pending_checks_are_run_before_other_commands(self, run):
+        import fabric.operations
+        from fabtools.checks import batch, check
+
+        calls = []
+        run.side_effect = lambda script: (calls.append('checks'),
+                                          _batch_output(script, [0]))[1]
+        with settings(host_string='example.com'):
+            with patch('fabric.operations._run_command') as run_command:
+                run_command.side_effect = lambda *args, **kwargs: calls.append('write')
+                with batch():
+                    check('test -f /a')
+                    fabric.operations._run_command('touch /a')
+        self.assertEqual(calls, ['checks', 'write'])
+
+    @patch('fabtools.checks.run')
+    def test_other_hosts_are_not_batched(self, run):
+        from fabtools.checks import batch, check
+
+        run.return_value = _result('')
+        with settings(host_string='example.com'):
+            with batch():
+                with settings(host_string='other.example.com'):
+                    self.assertIs(check('test -f /a'), True)
+        run.assert_called_once_with('test -f /a')
+
+
+class ParseOutputTestCase(unittest.TestCase):
+
+    def test_parse_output(self):
+        from fabtools.checks import _parse_output
+
+        output = '\n'.join([
+            'foo',
+            'bar',
+            '',
+            'MARK 0 0',
+            '',
+            'MARK 1 2',
+        ])
+        self.assertEqual(_parse_output(output, 'MARK'), {
+            0: ('foo\nbar', 0),
+            1: ('', 2),
+        })
@@ -0,0 +1,492 @@
+from mock import patch
+
+import pytest
+
+from fabtools.tests.conftest import _result
+
+
+BACKEND = 'deb'
+
+PACKAGES_OUTPUT = """\
+libc6\tamd64\tinstall ok installed\t2.36-9
+nginx\tamd64\tinstall ok installed\t1.22.1-9
+apache2\tamd64\tdeinstall ok config-files\t2.4.57-2
+vim\tamd64\thold ok installed\t2:9.0.1378-2
+"""
+
+
+def test_installed_packages(mock_run):
+    from fabtools.deb import installed_packages
+    assert installed_packages() == {
+        'libc6': '2.36-9',
+        'libc6:amd64': '2.36-9',
+        'nginx': '1.22.1-9',
+        'nginx:amd64': '1.22.1-9',
+        'vim': '2:9.0.1378-2',
+        'vim:amd64': '2:9.0.1378-2',
+    }
+
+
+def test_is_installed_uses_a_single_query(mock_run):
+    from fabtools.deb import is_installed
+    assert is_installed('nginx')
+    assert is_installed('libc6:amd64')
+    assert not is_installed('apache2')
+    assert not is_installed('foo')
+    assert mock_run.call_count == 1
+
+
+def test_require_packages(mock_run, mock_run_as_root):
+    from fabtools.require.deb import packages
+    packages(['nginx', 'vim', 'git', 'curl'])
+    mock_run_as_root.assert_called_once_with(
+        'DEBIAN_FRONTEND=noninteractive apt-get install --quiet --assume-yes '
+        'git curl', pty=False)
+    assert mock_run.call_count == 1
+
+
+def test_snapshot_updated_after_install(mock_run, mock_run_as_root):
+    from fabtools.deb import install, is_installed
+    assert not is_installed('git')
+    install(['git'])
+    assert is_installed('git')
+    assert mock_run.call_count == 1
+
+    # Other packages may have been installed as dependencies
+    mock_run.return_value = PACKAGES_OUTPUT + 'git\tamd64\tinstall ok installed\t1:2.39\n'
+    assert not is_installed('foo')
+    assert mock_run.call_count == 2
+    assert is_installed('git')
+
+
+def test_snapshot_updated_after_uninstall(mock_run, mock_run_as_root):
+    from fabtools.deb import is_installed
+    from fabtools.require.deb import nopackages
+    nopackages(['nginx', 'apache2'])
+    mock_run_as_root.assert_called_once_with(
+        'DEBIAN_FRONTEND=noninteractive apt-get remove --assume-yes nginx',
+        pty=False)
+    assert not is_installed('nginx')
+    assert mock_run.call_count == 1
+
+
+def test_snapshot_invalidated_after_failure(mock_run, mock_run_as_root):
+    from fabtools.deb import install, is_installed
+    is_installed('nginx')
+    mock_run_as_root.return_value = _result(succeeded=False)
+    install(['git'])
+    assert not is_installed('git')
+    assert mock_run.call_count == 2
+
+
+def test_snapshot_invalidated_after_abort(mock_run, mock_run_as_root):
+    from fabtools.deb import install, is_installed
+    is_installed('nginx')
+    mock_run_as_root.side_effect = SystemExit(1)
+    with pytest.raises(SystemExit):
+        install(['git'])
+    assert not is_installed('git')
+    assert mock_run.call_count == 2
+
+
+def test_snapshot_is_per_host(mock_run):
+    from fabric.api import settings
+    from fabtools.deb import is_installed
+    with settings(host_string='foo'):
+        assert is_installed('nginx')
+    mock_run.return_value = ''
+    with settings(host_string='bar'):
+        assert not is_installed('nginx')
+    assert mock_run.call_count == 2
+
+
+def test_transaction(mock_run, mock_run_as_root):
+    from fabtools.deb import is_installed, transaction
+    from fabtools.require.deb import package, packages
+    with transaction():
+        package('git')
+        packages(['nginx', 'curl', 'git'])
+        package('emacs', version='1:28.2', update=True)
+        assert not mock_run_as_root.called
+    assert [args[0] for args, kwargs in mock_run_as_root.call_args_list] == [
+        'DEBIAN_FRONTEND=noninteractive apt-get --quiet --quiet update',
+        'DEBIAN_FRONTEND=noninteractive apt-get install --quiet --assume-yes '
+        'git curl emacs=1:28.2',
+    ]
+    assert is_installed('emacs')
+    assert mock_run.call_count == 1
+
+
+def test_transaction_options(mock_run_as_root):
+    from fabtools.deb import install, transaction
+    with transaction():
+        install('git')
+        install('curl', options=['--no-install-recommends'])
+        install('wget')
+    assert [args[0] for args, kwargs in mock_run_as_root.call_args_list] == [
+        'DEBIAN_FRONTEND=noninteractive apt-get install --quiet --assume-yes '
+        'git wget',
+        'DEBIAN_FRONTEND=noninteractive apt-get install '
+        '--no-install-recommends --quiet --assume-yes curl',
+    ]
+
+
+def test_transaction_early_flush(mock_run_as_root):
+    from fabtools.deb import install, install_pending, transaction
+    with transaction():
+        install('gpg')
+        install_pending()
+        assert mock_run_as_root.call_count == 1
+        install('curl')
+    assert mock_run_as_root.call_count == 2
+
+
+def test_transaction_exception(mock_run_as_root):
+    from fabtools.deb import install, transaction
+    with pytest.raises(ValueError):
+        with transaction():
+            install('git')
+            raise ValueError
+    assert not mock_run_as_root.called
+
+
+def test_fast_install(mock_run, mock_run_as_root):
+    from fabtools.deb import FAST_OPTIONS
+    from fabtools.require.deb import packages
+    packages(['git', 'nginx'], fast=True)
+    mock_run_as_root.assert_called_once_with(
+        'DEBIAN_FRONTEND=noninteractive $(command -v eatmydata) apt-get '
+        'install %s --quiet --assume-yes git' % ' '.join(FAST_OPTIONS),
+        pty=False)
+
+
+def test_fast_install_from_env(mock_run_as_root):
+    from fabric.api import settings
+    from fabtools.deb import install
+    with settings(fabtools_deb_fast=True):
+        install('git', options=['--reinstall'])
+    command = mock_run_as_root.call_args[0][0]
+    assert 'eatmydata' in command
+    assert '--reinstall --no-install-recommends ' in command
+    assert '--force-unsafe-io' in command
+
+
+def test_fast_install_in_transaction(mock_run_as_root):
+    from fabtools.deb import install, transaction
+    with transaction():
+        install('git', fast=True)
+        install('curl')
+        install('wget', fast=True)
+    commands = [args[0] for args, kwargs in mock_run_as_root.call_args_list]
+    assert len(commands) == 2
+    assert commands[0].endswith(' git wget')
+    assert 'eatmydata' in commands[0]
+    assert commands[1].endswith(' curl')
+    assert 'eatmydata' not in commands[1]
+
+
+PRINT_URIS = """\
+'http://deb.debian.org/debian/pool/main/c/curl/curl_7.88.1-10%2bdeb12u5_amd64.deb' curl_7.88.1-10+deb12u5_amd64.deb 315704 SHA256:0123
+'http://deb.debian.org/debian/pool/main/v/vim/vim_2%3a9.0.1378-2_amd64.deb' vim_2%3a9.0.1378-2_amd64.deb 1567708 SHA256:4567
+"""
+
+
+def test_prefetch_upgrade(mock_run, mock_run_as_root):
+    from fabtools.deb import prefetch_upgrade
+    mock_run_as_root.return_value = _result(PRINT_URIS)
+    packages = prefetch_upgrade()
+    assert mock_run_as_root.call_count == 1
+    command = mock_run_as_root.call_args[0][0]
+    assert '--print-uris' in command
+    assert '--download-only' in command
+    assert packages == [
+        {'name': 'curl', 'version': '7.88.1-10+deb12u5', 'arch': 'amd64',
+         'size': 315704},
+        {'name': 'vim', 'version': '2:9.0.1378-2', 'arch': 'amd64',
+         'size': 1567708},
+    ]
+
+
+def test_upgrade_from_cache(mock_run, mock_run_as_root):
+    from fabtools.deb import installed_packages, upgrade
+    installed_packages()
+    upgrade(safe=False, from_cache=True)
+    mock_run_as_root.assert_called_once_with(
+        'DEBIAN_FRONTEND=noninteractive apt-get --assume-yes --no-download '
+        'dist-upgrade', pty=False)
+
+    # The versions have changed
+    installed_packages()
+    assert mock_run.call_count == 2
+
+
+CURL_SHA = '0' * 64
+VIM_SHA = '1' * 64
+
+BUNDLE_OUTPUT = """\
+%s  curl_7.88.1-10+deb12u5_amd64.deb
+%s  vim_2%%3a9.0.1378-2_amd64.deb
+""" % (CURL_SHA, VIM_SHA)
+
+
+def _bundle(tmpdir):
+    from fabtools.deb import Bundle
+    return Bundle([
+        {'name': 'curl', 'version': '7.88.1-10+deb12u5', 'arch': 'amd64',
+         'filename': 'curl_7.88.1-10+deb12u5_amd64.deb', 'sha256': CURL_SHA},
+        {'name': 'vim', 'version': '2:9.0.1378-2', 'arch': 'amd64',
+         'filename': 'vim_2%3a9.0.1378-2_amd64.deb', 'sha256': VIM_SHA},
+    ], str(tmpdir))
+
+
+def test_build_bundle(tmpdir):
+    from fabtools.deb import build_bundle
+
+    # curl is already in the local cache
+    tmpdir.join(CURL_SHA + '.deb').write('curl')
+
+    def fake_get(remote_path, local_path):
+        assert remote_path == '/tmp/fabtools-bundle/vim_2%3a9.0.1378-2_amd64.deb'
+        with open(local_path, 'w') as f:
+            f.write('vim')
+
+    with patch('fabtools.deb.run') as mock_run, \
+            patch('fabtools.deb.get', side_effect=fake_get) as mock_get, \
+            patch('fabtools.deb._sha256', return_value=VIM_SHA):
+        mock_run.return_value = BUNDLE_OUTPUT
+        bundle = build_bundle(['curl', 'vim'], cache_dir=str(tmpdir))
+
+    assert 'apt-cache depends --recurse' in mock_run.call_args_list[0][0][0]
+    assert mock_get.call_count == 1
+    assert bundle.packages == _bundle(tmpdir).packages
+    assert tmpdir.join(VIM_SHA + '.deb').read() == 'vim'
+
+
+def test_bundle_save_and_load(tmpdir):
+    from fabtools.deb import Bundle
+    filename = str(tmpdir.join('bundle.json'))
+    _bundle(tmpdir).save(filename)
+    bundle = Bundle.load(filename)
+    assert bundle.packages == _bundle(tmpdir).packages
+    assert bundle.cache_dir == str(tmpdir)
+
+
+def test_require_bundle(mock_run, mock_run_as_root, tmpdir):
+    from fabtools.require.deb import bundle
+
+    # vim is installed with the same version, curl is missing, and its
+    # file is already on the host
+    with patch('fabtools.deb.checksums') as mock_checksums, \
+            patch('fabtools.deb.put') as mock_put:
+        mock_checksums.return_value = {
+            '/var/cache/fabtools/debs/curl_7.88.1-10+deb12u5_amd64.deb':
+            CURL_SHA,
+        }
+        bundle(_bundle(tmpdir))
+    mock_checksums.assert_called_once_with(
+        ['/var/cache/fabtools/debs/curl_7.88.1-10+deb12u5_amd64.deb'],
+        'sha256', use_sudo=True)
+    assert not mock_put.called
+    mock_run_as_root.assert_called_once_with(
+        'DEBIAN_FRONTEND=noninteractive apt-get install --quiet --assume-yes '
+        '/var/cache/fabtools/debs/curl_7.88.1-10+deb12u5_amd64.deb',
+        pty=False)
+
+
+def test_push_bundle(mock_run_as_root, tmpdir):
+    from fabtools.deb import push_bundle
+    with patch('fabtools.deb.checksums') as mock_checksums, \
+            patch('fabtools.deb.put') as mock_put:
+        mock_checksums.return_value = {}
+        push_bundle(_bundle(tmpdir), remote_dir='/srv/debs')
+    mock_run_as_root.assert_called_once_with('mkdir -p /srv/debs')
+    assert mock_put.call_count == 2
+    mock_put.assert_any_call(str(tmpdir.join(VIM_SHA + '.deb')),
+                             '/srv/debs/vim_2%3a9.0.1378-2_amd64.deb',
+                             use_sudo=True)
+
+
+def test_preseed_packages(mock_run_as_root):
+    from fabtools.deb import preseed_packages
+    mock_run_as_root.return_value = _result(
+        'postfix postfix/mailname string example.com')
+    changed = preseed_packages({
+        'postfix': {
+            'postfix/main_mailer_type': ('select', 'Internet Site'),
+            'postfix/mailname': ('string', 'example.com'),
+        },
+        'mysql-server': {
+            'mysql-server/root_password': ('password', 's3cr3t'),
+        },
+    })
+    assert changed == ['postfix/mailname']
+    assert mock_run_as_root.call_count == 1
+    script = mock_run_as_root.call_args[0][0]
+    assert 'debconf-show mysql-server postfix' in script
+    assert script.count('debconf-set-selections') == 1
+    assert ("grep -qxF -- 'postfix/mailname: example.com' "
+            "|| echo 'postfix postfix/mailname string example.com'") in script
+
+
+APT_KEYS = """\
+4D64FEC119C2029067D6E791F8D2585B8783D481 /etc/apt/trusted.gpg.d/debian.gpg
+573BFD6B3D8FBC641079A6ABABF5BD827BD9BF62 /etc/apt/trusted.gpg.d/nginx.gpg
+"""
+
+
+@pytest.yield_fixture
+def mock_apt_keys():
+    from fabtools.deb import _APT_KEYS
+    _APT_KEYS.clear()
+    with patch('fabtools.deb.run') as mock_run, \
+            patch('fabtools.require.deb.package'):
+        mock_run.return_value = APT_KEYS
+        yield mock_run
+    _APT_KEYS.clear()
+
+
+def test_locate_apt_key(mock_apt_keys):
+    from fabtools.deb import apt_key_exists, locate_apt_key
+    assert locate_apt_key('7BD9BF62') == '/etc/apt/trusted.gpg.d/nginx.gpg'
+    assert locate_apt_key('0xf8d2585b8783d481') == \
+        '/etc/apt/trusted.gpg.d/debian.gpg'
+    assert locate_apt_key(
+        '4D64 FEC1 19C2 0290 67D6  E791 F8D2 585B 8783 D481') == \
+        '/etc/apt/trusted.gpg.d/debian.gpg'
+    assert not apt_key_exists('DEADBEEF')
+    assert mock_apt_keys.call_count == 1
+
+
+def test_index_updated_by_add_and_del(mock_apt_keys, mock_run_as_root):
+    from fabtools.deb import _add_pgp_key, apt_key_exists, del_apt_key
+    assert not apt_key_exists('C4DEFFEB')
+    with patch('fabtools.deb._get_pubid_gpg_key') as mock_pubid, \
+            patch('fabtools.deb.copy'), \
+            patch('fabtools.deb.remove') as mock_remove:
+        mock_pubid.return_value = '60E7C096C4DEFFEB'
+        _add_pgp_key('/tmp/varnish.gpg')
+        assert apt_key_exists('C4DEFFEB')
+
+        del_apt_key('7BD9BF62')
+        mock_remove.assert_called_with('/etc/apt/trusted.gpg.d/nginx.gpg',
+                                       force=True, use_sudo=True)
+        assert not apt_key_exists('7BD9BF62')
+    assert mock_apt_keys.call_count == 1
+
+
+SELECTIONS = """\
+adduser\t\t\t\t\t\tinstall
+apache2\t\t\t\t\t\tdeinstall
+nginx\t\t\t\t\t\t\tinstall
+vim\t\t\t\t\t\t\thold
+"""
+
+
+def test_get_selections(mock_run_as_root):
+    from fabtools.deb import get_selections
+    mock_run_as_root.return_value = _result(SELECTIONS)
+    selections = get_selections()
+    assert selections == {
+        'install': frozenset(['adduser', 'nginx']),
+        'deinstall': frozenset(['apache2']),
+        'hold': frozenset(['vim']),
+    }
+    assert selections.state('vim') == 'hold'
+    assert selections.state('foo') is None
+
+
+def test_selections_names_are_interned():
+    from fabtools.deb import parse_selections
+    first = parse_selections(SELECTIONS.splitlines())
+    second = parse_selections(SELECTIONS.splitlines())
+    name1, = [name for name in first['hold']]
+    name2, = [name for name in second['hold']]
+    assert name1 is name2
+
+
+def test_diff_selections():
+    from fabtools.deb import diff_selections, parse_selections
+    baseline = parse_selections(SELECTIONS.splitlines())
+    drifted = parse_selections([
+        'adduser install',
+        'apache2 install',
+        'vim hold',
+        'emacs install',
+    ])
+    drift = diff_selections(baseline, [
+        ('web1', parse_selections(SELECTIONS.splitlines())),
+        ('web2', drifted),
+    ])
+    assert list(drift) == ['web2']
+    diff = drift['web2']
+    assert diff.missing == set(['nginx'])
+    assert diff.extra == set(['emacs'])
+    assert diff.changed == {'apache2': ('deinstall', 'install')}
+
+
+def test_require_nginx_server_in_transaction(mock_run, mock_run_as_root):
+    from fabtools.deb import transaction
+    from fabtools.require.nginx import server
+
+    calls = []
+
+    def run_as_root(cmd, **kwargs):
+        calls.append(cmd)
+        return _result()
+
+    mock_run.return_value = 'libc6\tamd64\tinstall ok installed\t2.36-9\n'
+    mock_run_as_root.side_effect = run_as_root
+    with patch('fabtools.require.nginx.distrib_family',
+               return_value='debian'), \
+            patch('fabtools.require.nginx.require_started',
+                  side_effect=lambda name: calls.append('start ' + name)):
+        with transaction():
+            server()
+            assert calls == [
+                'DEBIAN_FRONTEND=noninteractive apt-get install --quiet '
+                '--assume-yes nginx',
+                'start nginx',
+            ]
+    assert len(calls) == 2
+
+
+def test_transaction_flushes_before_other_commands(mock_run_as_root):
+    import fabric.operations
+    from fabric.api import run, settings
+    from fabtools.deb import install, transaction
+
+    calls = []
+    mock_run_as_root.side_effect = \
+        lambda cmd, **kwargs: calls.append(cmd) or _result()
+    with patch('fabric.operations._run_command',
+               side_effect=lambda cmd, *args, **kwargs:
+               calls.append(cmd) or _result()) as mock_run_command:
+        with settings(host_string='web1'), transaction():
+            install('apache2')
+            with settings(host_string='web2'):
+                run('true')
+            assert calls == ['true']
+            run('service apache2 start')
+            assert calls == [
+                'true',
+                'DEBIAN_FRONTEND=noninteractive apt-get install --quiet '
+                '--assume-yes apache2',
+                'service apache2 start',
+            ]
+        assert fabric.operations._run_command is mock_run_command
+    assert len(calls) == 3
+
+
+def test_transaction_keeps_the_groups_left_after_a_failure(mock_run_as_root):
+    from fabtools.deb import install, transaction
+    mock_run_as_root.side_effect = [_result(), SystemExit(1)]
+    txn = transaction()
+    with pytest.raises(SystemExit):
+        with txn:
+            install(['git'])
+            install(['curl'], options=['--no-install-recommends'])
+            install(['vim'], options=['--only-upgrade'])
+    assert list(txn.pending) == [
+        (('--no-install-recommends',), False),
+        (('--only-upgrade',), False),
+    ]
@@ -0,0 +1,84 @@
+import os
+import time
+import unittest
+
+from fabric.api import abort, env
+
+
+def _host():
+    return env.host_string
+
+
+def _fail_on_b():
+    if env.host == 'b':
+        abort('b is broken')
+    return env.host
+
+
+class RunOnHostsTestCase(unittest.TestCase):
+
+    def test_serial(self):
+        from fabtools.executor import run_on_hosts
+
+        results = run_on_hosts(_host, ['a', 'alice@b:2222'], pool_size=1)
+        self.assertEqual(list(results), ['a', 'alice@b:2222'])
+        self.assertEqual(results['alice@b:2222'].result, 'alice@b:2222')
+        self.assertEqual(results.succeeded, ['a', 'alice@b:2222'])
+
+    def test_parallel(self):
+        from fabtools.executor import run_on_hosts
+
+        def slow():
+            time.sleep(0.5)
+            return os.getpid()
+
+        start = time.time()
+        results = run_on_hosts(slow, ['a', 'b', 'c', 'd'], pool_size=4)
+        self.assertLess(time.time() - start, 1.5)
+        self.assertEqual(results.succeeded, ['a', 'b', 'c', 'd'])
+        self.assertNotIn(os.getpid(), [res.result for res in results.values()])
+
+    def test_continue_on_error(self):
+        from fabtools.executor import run_on_hosts
+
+        seen = []
+        results = run_on_hosts(_fail_on_b, ['a', 'b', 'c'], pool_size=1,
+                               progress=seen.append)
+        self.assertEqual(results.failed, ['b'])
+        self.assertEqual(results['b'].error, 'b is broken')
+        self.assertEqual(results.succeeded, ['a', 'c'])
+        self.assertEqual([res.host for res in seen], ['a', 'b', 'c'])
+
+    def test_fail_fast(self):
+        from fabtools.executor import run_on_hosts
+
+        results = run_on_hosts(_fail_on_b, ['a', 'b', 'c'], pool_size=1,
+                               fail_fast=True)
+        self.assertEqual(results.succeeded, ['a'])
+        self.assertEqual(results.failed, ['b'])
+        self.assertEqual(results.skipped, ['c'])
+
+    def test_exception_in_worker(self):
+        from fabtools.executor import run_on_hosts
+
+        def broken(value):
+            raise ValueError(value)
+
+        results = run_on_hosts(broken, ['a', 'b'], args=('oops',),
+                               pool_size=2)
+        self.assertEqual(results.failed, ['a', 'b'])
+        self.assertEqual(results['a'].error, 'ValueError: oops')
+        self.assertIn('ValueError', results['a'].traceback)
+
+    def test_host_caches_are_merged(self):
+        from fabtools.executor import run_on_hosts
+        from fabtools.system import _FACTS
+        from fabtools.utils import host_key
+
+        def gather():
+            _FACTS[host_key()] = {'kernel': env.host}
+
+        _FACTS.clear()
+        run_on_hosts(gather, ['a', 'b'], pool_size=2)
+        self.assertEqual(_FACTS, {'a': {'kernel': 'a'}, 'b': {'kernel': 'b'}})
+        _FACTS.clear()
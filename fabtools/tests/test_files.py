@@ -1,16 +1,29 @@
 import hashlib
 import unittest
 
-from mock import patch
+from mock import Mock, patch
 import pytest
 
+from fabtools.tests.conftest import _result
 
-@patch('fabtools.require.files._mode')
-@patch('fabtools.require.files._owner')
-@patch('fabtools.require.files.umask')
+
+def _stat(type_='file', owner='root', group='root', mode='644'):
+    return {
+        'type': type_,
+        'owner': owner,
+        'group': group,
+        'mode': mode,
+        'size': 0,
+        'mtime': 0,
+    }
+
+
+@patch('fabtools.require.files._root_umask')
+@patch('fabtools.require.files.run_as_root')
 @patch('fabtools.require.files.put')
-@patch('fabtools.require.files.md5sum')
-@patch('fabtools.require.files.is_file')
+@patch('fabtools.require.files.checksum_algorithm', return_value='md5')
+@patch('fabtools.require.files.checksum')
+@patch('fabtools.require.files.stat_many')
 class FilesTestCase(unittest.TestCase):
 
     def _file(self, *args, **kwargs):
@@ -19,50 +32,225 @@ class FilesTestCase(unittest.TestCase):
         from fabtools import require
         require.files.file(*args, **kwargs)
 
-    def test_verify_remote_false(self, is_file, md5sum, put, umask, owner, mode):
+    def test_verify_remote_false(self, stat_many, checksum, algorithm, put, run_as_root, umask):
         """ If verify_remote is set to False, then we should find that
-        only is_file is used to check for the file's existence. Hashlib's
-        md5 should not have been called.
+        only stat_many is used to check for the file's existence. The
+        remote checksum should not have been computed.
         """
-        is_file.return_value = True
-        self._file(contents='This is a test', verify_remote=False)
-        self.assertTrue(is_file.called)
-        self.assertFalse(md5sum.called)
+        stat_many.return_value = {'/var/tmp/foo': _stat()}
+        self._file('/var/tmp/foo', contents='This is a test', verify_remote=False)
+        self.assertTrue(stat_many.called)
+        self.assertFalse(checksum.called)
 
-    def test_verify_remote_true(self, is_file, md5sum, put, umask, owner, mode):
-        """ If verify_remote is True, then we should find that an MD5 hash is
+    def test_verify_remote_true(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        """ If verify_remote is True, then we should find that a checksum is
         used to work out whether the file is different.
         """
-        is_file.return_value = True
-        md5sum.return_value = hashlib.md5('This is a test').hexdigest()
-        self._file(contents='This is a test', verify_remote=True)
-        self.assertTrue(is_file.called)
-        self.assertTrue(md5sum.called)
-
-    def test_temp_dir(self, is_file, md5sum, put, umask, owner, mode):
-        owner.return_value = 'root'
+        stat_many.return_value = {'/var/tmp/foo': _stat()}
+        checksum.return_value = hashlib.md5('This is a test').hexdigest()
+        self._file('/var/tmp/foo', contents='This is a test', verify_remote=True)
+        self.assertTrue(stat_many.called)
+        self.assertTrue(checksum.called)
+        self.assertFalse(put.called)
+
+    def test_temp_dir(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': None}
         umask.return_value = '0002'
-        mode.return_value = '0664'
         from fabtools import require
         require.file('/var/tmp/foo', source=__file__, use_sudo=True, temp_dir='/somewhere')
         put.assert_called_with(__file__, '/var/tmp/foo', use_sudo=True, temp_dir='/somewhere')
 
-    def test_home_as_temp_dir(self, is_file, md5sum, put, umask, owner, mode):
-        owner.return_value = 'root'
+    def test_home_as_temp_dir(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': None}
         umask.return_value = '0002'
-        mode.return_value = '0664'
         from fabtools import require
         require.file('/var/tmp/foo', source=__file__, use_sudo=True, temp_dir='')
         put.assert_called_with(__file__, '/var/tmp/foo', use_sudo=True, temp_dir='')
 
-    def test_default_temp_dir(self, is_file, md5sum, put, umask, owner, mode):
-        owner.return_value = 'root'
+    def test_default_temp_dir(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': None}
         umask.return_value = '0002'
-        mode.return_value = '0664'
         from fabtools import require
         require.file('/var/tmp/foo', source=__file__, use_sudo=True)
         put.assert_called_with(__file__, '/var/tmp/foo', use_sudo=True, temp_dir='/tmp')
 
+    def test_attributes_after_upload(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        """ Once uploaded, owner and mode are set using a single command """
+        stat_many.return_value = {'/var/tmp/foo': None}
+        umask.return_value = '0022'
+        self._file('/var/tmp/foo', contents='This is a test', use_sudo=True)
+        run_as_root.assert_called_once_with(
+            'chown root: "/var/tmp/foo" && chmod 0644 "/var/tmp/foo"')
+
+    def test_attributes_unchanged(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': _stat(mode='644')}
+        checksum.return_value = hashlib.md5('This is a test').hexdigest()
+        umask.return_value = '0022'
+        self._file('/var/tmp/foo', contents='This is a test', use_sudo=True)
+        self.assertFalse(put.called)
+        self.assertFalse(run_as_root.called)
+
+    def test_mode_changed(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': _stat(mode='644')}
+        checksum.return_value = hashlib.md5('This is a test').hexdigest()
+        self._file('/var/tmp/foo', contents='This is a test', use_sudo=True, mode='0600')
+        run_as_root.assert_called_once_with('chmod 0600 "/var/tmp/foo"')
+
+    def test_checksum_algorithm(self, stat_many, checksum, algorithm, put, run_as_root, umask):
+        stat_many.return_value = {'/var/tmp/foo': _stat()}
+        algorithm.return_value = 'sha256'
+        checksum.return_value = hashlib.sha256('This is a test').hexdigest()
+        self._file('/var/tmp/foo', contents='This is a test')
+        checksum.assert_called_once_with('/var/tmp/foo', 'sha256', use_sudo=False)
+        self.assertFalse(put.called)
+
+
+class ChecksumTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.files import _CHECKSUM_TOOLS
+        _CHECKSUM_TOOLS.clear()
+
+    tearDown = setUp
+
+    @patch('fabtools.files.run')
+    def test_tools_located_once(self, mock_run):
+        from fabtools.files import checksum_tools, md5sum
+        mock_run.side_effect = [
+            'md5=/sbin/md5\nsha256=/usr/bin/shasum\nblake2b=',
+            _result('d41d8cd98f00b204e9800998ecf8427e f1'),
+            _result('d41d8cd98f00b204e9800998ecf8427e f2'),
+        ]
+        self.assertEqual(md5sum('f1'), 'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEqual(md5sum('f2'), 'd41d8cd98f00b204e9800998ecf8427e')
+        self.assertEqual(mock_run.call_count, 3)
+        self.assertEqual(mock_run.call_args[0][0], '/sbin/md5 -r f2')
+        self.assertEqual(checksum_tools(), {
+            'md5': '/sbin/md5 -r',
+            'sha256': '/usr/bin/shasum -a 256',
+            'blake2b': None,
+        })
+
+    @patch('fabtools.files.run')
+    def test_auto_algorithm(self, mock_run):
+        from fabric.api import settings
+        from fabtools.files import checksum_algorithm
+        mock_run.return_value = 'md5=/usr/bin/md5sum\nsha256=/usr/bin/sha256sum\nblake2b='
+        self.assertEqual(checksum_algorithm(), 'md5')
+        with settings(fabtools_checksum_algorithm='auto'):
+            self.assertEqual(checksum_algorithm(), 'sha256')
+
+
+@patch('fabtools.require.files.run')
+@patch('fabtools.require.files.stat_many')
+class DirectoryTestCase(unittest.TestCase):
+
+    def test_missing_directory(self, stat_many, run):
+        from fabtools.require.files import directory
+        stat_many.return_value = {'/tmp/foo': None}
+        directory('/tmp/foo', owner='alice', mode='750')
+        self.assertEqual(run.call_args_list[0][0][0], 'mkdir -p "/tmp/foo"')
+        self.assertEqual(run.call_args_list[1][0][0],
+                         'chown alice: "/tmp/foo" && chmod 750 "/tmp/foo"')
+
+    def test_existing_directory(self, stat_many, run):
+        from fabtools.require.files import directory
+        stat_many.return_value = {'/tmp/foo': _stat('directory', 'alice', mode='750')}
+        directory('/tmp/foo', owner='alice', mode='0750')
+        self.assertFalse(run.called)
+
+    def test_wrong_group(self, stat_many, run):
+        from fabtools.require.files import directory
+        stat_many.return_value = {'/tmp/foo': _stat('directory', 'alice', mode='750')}
+        directory('/tmp/foo', owner='alice', group='staff', mode='750')
+        run.assert_called_once_with('chown alice:staff "/tmp/foo"')
+
+
+@patch('fabtools.require.files.run')
+class DirectoriesBatchTestCase(unittest.TestCase):
+
+    def test_single_command(self, run):
+        from fabtools.require.files import directories
+        run.return_value = (
+            'fabtools:0: created\n'
+            'fabtools:1:\n'
+            'fabtools:2: owner mode'
+        )
+        changes = directories(['/tmp/a', '/tmp/b', '/tmp/c'], owner='alice',
+                              mode='0750', batch=True)
+        self.assertEqual(run.call_count, 1)
+        self.assertEqual(changes, {
+            '/tmp/a': ['created'],
+            '/tmp/b': [],
+            '/tmp/c': ['owner', 'mode'],
+        })
+        script = run.call_args[0][0]
+        self.assertTrue("_owner=alice" in script)
+        self.assertTrue("_octal_mode=750" in script)
+        self.assertTrue("for p in /tmp/a /tmp/b /tmp/c; do" in script)
+
+    def test_failure(self, run):
+        from fabtools.require.files import directories
+        run.return_value = (
+            "chown: invalid user: 'bob:'\n"
+            'fabtools:0: !owner'
+        )
+        with pytest.raises(SystemExit):
+            directories(['/tmp/a'], owner='bob', batch=True)
+
+
+class TestStatMany(unittest.TestCase):
+
+    @patch('fabtools.files.run')
+    def test_stat_many(self, mock_run):
+        from fabtools.files import stat_many
+        mock_run.return_value = (
+            'fabtools:0:directory root root 755 4096 1381505030\n'
+            'fabtools:1:missing\n'
+            'fabtools:2:file alice staff 640 12 1381505031'
+        )
+        stats = stat_many(['/etc', '/nope', '/home/alice/foo.txt'])
+        self.assertEqual(mock_run.call_count, 1)
+        self.assertEqual(stats['/etc'], {
+            'type': 'directory',
+            'owner': 'root',
+            'group': 'root',
+            'mode': '755',
+            'size': 4096,
+            'mtime': 1381505030,
+        })
+        self.assertEqual(stats['/nope'], None)
+        self.assertEqual(stats['/home/alice/foo.txt']['owner'], 'alice')
+
+    @patch('fabtools.files.run')
+    def test_stat_many_ignores_other_output(self, mock_run):
+        from fabtools.files import stat_many
+        mock_run.return_value = (
+            'sudo: unable to resolve host web1\n'
+            'fabtools:0:file root root 644 10 1381505030\n'
+            "stat: cannot statx '/srv': Permission denied\n"
+            'fabtools:1:missing'
+        )
+        stats = stat_many(['/etc/hosts', '/srv/foo'])
+        self.assertEqual(stats['/etc/hosts']['mode'], '644')
+        self.assertEqual(stats['/srv/foo'], None)
+
+    @patch('fabtools.files.run')
+    def test_stat_many_missing_result(self, mock_run):
+        from fabtools.files import stat_many
+        mock_run.return_value = (
+            'fabtools:0:file root root 644 10 1381505030\n'
+            'directory root root 755 4096 1381505030'
+        )
+        with pytest.raises(SystemExit):
+            stat_many(['/etc/hosts', '/etc'])
+
+    @patch('fabtools.files.run')
+    def test_stat_many_empty(self, mock_run):
+        from fabtools.files import stat_many
+        self.assertEqual(stat_many([]), {})
+        self.assertFalse(mock_run.called)
+
 
 class TestUploadTemplate(unittest.TestCase):
 
@@ -215,3 +403,50 @@ def test_remove_recursive_force(mock_run):
     from fabtools.files import remove
     remove('/tmp/src', recursive=True, force=True)
     mock_run.assert_called_with('/bin/rm -r -f /tmp/src')
+
+
+@patch('fabtools.files.checksum_algorithm', return_value='md5')
+@patch('fabtools.files.checksums')
+class WatchTestCase(unittest.TestCase):
+
+    def test_changed_files(self, checksums, algorithm):
+        from fabtools.files import watch
+        checksums.side_effect = [
+            {'/etc/a.conf': 'aaa', '/etc/b.conf': 'bbb', '/etc/c.conf': None},
+            {'/etc/a.conf': 'aaa', '/etc/b.conf': 'ccc', '/etc/c.conf': 'ddd'},
+        ]
+        callback = Mock()
+        with watch(['/etc/a.conf', '/etc/b.conf', '/etc/c.conf'], callback=callback) as config:
+            pass
+        self.assertEqual(checksums.call_count, 2)
+        self.assertTrue(config.changed)
+        self.assertEqual(config.changed_files, ['/etc/b.conf', '/etc/c.conf'])
+        callback.assert_called_once_with()
+
+    def test_unchanged(self, checksums, algorithm):
+        from fabtools.files import watch
+        checksums.return_value = {'/etc/a.conf': 'aaa'}
+        with watch('/etc/a.conf') as config:
+            pass
+        self.assertFalse(config.changed)
+        self.assertEqual(config.changed_files, [])
+
+
+@pytest.mark.parametrize('output,succeeded,expected', [
+    ('42', True, 42),
+    ('', False, None),
+])
+def test_age(output, succeeded, expected):
+    from fabtools.files import age
+    with patch('fabtools.files.run') as mock_run:
+        mock_run.return_value = _result(output, succeeded)
+        assert age('/tmp/stamp') == expected
+    assert mock_run.call_count == 1
+
+
+def test_age_bsd_stat():
+    from fabtools.files import age
+    with patch('fabtools.files.run') as mock_run:
+        mock_run.return_value = _result('42')
+        age('/tmp/stamp')
+    assert 'stat -f %m "/tmp/stamp"' in mock_run.call_args[0][0]
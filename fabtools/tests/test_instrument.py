@@ -0,0 +1,134 @@
+import json
+import unittest
+from StringIO import StringIO
+
+from mock import patch
+
+from fabric.api import settings
+from fabric.operations import _AttributeString
+
+
+def _fake_run_command(command, *args, **kwargs):
+    res = _AttributeString('0022')
+    res.stderr = ''
+    res.succeeded = True
+    res.failed = False
+    return res
+
+
+class RecordingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools import instrument
+
+        instrument._install()
+        patcher = patch.dict(instrument._ORIGINALS,
+                             run_command=_fake_run_command)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_records_commands(self):
+        from fabtools import instrument
+        from fabtools.files import umask
+        from fabtools.require.files import _ROOT_UMASK, _root_umask
+
+        _ROOT_UMASK.clear()
+        with settings(host_string='example.com', user='alice'):
+            with instrument.recording() as recorder:
+                umask()
+                _root_umask()
+        _ROOT_UMASK.clear()
+
+        first, second = recorder.records
+        self.assertEqual(first['host'], 'example.com')
+        self.assertEqual(first['kind'], 'run')
+        self.assertEqual(first['function'], 'fabtools.files.umask')
+        self.assertEqual(first['sent'], len('umask'))
+        self.assertEqual(first['received'], len('0022'))
+        self.assertEqual(second['kind'], 'sudo')
+        self.assertEqual(second['function'], 'fabtools.files.umask')
+        self.assertEqual(second['caller'], 'fabtools.require.files._root_umask')
+
+    def test_survives_batch(self):
+        import fabric.operations
+        import fabric.sftp
+        from fabric.api import run
+        from fabtools import instrument
+        from fabtools.checks import batch
+
+        SFTP = fabric.sftp.SFTP
+        # Install the instrumentation from scratch, inside a batch block
+        with patch.dict(instrument._ORIGINALS, clear=True), \
+                patch.object(fabric.operations, '_run_command',
+                             _fake_run_command), \
+                patch.object(SFTP, 'put', SFTP.__dict__['put']), \
+                patch.object(SFTP, 'put_dir', SFTP.__dict__['put_dir']), \
+                patch.object(SFTP, 'get', SFTP.__dict__['get']):
+            with settings(host_string='example.com'):
+                with batch():
+                    with instrument.recording():
+                        pass
+                with instrument.recording() as recorder:
+                    run('umask')
+        self.assertEqual(len(recorder.records), 1)
+
+    def test_not_recording(self):
+        from fabtools import instrument
+        from fabtools.files import umask
+
+        with settings(host_string='example.com'):
+            with instrument.recording() as recorder:
+                pass
+            umask()
+        self.assertEqual(recorder.records, [])
+
+
+class RecorderTestCase(unittest.TestCase):
+
+    def _recorder(self):
+        from fabtools.instrument import Recorder
+
+        recorder = Recorder()
+        for host, function, duration in [('a', 'f', 1.0), ('a', 'g', 0.5),
+                                         ('b', 'f', 2.0)]:
+            recorder.records.append({
+                'host': host, 'kind': 'run', 'function': function,
+                'caller': 'c', 'command': 'true', 'time': duration,
+                'sent': 10, 'received': 5,
+            })
+        return recorder
+
+    def test_summary(self):
+        summary = self._recorder().summary('function')
+        self.assertEqual(summary, [
+            {'name': 'f', 'count': 2, 'time': 3.0, 'sent': 20, 'received': 10},
+            {'name': 'g', 'count': 1, 'time': 0.5, 'sent': 10, 'received': 5},
+        ])
+
+    def test_json(self):
+        data = json.loads(self._recorder().to_json())
+        self.assertEqual(data['total']['count'], 3)
+        self.assertEqual([host['name'] for host in data['hosts']], ['b', 'a'])
+        self.assertEqual(len(data['records']), 3)
+
+    def test_table(self):
+        lines = self._recorder().table('host').splitlines()
+        self.assertEqual(lines[0].split(),
+                         ['HOST', 'CALLS', 'TIME', '(s)', 'SENT', 'RECEIVED'])
+        self.assertEqual(lines[1].split(), ['b', '1', '2.000', '10', '5'])
+        self.assertEqual(lines[-1].split(), ['TOTAL', '3', '3.500', '30', '15'])
+
+
+class SizeTestCase(unittest.TestCase):
+
+    def test_file_like(self):
+        from fabtools.instrument import _size
+
+        f = StringIO('hello')
+        f.read()
+        self.assertEqual(_size(f), 5)
+
+    def test_missing_file(self):
+        from fabtools.instrument import _size
+
+        self.assertEqual(_size('/no/such/file'), 0)
@@ -0,0 +1,65 @@
+import glob
+import os
+import subprocess
+import sys
+import unittest
+
+
+def _run(statement):
+    return subprocess.check_output(
+        [sys.executable, '-W', 'ignore', '-c', statement]).strip()
+
+
+class LazyImportTestCase(unittest.TestCase):
+
+    def test_submodules_are_not_imported(self):
+        output = _run(
+            'import sys, fabtools; '
+            'print(sorted(name for name in sys.modules '
+            'if name.startswith("fabtools.") and sys.modules[name]))')
+        self.assertEqual(output, "['fabtools.utils']")
+
+    def test_submodule_access(self):
+        output = _run(
+            'import fabtools; '
+            'print(fabtools.deb.__name__)')
+        self.assertEqual(output, 'fabtools.deb')
+
+    def test_all_submodules(self):
+        import fabtools
+        package_dir = os.path.dirname(fabtools.__file__)
+        names = sorted(
+            os.path.splitext(os.path.basename(path))[0]
+            for path in glob.glob(os.path.join(package_dir, '*.py'))
+            if not path.endswith('__init__.py')
+        )
+        output = _run(
+            'import fabtools; '
+            'print("\\n".join(getattr(fabtools, name).__name__ '
+            'for name in %r))' % names)
+        self.assertEqual(output.splitlines(),
+                         ['fabtools.%s' % name for name in names])
+
+    def test_require_shortcuts(self):
+        output = _run(
+            'import sys, fabtools; '
+            'from fabtools.require import file; '
+            'print(file.__module__); '
+            'print(fabtools.icanhaz is fabtools.require); '
+            'print("fabtools.require.deb" in sys.modules); '
+            'print(fabtools.require.deb.packages.__module__)')
+        self.assertEqual(output.splitlines(), [
+            'fabtools.require.files',
+            'True',
+            'False',
+            'fabtools.require.deb',
+        ])
+
+    def test_unknown_attribute(self):
+        import fabtools
+        self.assertRaises(AttributeError, getattr, fabtools, 'no_such_module')
+
+    def test_batch(self):
+        import fabtools
+        from fabtools.checks import batch
+        self.assertIs(fabtools.batch, batch)
@@ -0,0 +1,85 @@
+from mock import patch
+
+import pytest
+
+from fabtools.tests.conftest import _result
+
+
+BACKEND = 'portage'
+
+PACKAGES_OUTPUT = """\
+dev-db/redis-7.0.11-r1
+dev-lang/python-3.11.4
+dev-lang/python-3.12.0_rc2
+media-fonts/font-adobe-100dpi-1.0.4
+sys-apps/-MERGING-coreutils-9.3
+"""
+
+
+def test_installed_packages(mock_run):
+    from fabtools.portage import installed_packages
+    assert installed_packages() == {
+        'dev-db/redis': ['7.0.11-r1'],
+        'dev-lang/python': ['3.11.4', '3.12.0_rc2'],
+        'media-fonts/font-adobe-100dpi': ['1.0.4'],
+    }
+
+
+@pytest.mark.parametrize('atom,expected', [
+    ('redis', True),
+    ('dev-db/redis', True),
+    ('dev-lang/redis', False),
+    ('mongodb', False),
+    ('font-adobe-100dpi', True),
+    ('=dev-db/redis-7.0.11-r1', True),
+    ('=dev-db/redis-7.0.11', False),
+    ('~dev-db/redis-7.0.11', True),
+    ('=redis-7.0*', True),
+    ('=redis-7.1*', False),
+    ('>=python-3.12.0', False),
+    ('>=python-3.12.0_beta1', True),
+    ('<python-3.11.4', False),
+    ('<=python-3.11.4', True),
+    ('>python-3.11.4_p1', True),
+])
+def test_is_installed(mock_run, atom, expected):
+    from fabtools.portage import is_installed
+    assert is_installed(atom) is expected
+    assert mock_run.call_count == 1
+
+
+def test_slot_atoms_use_emerge(mock_run):
+    from fabtools.portage import is_installed
+    with patch('fabtools.portage.run') as mock_emerge:
+        mock_emerge.return_value = _result(
+            '\n[ebuild  N     ] dev-lang/python:3.12')
+        assert not is_installed('dev-lang/python:3.12')
+    mock_emerge.assert_called_once_with(
+        'emerge --color n -p dev-lang/python:3.12')
+    assert not mock_run.called
+
+
+def test_version_key():
+    from fabtools.portage import _version_key
+    versions = ['1.0', '1.0_alpha2', '1.0_p1', '1.0-r1', '1.0a', '1.0.1',
+                '1.0_rc1', '0.9']
+    assert sorted(versions, key=_version_key) == [
+        '0.9', '1.0_alpha2', '1.0_rc1', '1.0', '1.0-r1', '1.0_p1', '1.0a',
+        '1.0.1']
+
+
+def test_require_packages_installs_the_missing_ones(mock_run,
+                                                   mock_run_as_root):
+    from fabtools.require.portage import packages
+    packages(['redis', 'dev-db/mongodb', '=dev-lang/python-3.11.4'])
+    mock_run_as_root.assert_called_once_with(
+        'emerge --color n  dev-db/mongodb', pty=False)
+    assert mock_run.call_count == 1
+
+
+def test_install_updates_the_snapshot(mock_run, mock_run_as_root):
+    from fabtools.portage import install, is_installed
+    assert not is_installed('mongodb')
+    install(['mongodb'])
+    assert is_installed('mongodb')
+    assert mock_run.call_count == 1
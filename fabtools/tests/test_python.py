@@ -21,3 +21,64 @@ class PythonTestCase(unittest.TestCase):
         res = is_pip_installed(version='1.3.1')
 
         self.assertTrue(res)
+
+
+FREEZE = """\
+Flask==2.2.5
+zope.interface==5.5.2
+-e git+https://github.com/example/app.git@abc123#egg=myapp
+requests @ file:///tmp/requests-2.31.0-py3-none-any.whl
+"""
+
+
+class InventoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from fabtools.python import _INVENTORIES
+        _INVENTORIES.clear()
+        patcher = mock.patch('fabtools.python.run')
+        self.mock_run = patcher.start()
+        self.mock_run.return_value = FREEZE
+        self.addCleanup(patcher.stop)
+        self.addCleanup(_INVENTORIES.clear)
+
+    def test_installed_packages(self):
+        from fabtools.python import installed_packages
+        self.assertEqual(installed_packages(), {
+            'flask': '2.2.5',
+            'zope-interface': '5.5.2',
+            'myapp': None,
+            'requests': None,
+        })
+
+    def test_is_installed_uses_a_single_query(self):
+        from fabtools.python import is_installed
+        self.assertTrue(is_installed('flask'))
+        self.assertTrue(is_installed('Zope_Interface'))
+        self.assertTrue(is_installed('Flask==2.2.5'))
+        self.assertFalse(is_installed('Flask==2.3.0'))
+        self.assertFalse(is_installed('django'))
+        self.assertEqual(self.mock_run.call_count, 1)
+
+    def test_is_installed_from_url(self):
+        from fabtools.python import is_installed
+        self.assertTrue(is_installed('myapp'))
+        self.assertTrue(is_installed('requests'))
+        self.assertFalse(is_installed('myapp==1.0'))
+
+    def test_inventory_per_pip_command_and_virtualenv(self):
+        from fabtools.python import is_installed, virtualenv
+        is_installed('flask')
+        is_installed('flask', pip_cmd='pip3')
+        with virtualenv('/srv/venv'):
+            is_installed('flask')
+            is_installed('django')
+        self.assertEqual(self.mock_run.call_count, 3)
+
+    def test_install_refreshes_the_inventory(self):
+        from fabtools.python import install, is_installed
+        self.assertFalse(is_installed('django'))
+        install('django')
+        self.mock_run.return_value = FREEZE + 'Django==4.2.7\n'
+        self.assertTrue(is_installed('django'))
+        self.assertEqual(self.mock_run.call_count, 3)
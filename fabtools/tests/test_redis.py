@@ -1,5 +1,7 @@
 import unittest
 
+from mock import patch
+
 
 class RedisTestCase(unittest.TestCase):
 
@@ -29,3 +31,19 @@ class RedisTestCase(unittest.TestCase):
             _download_url('2.6.15'),
             'http://download.redis.io/releases/'
         )
+
+
+class _Stop(Exception):
+    pass
+
+
+@patch('fabtools.require.user', side_effect=_Stop)
+@patch('fabtools.system.distrib_id', return_value='foo')
+@patch('fabtools.system.distrib_family', return_value='other')
+@patch('fabtools.require.system.distrib_family', return_value='other')
+class UnsupportedFamilyTestCase(unittest.TestCase):
+
+    def test_installed_from_source(self, *mocks):
+        from fabtools.require.redis import installed_from_source
+        # The build dependencies are left alone, as before
+        self.assertRaises(_Stop, installed_from_source)
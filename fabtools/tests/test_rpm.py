@@ -0,0 +1,157 @@
+from mock import patch
+
+import pytest
+
+from fabtools.tests.conftest import _result
+
+
+BACKEND = 'rpm'
+
+PACKAGES_OUTPUT = """\
+glibc\tx86_64\t2.17\t326.el7_9
+glibc\ti686\t2.17\t326.el7_9
+nginx\tx86_64\t1.20.1\t10.el7
+"""
+
+
+@pytest.yield_fixture(autouse=True)
+def mock_whatprovides():
+    """
+    Fake the queries about the names missing from the snapshot (not
+    provided by any package, unless the test says otherwise)
+    """
+    with patch('fabtools.rpm.run') as mock:
+        mock.return_value = _result('', succeeded=False)
+        yield mock
+
+
+def test_installed_packages(mock_run):
+    from fabtools.rpm import installed_packages
+    packages = installed_packages()
+    assert packages['nginx'] == '1.20.1-10.el7'
+    assert packages['nginx.x86_64'] == '1.20.1-10.el7'
+    assert packages['nginx-1.20.1'] == '1.20.1-10.el7'
+    assert packages['nginx-1.20.1-10.el7'] == '1.20.1-10.el7'
+    assert packages['nginx-1.20.1-10.el7.x86_64'] == '1.20.1-10.el7'
+    assert 'glibc.i686' in packages
+
+
+def test_is_installed_uses_a_single_query(mock_run):
+    from fabtools.rpm import is_installed
+    assert is_installed('nginx')
+    assert is_installed('glibc.i686')
+    assert not is_installed('httpd')
+    assert mock_run.call_count == 1
+
+
+def test_is_installed_checks_the_provides(mock_run, mock_whatprovides):
+    from fabtools.rpm import is_installed
+    mock_whatprovides.return_value = _result('httpd-2.4.6-99.el7.x86_64')
+    assert is_installed('webserver')
+    assert is_installed('/usr/sbin/httpd')
+    mock_whatprovides.assert_called_with(
+        'rpm --query --whatprovides /usr/sbin/httpd')
+    assert mock_run.call_count == 1
+
+
+def test_is_installed_accepts_the_names_known_by_rpm(mock_run):
+    from fabtools.rpm import is_installed
+    assert is_installed('nginx-1.20.1')
+    assert is_installed('nginx-1.20.1-10.el7')
+    assert is_installed('glibc-2.17.i686')
+    assert not is_installed('nginx-1.24.0')
+
+
+def test_install_updates_the_snapshot(mock_run, mock_run_as_root):
+    from fabtools.rpm import install, is_installed
+    assert not is_installed('httpd')
+    install(['httpd', 'mod_ssl'])
+    assert is_installed('httpd')
+    assert is_installed('mod_ssl')
+    assert mock_run.call_count == 1
+
+
+def test_uninstall_updates_the_snapshot(mock_run, mock_run_as_root,
+                                        mock_whatprovides):
+    from fabtools.rpm import is_installed, uninstall
+    assert is_installed('nginx')
+    uninstall('nginx')
+    assert not is_installed('nginx')
+    assert mock_run.call_count == 1
+    assert not mock_whatprovides.called
+
+
+def test_upgrade_invalidates_the_snapshot(mock_run, mock_run_as_root):
+    from fabtools.rpm import is_installed, upgrade
+    assert is_installed('nginx')
+    upgrade()
+    assert is_installed('nginx')
+    assert mock_run.call_count == 2
+
+
+def test_require_packages_installs_the_missing_ones(mock_run,
+                                                   mock_run_as_root):
+    from fabtools.require.rpm import packages
+    packages(['nginx', 'httpd', 'glibc'])
+    mock_run_as_root.assert_called_once_with(
+        'yum -y --color=never  install httpd')
+    assert mock_run.call_count == 1
+
+
+@pytest.mark.parametrize('module,mock_run,expected', [
+    ('arch', 'linux 6.6.1.arch1-1\nnginx 1.24.0-1\n', {
+        'linux': '6.6.1.arch1-1',
+        'nginx': '1.24.0-1',
+    }),
+    ('opkg', 'busybox - 1.36.1-1\nlibc - 1.2.4-4 - musl\n', {
+        'busybox': '1.36.1-1',
+        'libc': '1.2.4-4',
+    }),
+    ('pkg', 'redis-7.0.11;Persistent key-value database\n'
+            'py39-pip-23.1;Python package installer\n', {
+        'redis': '7.0.11',
+        'redis-7.0.11': '7.0.11',
+        'py39-pip': '23.1',
+        'py39-pip-23.1': '23.1',
+    }),
+], indirect=['mock_run'])
+def test_other_backends(module, mock_run, expected):
+    mod = __import__('fabtools.%s' % module, fromlist=['installed_packages'])
+    assert mod.installed_packages() == expected
+    assert mod.is_installed(sorted(expected)[0])
+    assert not mod.is_installed('no-such-package')
+    assert mock_run.call_count == 1
+
+
+def test_pkg_patterns(mock_run):
+    from fabtools.pkg import is_installed
+    mock_run.return_value = 'redis-7.0.11;Persistent key-value database\n'
+    with patch('fabtools.pkg.run') as mock_pkg_info:
+        mock_pkg_info.return_value = _result('redis-7.0.11')
+        assert is_installed('redis>=7')
+        assert not is_installed('memcached')
+    mock_pkg_info.assert_called_once_with("pkg_info -e 'redis>=7'")
+
+
+@pytest.mark.parametrize('update_age,max_age,updated', [
+    (None, 86400, True),
+    (3600, 86400, False),
+    (3600, {'minutes': 30}, True),
+])
+def test_uptodate_index(update_age, max_age, updated):
+    from fabtools.require.rpm import uptodate_index
+    with patch('fabtools.require.rpm.age') as mock_age, \
+            patch('fabtools.require.rpm.update_index') as mock_update:
+        mock_age.return_value = update_age
+        uptodate_index(max_age=max_age)
+    mock_age.assert_called_once_with(
+        '/var/lib/fabtools/yum-update-success-stamp')
+    assert mock_update.called is updated
+
+
+def test_update_index_touches_the_stamp(mock_run_as_root):
+    from fabtools.rpm import update_index
+    update_index()
+    mock_run_as_root.assert_called_once_with(
+        'yum -y --color=never makecache && mkdir -p /var/lib/fabtools && '
+        'touch /var/lib/fabtools/yum-update-success-stamp')
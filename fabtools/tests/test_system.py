@@ -2,6 +2,8 @@ from mock import patch
 
 import pytest
 
+from fabtools.tests.conftest import _result
+
 
 def test_unsupported_system():
 
@@ -16,3 +18,187 @@ def test_unsupported_system():
 
     exception_msg = str(excinfo.value)
     assert exception_msg == "Unsupported family other (foo). Supported families: debian, redhat"
+
+
+DEBIAN_FACTS = """\
+kernel=Linux
+kernel_release=6.1.0-18-amd64
+arch=x86_64
+file:debian_version=1
+file:os-release=1
+os_release:PRETTY_NAME="Debian GNU/Linux 12 (bookworm)"
+os_release:VERSION_ID="12"
+os_release:VERSION="12 (bookworm)"
+systemd=1
+"""
+
+ROCKY_FACTS = """\
+kernel=Linux
+kernel_release=5.14.0-362.el9.x86_64
+arch=x86_64
+file:redhat-release=1
+file:os-release=1
+redhat_release=Rocky Linux release 9.3 (Blue Onyx)
+"""
+
+
+@pytest.yield_fixture
+def mock_run():
+    from fabtools.system import _FACTS
+    _FACTS.clear()
+    with patch('fabtools.system.run') as mock:
+        yield mock
+    _FACTS.clear()
+
+
+def test_facts_are_gathered_once(mock_run):
+    from fabtools.system import (distrib_codename, distrib_desc,
+                                 distrib_family, distrib_id, distrib_release,
+                                 get_arch, using_systemd)
+    mock_run.return_value = _result(DEBIAN_FACTS)
+    assert distrib_id() == 'Debian'
+    assert distrib_family() == 'debian'
+    assert distrib_release() == ''
+    assert distrib_codename() == 'bookworm'
+    assert distrib_desc() == 'Debian GNU/Linux 12 (bookworm)'
+    assert get_arch() == 'x86_64'
+    assert using_systemd()
+    assert mock_run.call_count == 1
+
+
+def test_facts_redhat_release(mock_run):
+    from fabtools.system import (distrib_codename, distrib_desc, distrib_id,
+                                 distrib_release, using_systemd)
+    mock_run.return_value = _result(ROCKY_FACTS)
+    assert distrib_id() == 'RockyLinux'
+    assert distrib_release() == '9.3'
+    assert distrib_codename() == 'Blue Onyx'
+    assert distrib_desc() == 'Rocky Linux release 9.3 (Blue Onyx)'
+    assert not using_systemd()
+
+
+def test_facts_lsb_release(mock_run):
+    from fabtools.system import distrib_id, distrib_release
+    mock_run.return_value = _result(
+        ROCKY_FACTS + 'lsb_id=Rocky\nlsb_release=9.3\n')
+    assert distrib_id() == 'RockyLinux'
+    assert distrib_release() == '9.3'
+
+
+def test_invalidate_facts(mock_run):
+    from fabtools.system import distrib_id, invalidate_facts
+    mock_run.return_value = _result(DEBIAN_FACTS)
+    distrib_id()
+    invalidate_facts()
+    mock_run.return_value = _result(ROCKY_FACTS)
+    assert distrib_id() == 'RockyLinux'
+    assert mock_run.call_count == 2
+
+
+def test_facts_are_per_host(mock_run):
+    from fabric.api import settings
+    from fabtools.system import distrib_id
+    mock_run.return_value = _result(DEBIAN_FACTS)
+    with settings(host_string='alice@foo'):
+        assert distrib_id() == 'Debian'
+    mock_run.return_value = _result(ROCKY_FACTS)
+    with settings(host_string='alice@bar'):
+        assert distrib_id() == 'RockyLinux'
+    with settings(host_string='alice@foo'):
+        assert distrib_id() == 'Debian'
+    assert mock_run.call_count == 2
+
+
+def test_failed_probe_is_not_cached(mock_run, tmpdir):
+    from fabric.api import settings
+    from fabtools.system import distrib_id
+    mock_run.return_value = _result('', succeeded=False)
+    with settings(fabtools_facts_cache_dir=str(tmpdir)):
+        assert distrib_id() == 'Unknown Distribution'
+        assert tmpdir.listdir() == []
+        mock_run.return_value = _result(DEBIAN_FACTS)
+        assert distrib_id() == 'Debian'
+    assert mock_run.call_count == 2
+
+
+def test_incomplete_probe_is_not_cached(mock_run):
+    from fabtools.system import distrib_id, get_arch
+    mock_run.side_effect = [_result('kernel=Linux\n'), _result('aarch64')]
+    assert get_arch() == 'aarch64'
+    mock_run.assert_called_with('uname -m')
+    mock_run.side_effect = None
+    mock_run.return_value = _result(DEBIAN_FACTS)
+    assert distrib_id() == 'Debian'
+    assert get_arch() == 'x86_64'
+    assert mock_run.call_count == 3
+
+
+def test_facts_disk_cache(mock_run, tmpdir):
+    from fabric.api import settings
+    from fabtools.system import _FACTS, distrib_id, invalidate_facts
+    mock_run.return_value = _result(DEBIAN_FACTS)
+    with settings(fabtools_facts_cache_dir=str(tmpdir)):
+        distrib_id()
+        _FACTS.clear()
+        assert distrib_id() == 'Debian'
+        assert mock_run.call_count == 1
+
+        # Expired entries are ignored
+        _FACTS.clear()
+        with settings(fabtools_facts_cache_ttl=-1):
+            distrib_id()
+        assert mock_run.call_count == 2
+
+        invalidate_facts()
+        assert tmpdir.listdir() == []
+
+
+PACKAGES = {
+    'compiler': {
+        'debian': 'build-essential',
+        'redhat': ['gcc', 'make'],
+        'arch': None,
+    },
+    'curl': 'curl',
+}
+
+
+def test_require_packages_debian():
+    from fabtools.require.system import packages
+    with patch('fabtools.require.system.distrib_family') as mock_family, \
+            patch('fabtools.require.deb.packages') as mock_packages:
+        mock_family.return_value = 'debian'
+        packages(PACKAGES, update=True)
+    mock_packages.assert_called_once_with(['build-essential', 'curl'],
+                                          update=True)
+
+
+def test_require_packages_redhat():
+    from fabtools.require.system import packages
+    with patch('fabtools.require.system.distrib_family') as mock_family, \
+            patch('fabtools.require.rpm.packages') as mock_packages:
+        mock_family.return_value = 'redhat'
+        packages(PACKAGES)
+    mock_packages.assert_called_once_with(['gcc', 'make', 'curl'])
+
+
+def test_require_packages_nothing_needed():
+    from fabtools.require.system import packages
+    with patch('fabtools.require.system.distrib_family') as mock_family, \
+            patch('fabtools.require.arch.packages') as mock_packages:
+        mock_family.return_value = 'arch'
+        packages({'compiler': PACKAGES['compiler']})
+    assert not mock_packages.called
+
+
+def test_require_packages_unsupported_family():
+    from fabtools.require.system import packages
+    from fabtools.system import UnsupportedFamily
+    with patch('fabtools.require.system.distrib_family') as mock_family, \
+            patch('fabtools.system.distrib_id') as mock_distrib_id, \
+            patch('fabtools.system.distrib_family') as mock_system_family:
+        mock_family.return_value = mock_system_family.return_value = 'gentoo'
+        mock_distrib_id.return_value = 'Gentoo'
+        with pytest.raises(UnsupportedFamily) as excinfo:
+            packages(PACKAGES)
+    assert excinfo.value.supported == ['arch', 'debian', 'redhat']
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from mock import patch
+
+from fabric.api import env, get, put, run, settings
+
+
+class LocalTransportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _local(self):
+        from fabtools.transport import local
+        return local(shell='/bin/sh -c')
+
+    def test_run(self):
+        with settings(host_string='example.com'):
+            with self._local():
+                self.assertEqual(env.host_string, 'local')
+                res = run('echo hello; echo world >&2')
+            self.assertEqual(env.host_string, 'example.com')
+        self.assertEqual(res, 'hello\nworld')
+        self.assertTrue(res.succeeded)
+        self.assertEqual(res.return_code, 0)
+
+    def test_run_honors_cd(self):
+        from fabric.api import cd
+
+        with self._local():
+            with cd(self.tmpdir):
+                res = run('pwd')
+        self.assertEqual(res, os.path.realpath(self.tmpdir))
+
+    def test_failure(self):
+        with self._local():
+            with settings(warn_only=True):
+                res = run('echo oops >&2; exit 3', combine_stderr=False)
+        self.assertTrue(res.failed)
+        self.assertEqual(res.return_code, 3)
+        self.assertEqual(res.stderr, 'oops')
+
+    def test_abort_on_failure(self):
+        with self._local():
+            self.assertRaises(SystemExit, run, 'exit 1')
+
+    def test_put_and_get(self):
+        path = os.path.join(self.tmpdir, 'foo.txt')
+        with self._local():
+            put(StringIO('hello'), path, mode=0640)
+            downloaded = StringIO()
+            get(path, downloaded)
+        self.assertEqual(downloaded.getvalue(), 'hello')
+        self.assertEqual(os.stat(path).st_mode & 0777, 0640)
+
+    def test_require_file(self):
+        from fabtools.require import file as require_file
+
+        path = os.path.join(self.tmpdir, 'foo.txt')
+        with self._local():
+            require_file(path, contents='hello', mode='600')
+        with open(path) as f:
+            self.assertEqual(f.read(), 'hello')
+        self.assertEqual(os.stat(path).st_mode & 0777, 0600)
+
+
+class ArgvTestCase(unittest.TestCase):
+
+    @patch('os.geteuid', return_value=1000)
+    def test_local(self, geteuid):
+        from fabtools.transport import LocalTransport
+
+        transport = LocalTransport('/bin/sh -c')
+        self.assertEqual(transport.argv('ls'), ['/bin/sh', '-c', 'ls'])
+        self.assertEqual(transport.argv('ls', sudo=True, user='alice'), [
+            'sudo', '-n', '-H', '-u', 'alice', '/bin/sh', '-c', 'ls'])
+
+    @patch('os.geteuid', return_value=0)
+    def test_local_as_root(self, geteuid):
+        from fabtools.transport import LocalTransport
+
+        transport = LocalTransport('/bin/sh -c')
+        self.assertEqual(transport.argv('ls', sudo=True),
+                         ['/bin/sh', '-c', 'ls'])
+
+    @patch('os.geteuid', return_value=1000)
+    def test_chroot(self, geteuid):
+        from fabtools.transport import ChrootTransport
+
+        transport = ChrootTransport('/srv/image')
+        self.assertEqual(transport.host_string, 'chroot:/srv/image')
+        self.assertEqual(transport.argv('ls', sudo=True, user='alice'), [
+            'sudo', '-n', '-H', 'chroot', '--userspec=alice:', '/srv/image',
+            '/bin/sh', '-c', 'ls'])
+
+    def test_container(self):
+        from fabtools.transport import ContainerTransport
+
+        transport = ContainerTransport('builder', engine='podman')
+        self.assertEqual(transport.host_string, 'podman:builder')
+        self.assertEqual(transport.argv('ls'), [
+            'podman', 'exec', '-i', 'builder', '/bin/sh', '-c', 'ls'])
+        self.assertEqual(transport.argv('ls', sudo=True), [
+            'podman', 'exec', '-i', '-u', 'root', 'builder',
+            '/bin/sh', '-c', 'ls'])
+
+    def test_missing_command(self):
+        from fabtools.transport import ContainerTransport
+
+        transport = ContainerTransport('builder', engine='no-such-engine')
+        stdout, stderr, status = transport.execute('ls')
+        self.assertEqual(status, 127)
+
+
+class DefaultTransportTestCase(unittest.TestCase):
+
+    def test_ssh_is_the_default(self):
+        from fabtools.transport import SSHTransport, current
+
+        self.assertIsInstance(current(), SSHTransport)
@@ -0,0 +1,9 @@
+import pytest
+
+
+def test_to_seconds():
+    from fabtools.utils import to_seconds
+    assert to_seconds(90) == 90
+    assert to_seconds({'hour': 1, 'minutes': 30}) == 5400
+    with pytest.raises(ValueError):
+        to_seconds({'fortnight': 1})
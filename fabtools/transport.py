@@ -0,0 +1,489 @@
+"""
+Transports
+==========
+
+This module makes it possible to choose how fabtools (and Fabric's
+``run``, ``sudo``, ``put`` and ``get`` functions) reach the system to
+manage.
+
+By default, commands are run over SSH, using Fabric. Other transports
+run them on the controlling machine itself, inside a chroot, or inside
+a container, without using SSH. This is useful to provision build
+containers or to bake images, and to measure the cost of fabtools
+itself, separately from network latency.
+
+Example::
+
+    from fabtools import require
+    from fabtools.transport import chroot, container, local
+
+    # Provision the controlling machine
+    with local():
+        require.deb.packages(['git', 'rsync'])
+
+    # Provision an image being built in a chroot
+    with chroot('/srv/images/debian-13'):
+        require.deb.packages(['nginx'])
+
+    # Provision a running container
+    with container('builder', engine='podman'):
+        require.file('/etc/motd', contents='Built by fabtools\\n')
+
+Other transports can be implemented by subclassing :py:class:`Transport`
+(or :py:class:`ShellTransport` to reuse its file transfer support), and
+activating them with :py:func:`use`.
+
+.. note:: Inside a chroot, commands run with ``run()`` are run as
+          **root**. Use ``sudo(command, user='foo')`` to run them as
+          an unprivileged user.
+
+"""
+
+from contextlib import contextmanager
+from pipes import quote
+import os
+import shlex
+import subprocess
+
+from fabric.api import hide, settings
+from fabric.context_managers import (
+    quiet as quiet_manager,
+    warn_only as warn_only_manager,
+)
+from fabric.operations import (
+    _AttributeString,
+    _prefix_commands,
+    _prefix_env_vars,
+)
+from fabric.state import output
+from fabric.utils import error
+import fabric.operations
+import fabric.sftp
+
+
+# Positional arguments of fabric.operations._run_command
+_RUN_COMMAND_ARGS = (
+    'shell', 'pty', 'combine_stderr', 'sudo', 'user', 'quiet', 'warn_only',
+    'stdout', 'stderr', 'group', 'timeout', 'shell_escape',
+    'capture_buffer_size',
+)
+
+_ORIGINALS = {}
+
+
+class Transport(object):
+    """
+    Base class of the transports.
+
+    Subclasses must implement :py:meth:`run_command` and
+    :py:meth:`sftp`, and should implement :py:meth:`execute`.
+    """
+
+    #: Host string used when the transport is active (or ``None`` to
+    #: keep the current one)
+    host_string = None
+
+    def run_command(self, command, **kwargs):
+        """
+        Run a command for Fabric's ``run()`` or ``sudo()``, with the
+        same arguments and behavior as Fabric's ``_run_command()``.
+        """
+        raise NotImplementedError
+
+    def sftp(self, host_string):
+        """
+        Get an object with the same interface as ``fabric.sftp.SFTP``,
+        used by Fabric's ``put()`` and ``get()``.
+        """
+        raise NotImplementedError
+
+    def execute(self, command, sudo=False, user=None, group=None,
+                stdin=None, combine_stderr=False):
+        """
+        Run a command quietly, feeding it with the *stdin* string.
+
+        Returns a ``(stdout, stderr, status)`` tuple.
+        """
+        raise NotImplementedError
+
+
+class SSHTransport(Transport):
+    """
+    Run commands over SSH, using Fabric (this is the default).
+    """
+
+    def run_command(self, command, **kwargs):
+        return _ORIGINALS['run_command'](command, **kwargs)
+
+    def sftp(self, host_string):
+        return _ORIGINALS['SFTP'](host_string)
+
+    def execute(self, command, sudo=False, user=None, group=None,
+                stdin=None, combine_stderr=False):
+        if stdin:
+            raise NotImplementedError('stdin is not supported over SSH')
+        with settings(hide('everything'), warn_only=True):
+            res = self.run_command(command, sudo=sudo, user=user, group=group,
+                                   combine_stderr=combine_stderr)
+        return res, res.stderr, res.return_code
+
+
+class ShellTransport(Transport):
+    """
+    Base class of the transports running commands as local processes.
+
+    Subclasses must implement :py:meth:`argv`. Files are transferred
+    by streaming them through ``cat``.
+    """
+
+    def __init__(self, shell=None):
+        self.shell = shell
+
+    def argv(self, command, sudo=False, user=None, group=None):
+        """
+        Get the local process arguments to run *command* (a shell
+        command line) on the target system.
+        """
+        raise NotImplementedError
+
+    def cwd(self):
+        """
+        Local directory where the commands are started (``None`` to keep
+        the current one).
+        """
+        return None
+
+    def shell_argv(self):
+        from fabric.state import env
+
+        return shlex.split(self.shell or env.shell)
+
+    def execute(self, command, sudo=False, user=None, group=None,
+                stdin=None, combine_stderr=False):
+        argv = self.argv(command, sudo, user, group)
+        try:
+            proc = subprocess.Popen(
+                argv,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=combine_stderr and subprocess.STDOUT or subprocess.PIPE,
+                cwd=self.cwd(),
+            )
+        except OSError as e:
+            # Same status as a shell for a missing command
+            return '', '%s: %s' % (argv[0], e.strerror), 127
+        stdout, stderr = proc.communicate(stdin or '')
+        return stdout, stderr or '', proc.returncode
+
+    def run_command(self, command, shell=True, pty=True, combine_stderr=None,
+                    sudo=False, user=None, quiet=False, warn_only=False,
+                    group=None, **kwargs):
+        """
+        Run a command like Fabric's ``_run_command()`` does (printing
+        the command and its output, and handling errors).
+        """
+        from fabric.state import env
+
+        manager = _noop
+        if warn_only:
+            manager = warn_only_manager
+        # Quiet's behavior is a superset of warn_only's, so it wins.
+        if quiet:
+            manager = quiet_manager
+        with manager():
+            given_command = command
+            command = _prefix_env_vars(_prefix_commands(command, 'remote'))
+            argv = self.argv(command, sudo, user, group)
+            real_command = ' '.join(quote(arg) for arg in argv)
+
+            which = 'sudo' if sudo else 'run'
+            if output.debug:
+                print("[%s] %s: %s" % (env.host_string, which, real_command))
+            elif output.running:
+                print("[%s] %s: %s" % (env.host_string, which, given_command))
+
+            if combine_stderr is None:
+                combine_stderr = env.combine_stderr
+            stdout, stderr, status = self.execute(
+                command, sudo, user, group, combine_stderr=combine_stderr)
+
+            if output.stdout:
+                for line in stdout.splitlines():
+                    print("[%s] out: %s" % (env.host_string, line))
+            if output.stderr:
+                for line in stderr.splitlines():
+                    print("[%s] err: %s" % (env.host_string, line))
+
+            out = _AttributeString(stdout.strip())
+            err = _AttributeString(stderr.strip())
+
+            out.failed = False
+            out.command = given_command
+            out.real_command = real_command
+            if status not in env.ok_ret_codes:
+                out.failed = True
+                msg = "%s() received nonzero return code %s while executing" % (
+                    which, status
+                )
+                if env.warn_only:
+                    msg += " '%s'!" % given_command
+                else:
+                    msg += "!\n\nRequested: %s\nExecuted: %s" % (
+                        given_command, real_command
+                    )
+                error(message=msg, stdout=out, stderr=err)
+
+            out.return_code = status
+            out.succeeded = not out.failed
+            out.stderr = err
+            return out
+
+    def sftp(self, host_string):
+        return ShellSFTP(self)
+
+
+class LocalTransport(ShellTransport):
+    """
+    Run commands on the controlling machine, as the current user.
+
+    Commands run with ``sudo()`` use ``sudo -n`` (so ``sudo`` must not
+    ask for a password), unless the current user is already root.
+    """
+
+    host_string = 'local'
+
+    def argv(self, command, sudo=False, user=None, group=None):
+        prefix = []
+        if sudo and (user or group or os.geteuid() != 0):
+            prefix = _sudo_argv(user, group)
+        return prefix + self.shell_argv() + [command]
+
+    def cwd(self):
+        # Like SSH sessions, start in the home directory
+        return os.path.expanduser('~')
+
+
+class ChrootTransport(ShellTransport):
+    """
+    Run commands inside a chroot on the controlling machine.
+
+    The ``chroot`` command is run with ``sudo -n``, unless the current
+    user is already root.
+    """
+
+    def __init__(self, path, shell='/bin/sh -c'):
+        super(ChrootTransport, self).__init__(shell)
+        self.path = path
+        self.host_string = 'chroot:%s' % path
+
+    def argv(self, command, sudo=False, user=None, group=None):
+        argv = ['chroot']
+        if sudo and (user or group):
+            argv.append('--userspec=%s:%s' % (user or 'root', group or ''))
+        argv += [self.path] + self.shell_argv() + [command]
+        if os.geteuid() != 0:
+            argv = _sudo_argv() + argv
+        return argv
+
+
+class ContainerTransport(ShellTransport):
+    """
+    Run commands inside a running container, using ``docker exec``
+    (or the equivalent command of another *engine*, such as ``podman``).
+
+    Commands run with ``run()`` use the default user of the container,
+    and commands run with ``sudo()`` are run as root (or as the
+    requested user).
+    """
+
+    def __init__(self, name, engine='docker', shell='/bin/sh -c'):
+        super(ContainerTransport, self).__init__(shell)
+        self.name = name
+        self.engine = engine
+        self.host_string = '%s:%s' % (engine, name)
+
+    def argv(self, command, sudo=False, user=None, group=None):
+        argv = [self.engine, 'exec', '-i']
+        if sudo:
+            spec = user or 'root'
+            if group:
+                spec += ':%s' % group
+            argv += ['-u', spec]
+        return argv + [self.name] + self.shell_argv() + [command]
+
+
+class ShellSFTP(fabric.sftp.SFTP):
+    """
+    Fabric's SFTP helper, using a :py:class:`ShellTransport` instead
+    of an SFTP session.
+    """
+
+    def __init__(self, transport):
+        self.ftp = _ShellClient(transport)
+
+
+class _Attributes(object):
+
+    def __init__(self, st_mode):
+        self.st_mode = st_mode
+
+
+class _ShellClient(object):
+    """
+    Subset of Paramiko's ``SFTPClient`` used by Fabric, implemented
+    with shell commands
+    """
+
+    # Print the numeric base and the mode (GNU stat gives an
+    # hexadecimal value, BSD stat an octal one)
+    STAT = (
+        "if stat -c %%f / >/dev/null 2>&1; "
+        "then m=$(stat %(follow)s-c %%f %(path)s) && echo 16 $m; "
+        "else m=$(stat %(follow)s-f %%p %(path)s) && echo 8 $m; fi"
+    )
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def _run(self, command, stdin=None):
+        stdout, stderr, status = self.transport.execute(command, stdin=stdin)
+        if status != 0:
+            raise IOError(stderr.strip() or 'command failed: %s' % command)
+        return stdout
+
+    def normalize(self, path):
+        return self._run('cd %s && pwd' % quote(path)).strip()
+
+    def getcwd(self):
+        return None
+
+    def _stat(self, path, follow):
+        res = self._run(self.STAT % {
+            'follow': follow and '-L ' or '',
+            'path': quote(path),
+        })
+        try:
+            base, value = res.split()
+            return _Attributes(int(value, int(base)))
+        except ValueError:
+            raise IOError('unexpected stat output: %s' % res)
+
+    def stat(self, path):
+        return self._stat(path, True)
+
+    def lstat(self, path):
+        return self._stat(path, False)
+
+    def listdir(self, path):
+        return self._run('ls -1A %s' % quote(path)).splitlines()
+
+    def mkdir(self, path):
+        self._run('mkdir %s' % quote(path))
+
+    def chmod(self, path, mode):
+        self._run('chmod %o %s' % (mode, quote(path)))
+
+    def putfo(self, fl, remotepath):
+        self._run('cat > %s' % quote(remotepath), stdin=fl.read())
+        return self.stat(remotepath)
+
+    def put(self, localpath, remotepath):
+        with open(localpath, 'rb') as fl:
+            return self.putfo(fl, remotepath)
+
+    def getfo(self, remotepath, fl):
+        fl.write(self._run('cat %s' % quote(remotepath)))
+
+    def get(self, remotepath, localpath):
+        with open(localpath, 'wb') as fl:
+            self.getfo(remotepath, fl)
+
+    def close(self):
+        pass
+
+
+def _sudo_argv(user=None, group=None):
+    argv = ['sudo', '-n', '-H']
+    if user:
+        argv += ['-u', user]
+    if group:
+        argv += ['-g', group]
+    return argv
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+_SSH = SSHTransport()
+
+
+def current():
+    """
+    Get the active transport (``env.fabtools_transport``, or the SSH
+    transport by default).
+    """
+    from fabric.state import env
+
+    return env.get('fabtools_transport') or _SSH
+
+
+@contextmanager
+def use(transport):
+    """
+    Context manager to use another *transport* in the block.
+
+    If the transport has a ``host_string`` attribute, it is used as the
+    current host string in the block (so that the per-host caches of
+    fabtools are kept separate).
+    """
+    _install()
+    overrides = {'fabtools_transport': transport}
+    if transport.host_string is not None:
+        overrides['host_string'] = transport.host_string
+    with settings(**overrides):
+        yield transport
+
+
+def local(shell=None):
+    """
+    Context manager to run commands on the controlling machine.
+    """
+    return use(LocalTransport(shell))
+
+
+def chroot(path, shell='/bin/sh -c'):
+    """
+    Context manager to run commands inside a chroot.
+    """
+    return use(ChrootTransport(path, shell))
+
+
+def container(name, engine='docker', shell='/bin/sh -c'):
+    """
+    Context manager to run commands inside a running container.
+    """
+    return use(ContainerTransport(name, engine, shell))
+
+
+def _install():
+    """
+    Route Fabric's low-level functions through the active transport
+    (only once)
+    """
+    if _ORIGINALS:
+        return
+    _ORIGINALS['run_command'] = fabric.operations._run_command
+    _ORIGINALS['SFTP'] = fabric.operations.SFTP
+    fabric.operations._run_command = _run_command
+    fabric.operations.SFTP = _sftp
+
+
+def _run_command(command, *args, **kwargs):
+    kwargs.update(zip(_RUN_COMMAND_ARGS, args))
+    return current().run_command(command, **kwargs)
+
+
+def _sftp(host_string):
+    return current().sftp(host_string)
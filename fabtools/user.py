@@ -14,6 +14,8 @@ from fabtools.group import (
     exists as _group_exists,
     create as _group_create,
 )
+from fabtools import agent
+from fabtools.checks import check
 from fabtools.files import uncommented_lines
 from fabtools.utils import run_as_root
 
@@ -22,8 +24,10 @@ def exists(name):
     """
     Check if a user exists.
     """
-    with settings(hide('running', 'stdout', 'warnings'), warn_only=True):
-        return run('getent passwd %(name)s' % locals()).succeeded
+    entry = agent.query('user', name=name)
+    if entry is not None:
+        return entry['exists']
+    return check('getent passwd %(name)s' % locals())
 
 
 _SALT_CHARS = string.ascii_letters + string.digits + './'
@@ -187,6 +191,9 @@ def home_directory(name):
         home = fabtools.user.home_directory('alice')
 
     """
+    entry = agent.query('user', name=name)
+    if entry is not None and entry['exists']:
+        return entry['home']
     with settings(hide('running', 'stdout')):
         return run('echo ~' + name)
 
@@ -4,10 +4,13 @@ Utilities
 """
 
 from pipes import quote
+from types import ModuleType
+import importlib
 import os
 import posixpath
+import sys
 
-from fabric.api import hide, run, sudo
+from fabric.api import hide, run, settings, sudo
 
 
 def run_as_root(command, *args, **kwargs):
@@ -26,6 +29,230 @@ def run_as_root(command, *args, **kwargs):
     return func(command, *args, **kwargs)
 
 
+def host_key():
+    """
+    Get the key identifying the current remote system.
+
+    This is used to index the per-host caches kept by fabtools (system
+    facts, installed packages...). Commands run inside an OpenVZ guest
+    container get a key distinct from the host's.
+    """
+    from fabric.state import env
+
+    guest = env.get('fabtools_guest')
+    if guest:
+        return '%s/%s' % (env.host_string, guest)
+    return env.host_string
+
+
+# All the per-host caches (see host_cache)
+_HOST_CACHES = []
+
+
+def host_cache():
+    """
+    Create a dict to cache data about remote hosts, indexed by
+    :py:func:`host_key`.
+
+    When running on several hosts in parallel (see
+    :py:mod:`fabtools.executor`), the entries gathered by the worker
+    processes are merged back into these caches.
+    """
+    cache = {}
+    _HOST_CACHES.append(cache)
+    return cache
+
+
+class PackageSnapshot(object):
+    """
+    Snapshot of the installed packages of each host, for a package
+    manager.
+
+    The packages are listed using a single *query* command (whose output
+    is turned into a dict mapping package names to versions by *parse*),
+    the first time they are needed for a given host. The snapshot is
+    then kept in memory, and the packages installed or removed using
+    :py:meth:`run` are recorded, so that they are known without listing
+    the packages again.
+    """
+
+    def __init__(self, query, parse):
+        self.query = query
+        self.parse = parse
+        self._installed = host_cache()
+        # Packages installed or removed since the snapshot was taken
+        self._changed = host_cache()
+
+    def packages(self, refresh=False):
+        """
+        Get the installed packages of the current host.
+        """
+        key = host_key()
+        if refresh or key in self._changed or key not in self._installed:
+            self._changed.pop(key, None)
+            self._installed[key] = self.load()
+        return self._installed[key]
+
+    def load(self):
+        """
+        List the installed packages of the current host.
+        """
+        with settings(hide('running', 'stdout', 'stderr', 'warnings'),
+                      warn_only=True):
+            res = run(self.query)
+        return self.parse(res)
+
+    def invalidate(self):
+        """
+        Forget the installed packages of the current host.
+        """
+        key = host_key()
+        self._installed.pop(key, None)
+        self._changed.pop(key, None)
+
+    def change(self, pkg_name):
+        """
+        Get the recorded state of a package just installed (``True``) or
+        removed (``False``), or ``None`` if it was not changed.
+        """
+        return self._changed.get(host_key(), {}).get(pkg_name)
+
+    def record(self, packages, installed):
+        """
+        Record the packages just installed or removed on the current host.
+        """
+        key = host_key()
+        if key not in self._installed:
+            return
+        if isinstance(packages, basestring):
+            packages = packages.split()
+        # Other packages may have been installed or removed as dependencies,
+        # so the next query about them will list the packages again
+        changes = self._changed.setdefault(key, {})
+        for pkg_name in packages:
+            changes[pkg_name] = installed
+
+    def is_installed(self, pkg_name):
+        """
+        Check if a package is installed on the current host.
+        """
+        state = self.change(pkg_name)
+        if state is not None:
+            return state
+        return pkg_name in self.packages()
+
+    def run(self, packages, installed, func, *args, **kwargs):
+        """
+        Call *func* to install (or remove) *packages*, and update the
+        snapshot: the packages are recorded if it succeeds, and the
+        snapshot is forgotten if it fails (or aborts), as some packages
+        may have been changed.
+        """
+        try:
+            res = func(*args, **kwargs)
+        except:
+            self.invalidate()
+            raise
+        if res.succeeded:
+            self.record(packages, installed)
+        else:
+            self.invalidate()
+        return res
+
+
+class LazyModule(ModuleType):
+    """
+    Package whose submodules are only imported when they are first
+    accessed as attributes (see :py:func:`lazy_package`).
+    """
+
+    def __init__(self, module, submodules, attributes):
+        ModuleType.__init__(self, module.__name__)
+        self.__dict__.update(module.__dict__)
+        # Keep the original module alive, as Python 2 clears the globals
+        # of a module when it is garbage collected
+        self._original_module = module
+        self._submodules = frozenset(submodules)
+        self._attributes = attributes
+
+    def __getattr__(self, name):
+        if name in self._submodules:
+            return importlib.import_module('%s.%s' % (self.__name__, name))
+        if name in self._attributes:
+            module_name, attr = self._attributes[name]
+            value = importlib.import_module(module_name)
+            if attr is not None:
+                value = getattr(value, attr)
+            setattr(self, name, value)
+            return value
+        raise AttributeError("'module' object has no attribute '%s'" % name)
+
+    def __dir__(self):
+        return sorted(
+            set(self.__dict__) | self._submodules | set(self._attributes)
+        )
+
+
+def lazy_package(name, submodules, attributes=None):
+    """
+    Replace the package *name* in ``sys.modules`` by a
+    :py:class:`LazyModule`, so that importing the package does not
+    import all of its *submodules*.
+
+    *attributes* maps other lazy attribute names to ``(module_name,
+    attribute_name)`` tuples (or to ``(module_name, None)`` for the
+    module itself).
+
+    This is meant to be called at the end of the package's
+    ``__init__.py``::
+
+        from fabtools.utils import lazy_package
+
+        lazy_package(__name__, ['deb', 'rpm'], {
+            'package': ('fabtools.require.deb', 'package'),
+        })
+
+    """
+    module = LazyModule(sys.modules[name], submodules, attributes or {})
+    sys.modules[name] = module
+    return module
+
+
+def to_seconds(var):
+    """
+    Convert a duration to seconds.
+
+    *var* can be either an integer (a value in seconds), or a dictionary
+    whose keys are units (``seconds``, ``minutes``, ``hours``, ``days``,
+    ``weeks``, ``months``) and values are integers.
+    """
+    sec = 0
+    MINUTE = 60
+    HOUR = 60 * MINUTE
+    DAY = 24 * HOUR
+    WEEK = 7 * DAY
+    MONTH = 31 * DAY
+    try:
+        for key, value in var.items():
+            if key in ('second', 'seconds'):
+                sec += value
+            elif key in ('minute', 'minutes'):
+                sec += value * MINUTE
+            elif key in ('hour', 'hours'):
+                sec += value * HOUR
+            elif key in ('day', 'days'):
+                sec += value * DAY
+            elif key in ('week', 'weeks'):
+                sec += value * WEEK
+            elif key in ('month', 'months'):
+                sec += value * MONTH
+            else:
+                raise ValueError("Unknown time unit '%s'" % key)
+        return sec
+    except AttributeError:
+        return var
+
+
 def get_cwd(local=False):
 
     from fabric.api import local as local_run